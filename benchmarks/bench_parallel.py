@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Benchmark how per-protein statistics scale with the number of worker processes.
+
+Runs the exact Mann-Whitney U test and the permutation test of every protein on the
+shared executors of 1, 2, 4, ... workers up to the number of CPUs, checks that every worker
+count gives the same results and reports the speedup over a single worker.
+
+Usage:
+    python benchmarks/bench_parallel.py [path/to/long_format.csv] [--workers 1 2 4 8] [--permutations 1000]
+
+Without a CSV path, a synthetic long-format dataset is generated.
+"""
+
+import argparse
+import os
+
+import pandas as pd
+
+from bench_differential_expression import make_synthetic_data, timed
+from nextgen.analysis import permutation_test
+from nextgen.analysis.parallel import mann_whitney_exact_shard, shared_executor
+
+
+def worker_counts() -> list:
+    counts, n = [], 1
+    while n < (os.cpu_count() or 1):
+        counts.append(n)
+        n *= 2
+    return counts + [os.cpu_count() or 1]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("csv", nargs="?", help="Long-format CSV (default: synthetic data)")
+    parser.add_argument("--workers", type=int, nargs="+", default=worker_counts())
+    parser.add_argument("--permutations", type=int, default=1000)
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.csv) if args.csv else make_synthetic_data(n_proteins=2000, n_runs=60)
+    print(f"{len(df):,} rows, {df['protein_group'].nunique():,} proteins")
+
+    baselines = {}
+    for workers in args.workers:
+        executor = shared_executor(workers)
+        # Start the pool outside the timing, as a long-running server would
+        executor.map(mann_whitney_exact_shard, df.head(1000))
+        runs = {
+            "mann_whitney_exact": timed(executor.map, mann_whitney_exact_shard, df),
+            "permutation_test": timed(permutation_test, df, n_permutations=args.permutations, seed=0,
+                                      stop_exceedances=None, max_workers=workers),
+        }
+        for name, (result, elapsed) in runs.items():
+            if name not in baselines:
+                baselines[name] = result, elapsed
+            else:
+                pd.testing.assert_frame_equal(result, baselines[name][0])
+            print(f"{name:18s} {workers:3d} workers: {elapsed:8.3f}s ({baselines[name][1] / elapsed:.2f}x)")
+    print("Results match across worker counts")
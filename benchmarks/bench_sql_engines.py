@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Benchmark the SQL engines of the DataScientistAgent on the training-set queries.
+
+Runs every question_sql example of the training file on each engine, checks that the
+engines return the same number of rows and reports the time per query.
+
+Usage:
+    python benchmarks/bench_sql_engines.py [--db database/nextgen.db] [--duckdb database/nextgen.duckdb]
+        [--parquet database/parquet] [--train data/train_data_scientist.jsonl] [--repeat 3]
+
+Engines whose data is missing (no DuckDB copy, no Parquet export) are skipped.
+"""
+
+import argparse
+import json
+import os
+import time
+from types import SimpleNamespace
+
+import pandas as pd
+
+from nextgen.vanna.engines import connect_sql_engine
+
+
+def load_queries(path: str) -> list:
+    """question_sql examples of a Vanna training file."""
+    with open(path, 'r') as f:
+        examples = [json.loads(line) for line in f if line.strip()]
+    return [example for example in examples if example.get('type') == 'question_sql']
+
+
+class SQLiteConnector(SimpleNamespace):
+    """Minimal stand-in for a Vanna instance, enough for connect_sql_engine."""
+
+    def connect_to_sqlite(self, path: str) -> None:
+        import sqlite3
+
+        conn = sqlite3.connect(path, check_same_thread=False)
+        self.run_sql = lambda sql: pd.read_sql_query(sql, conn)
+        self.run_sql_is_set = True
+
+
+def make_runner(engine: str, args):
+    vn = SQLiteConnector()
+    sql_path = args.duckdb if engine == 'duckdb' and args.duckdb else args.db
+    connect_sql_engine(vn, engine=engine, sql_path=sql_path, parquet_path=args.parquet)
+    return vn.run_sql
+
+
+def time_query(run_sql, sql: str, repeat: int):
+    """Best wall time of ``repeat`` runs and the row count of the result."""
+    best = float('inf')
+    rows = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        df = run_sql(sql)
+        best = min(best, time.perf_counter() - start)
+        rows = len(df)
+    return best, rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='database/nextgen.db')
+    parser.add_argument('--duckdb', default='database/nextgen.duckdb',
+                        help="DuckDB copy; if missing the SQLite file is attached instead")
+    parser.add_argument('--parquet', default='database/parquet')
+    parser.add_argument('--train', default='data/train_data_scientist.jsonl')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.duckdb):
+        args.duckdb = None
+
+    runners = {}
+    for engine in ('sqlite', 'duckdb', 'parquet'):
+        try:
+            runners[engine] = make_runner(engine, args)
+        except Exception as e:
+            print(f"Skipping engine {engine}: {e}")
+
+    results = []
+    for example in load_queries(args.train):
+        row = {'question': example['question'][:60]}
+        for engine, run_sql in runners.items():
+            try:
+                row[f'{engine}_s'], row[f'{engine}_rows'] = time_query(run_sql, example['sql'], args.repeat)
+            except Exception as e:
+                print(f"{engine} failed on {example['question']!r}: {e}")
+        results.append(row)
+
+    results = pd.DataFrame(results)
+    pd.set_option('display.width', 200)
+    print(results.to_string(index=False))
+
+    timings = [f'{engine}_s' for engine in runners if f'{engine}_s' in results]
+    print("\nTotal time per engine:")
+    print(results[timings].sum().to_string())
+    for engine in runners:
+        if engine != 'sqlite' and f'{engine}_rows' in results and 'sqlite_rows' in results:
+            mismatched = (results[f'{engine}_rows'] != results['sqlite_rows']).sum()
+            print(f"{engine}: {mismatched} queries returned a different number of rows than sqlite")
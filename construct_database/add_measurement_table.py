@@ -1,13 +1,31 @@
 #!/usr/bin/env python3
 """
-Script to read protein_level_Citrullination.csv and add a measurement table
-to the existing SQLite database test.db.
+Script to read protein_level_Citrullination.csv and add the measurement data
+to the existing SQLite database.
+
+Protein groups and runs are stored once in the protein_groups and runs dictionary
+tables; measurement_data references them by integer key. Protein.Group holds
+semicolon-separated accessions, which are split into the protein_group_member mapping
+table while the export is streamed, so every intensity is stored once per protein group.
+
+Two views join the tables back together:
+- measurement has one row per member accession (protein_group is the accession), the
+  layout of the previously pre-expanded CSV, so queries by accession keep working;
+- protein_group_measurement has one row per protein group (protein_group is the full
+  semicolon-separated group).
 """
 
 import sqlite3
 import csv
 import sys
-from typing import List, Dict
+from typing import List, Dict, Tuple
+
+import pandas as pd
+
+from bulk_loader import ThroughputReporter, assign_surrogate_keys, bulk_load_pragmas, read_chunks, to_sql_values
+from add_protein_group_stats import drop_stats_schema, refresh_if_ready
+from optimize_database import MEASUREMENT_INDEXES, analyze_database, create_indexes
+from run_manifest import RunHasher, create_manifest_schema, record_runs
 
 def get_column_names(csv_file: str) -> List[str]:
     """Extract column names from the first line of the CSV file."""
@@ -15,184 +33,221 @@ def get_column_names(csv_file: str) -> List[str]:
         reader = csv.reader(f)
         return next(reader)
 
-def create_measurement_table_schema(columns: List[str]) -> str:
-    """Create the SQL CREATE TABLE statement for measurement table."""
-    # Clean column names - replace spaces and special characters, and convert to lowercase
-    clean_columns = []
-    for col in columns:
-        # Replace problematic characters and convert to lowercase
-        clean_col = col.replace(' ', '_').replace('(', '').replace(')', '').replace('[', '').replace(']', '').replace('-', '_').replace('.', '_').lower()
-        # Remove multiple underscores
-        clean_col = '_'.join(filter(None, clean_col.split('_')))
-        clean_columns.append(clean_col)
-    
+def clean_column_name(col: str) -> str:
+    """Replace spaces and special characters in a column name and convert it to lowercase."""
+    clean_col = col.replace(' ', '_').replace('(', '').replace(')', '').replace('[', '').replace(']', '').replace('-', '_').replace('.', '_').lower()
+    # Remove multiple underscores
+    return '_'.join(filter(None, clean_col.split('_')))
+
+def create_measurement_table_schema(columns: List[str]) -> List[str]:
+    """Create the SQL statements for the dictionary and mapping tables, measurement_data and the views."""
+    clean_columns = [clean_column_name(col) for col in columns]
+
     # Define column types based on the data structure (using lowercase names)
-    sql_columns = []
-    for i, col in enumerate(clean_columns):
+    sql_columns = [
+        '"protein_group_id" INTEGER NOT NULL REFERENCES protein_groups (protein_group_id)',
+        '"run_id" INTEGER NOT NULL REFERENCES runs (run_id)',
+    ]
+    view_columns = []
+    member_view_columns = []
+    for col in clean_columns:
         if col == 'protein_group':
-            sql_columns.append(f'"{col}" TEXT')
-        elif col == 'protein_ids':
-            sql_columns.append(f'"{col}" TEXT')
-        elif col == 'genes':
-            sql_columns.append(f'"{col}" TEXT')
-        elif col == 'citrullination_r':
-            sql_columns.append(f'"{col}" BOOLEAN')
-        elif col == 'run':
-            sql_columns.append(f'"{col}" TEXT')
+            view_columns.append('pg.protein_group')
+            member_view_columns.append('pgm.accession AS protein_group')
+            continue
+        if col == 'run':
+            view_columns.append('r.run')
+            member_view_columns.append('r.run')
+            continue
+        if col == 'citrullination_r':
+            sql_columns.append(f'"{col}" INTEGER NOT NULL CHECK ("{col}" IN (0, 1))')
         elif col == 'intensity':
             sql_columns.append(f'"{col}" REAL')
         else:
             sql_columns.append(f'"{col}" TEXT')
-    
-    return f"CREATE TABLE measurement (\n    {',\n    '.join(sql_columns)}\n)"
-
-def validate_data(csv_file: str) -> bool:
-    """Basic validation of CSV data structure."""
-    print("Validating CSV data structure...")
-    
-    row_count = 0
-    
-    with open(csv_file, 'r', encoding='utf-8') as f:
-        reader = csv.reader(f)
-        headers = next(reader)  # Skip header
-        
-        for row in reader:
-            row_count += 1
-            # Basic validation - ensure row has expected number of columns
-            if len(row) != len(headers):
-                print(f"Warning: Row {row_count} has {len(row)} columns, expected {len(headers)}")
-    
-    print(f"Processed {row_count} rows from CSV")
-    return True
+        view_columns.append(f'm."{col}"')
+        member_view_columns.append(f'm."{col}"')
+
+    column_sql = ',\n    '.join(sql_columns)
+    return [
+        "CREATE TABLE protein_groups (\n    protein_group_id INTEGER PRIMARY KEY,\n    protein_group TEXT NOT NULL UNIQUE\n)",
+        "CREATE TABLE runs (\n    run_id INTEGER PRIMARY KEY,\n    run TEXT NOT NULL UNIQUE\n)",
+        "CREATE TABLE protein_group_member (\n    protein_group_id INTEGER NOT NULL REFERENCES protein_groups (protein_group_id),\n"
+        "    accession TEXT NOT NULL,\n    PRIMARY KEY (protein_group_id, accession)\n) WITHOUT ROWID",
+        f"CREATE TABLE measurement_data (\n    {column_sql}\n)",
+        f"CREATE VIEW protein_group_measurement AS\nSELECT {', '.join(view_columns)}\nFROM measurement_data m\n"
+        "JOIN protein_groups pg ON pg.protein_group_id = m.protein_group_id\n"
+        "JOIN runs r ON r.run_id = m.run_id",
+        f"CREATE VIEW measurement AS\nSELECT {', '.join(member_view_columns)}\nFROM measurement_data m\n"
+        "JOIN protein_group_member pgm ON pgm.protein_group_id = m.protein_group_id\n"
+        "JOIN runs r ON r.run_id = m.run_id",
+    ]
+
+def drop_measurement_schema(cursor: sqlite3.Cursor):
+    """
+    Drop the measurement view (or the table built by older versions of this script), its tables,
+    the protein_group_stats summary and the run manifest of ingest_runs.py, which no longer
+    describe the rebuilt table. The load records the manifest again for the runs it loads.
+    """
+    cursor.execute("SELECT type FROM sqlite_master WHERE name='measurement'")
+    existing = cursor.fetchone()
+    if existing:
+        print(f"{existing[0].capitalize()} 'measurement' already exists. Dropping it...")
+        cursor.execute(f"DROP {existing[0].upper()} measurement")
+    cursor.execute("DROP VIEW IF EXISTS protein_group_measurement")
+    drop_stats_schema(cursor.connection)
+    for table in ['measurement_data', 'protein_group_member', 'protein_groups', 'runs', 'ingested_runs']:
+        cursor.execute(f"DROP TABLE IF EXISTS {table}")
+
+def split_protein_groups(protein_groups: List[Tuple[int, str]]) -> List[Tuple[int, str]]:
+    """
+    Split new protein_groups rows into protein_group_member rows.
+
+    Args:
+        protein_groups: (protein_group_id, protein_group) rows, the group being semicolon-separated accessions
+
+    Returns:
+        List of (protein_group_id, accession) rows
+    """
+    members = []
+    for protein_group_id, protein_group in protein_groups:
+        for accession in dict.fromkeys(filter(None, (part.strip() for part in protein_group.split(';')))):
+            members.append((protein_group_id, accession))
+    return members
 
-def add_measurement_table(db_file: str, csv_file: str):
-    """Main function to add the measurement table."""
+def convert_measurement_chunk(chunk: pd.DataFrame, protein_group_ids: Dict[str, int], run_ids: Dict[str, int]):
+    """
+    Convert a chunk of CSV text columns to measurement_data rows.
 
-    
-    
+    Returns:
+        Tuple of (measurement_data DataFrame, new protein_groups rows, new runs rows)
+    """
+    data = pd.DataFrame(index=chunk.index)
+    data['protein_group_id'], new_protein_groups = assign_surrogate_keys(chunk['protein_group'], protein_group_ids)
+    data['run_id'], new_runs = assign_surrogate_keys(chunk['run'], run_ids)
+    for col in chunk.columns:
+        if col in ('protein_group', 'run'):
+            continue
+        if col == 'citrullination_r':
+            # Convert TRUE/FALSE to 0/1
+            data[col] = chunk[col].str.upper().eq('TRUE').astype(int)
+        elif col == 'intensity':
+            # Convert to float, unparseable values become NULL
+            data[col] = pd.to_numeric(chunk[col], errors='coerce')
+        else:
+            data[col] = chunk[col]
+    return data, new_protein_groups, new_runs
+
+def add_measurement_table(db_file: str, csv_file: str, bulk: bool = True):
+    """
+    Main function to add the measurement table.
+
+    Args:
+        db_file: Path to the SQLite database file
+        csv_file: Path to the measurement CSV export
+        bulk: Load with an in-memory journal and synchronous writes disabled (see bulk_load_pragmas)
+    """
     print("Reading column names from CSV file...")
     columns = get_column_names(csv_file)
     print(f"Found {len(columns)} columns: {columns}")
-    
-    # Create database schema
-    create_table_sql = create_measurement_table_schema(columns)
-    print(f"CREATE TABLE SQL:\n{create_table_sql}")
-    
+
     # Clean column names for insertion
-    clean_columns = []
-    for col in columns:
-        clean_col = col.replace(' ', '_').replace('(', '').replace(')', '').replace('[', '').replace(']', '').replace('-', '_').replace('.', '_').lower()
-        clean_col = '_'.join(filter(None, clean_col.split('_')))
-        clean_columns.append(clean_col)
-    
+    clean_columns = [clean_column_name(col) for col in columns]
+    if 'protein_group' not in clean_columns or 'run' not in clean_columns:
+        print("Error: CSV file must contain Protein.Group and Run columns")
+        return False
+    value_indexes = [i for i, col in enumerate(clean_columns) if col not in ('protein_group', 'run')]
+
+    # Create database schema
+    schema_statements = create_measurement_table_schema(columns)
+    for statement in schema_statements:
+        print(f"Schema SQL:\n{statement}")
+
     print("Connecting to existing SQLite database...")
-    
+
     # Connect to existing database
     conn = sqlite3.connect(db_file)
     cursor = conn.cursor()
-    
-    # Validate data before proceeding
-    if not validate_data(csv_file):
-        print("\nCSV data validation failed!")
-        print("Please fix the data or modify the validation logic.")
-        conn.close()
-        return False
-    
-    print("CSV data validation passed!")
-    
-    # Check if measurement table already exists
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='measurement'")
-    if cursor.fetchone():
-        print("Table 'measurement' already exists. Dropping it...")
-        cursor.execute("DROP TABLE measurement")
-    
-    # Create table
-    cursor.execute(create_table_sql)
-    print("Table 'measurement' created successfully")
-    
-    # Prepare insert statement
-    placeholders = ','.join(['?' for _ in columns])
-    column_list = ",".join([f'"{col}"' for col in clean_columns])
-    insert_sql = f'INSERT INTO measurement ({column_list}) VALUES ({placeholders})'
+
+    drop_measurement_schema(cursor)
+
+    # Create tables and view
+    for statement in schema_statements:
+        cursor.execute(statement)
+    create_manifest_schema(conn)
+    print("Measurement tables and view created successfully")
+
+    # Prepare insert statements
+    value_columns = ['protein_group_id', 'run_id'] + [clean_columns[i] for i in value_indexes]
+    placeholders = ','.join(['?' for _ in value_columns])
+    column_list = ",".join([f'"{col}"' for col in value_columns])
+    insert_sql = f'INSERT INTO measurement_data ({column_list}) VALUES ({placeholders})'
     print(f"Insert SQL: {insert_sql}")
-    
+
     print("Reading and inserting data...")
-    
-    # Read and insert data
-    inserted_count = 0
+
+    # Surrogate keys assigned as new protein groups and runs are seen
+    protein_group_ids: Dict[str, int] = {}
+    run_ids: Dict[str, int] = {}
+    # Content hash of every run, so that ingest_runs.py skips the runs loaded here
+    hasher = RunHasher()
+
+    # Stream the file once and insert every chunk in a single transaction
+    reporter = ThroughputReporter('measurement_data')
     try:
-        with open(csv_file, 'r', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            next(reader)  # Skip header
-            
-            batch_size = 1000
-            batch = []
-            
-            for row_num, row in enumerate(reader, 1):
-                # Pad row with empty strings if needed
-                while len(row) < len(columns):
-                    row.append('')
-                
-                # Truncate row if too long
-                row = row[:len(columns)]
-                
-                # Convert data types
-                processed_row = []
-                for i, value in enumerate(row):
-                    if clean_columns[i] == 'citrullination_r':
-                        # Convert TRUE/FALSE to boolean
-                        processed_row.append(value.upper() == 'TRUE' if value else False)
-                    elif clean_columns[i] == 'intensity':
-                        # Convert to float
-                        try:
-                            processed_row.append(float(value) if value else None)
-                        except ValueError:
-                            processed_row.append(None)
-                    else:
-                        processed_row.append(value)
-                
-                batch.append(processed_row)
-                
-                if len(batch) >= batch_size:
-                    cursor.executemany(insert_sql, batch)
-                    inserted_count += len(batch)
-                    batch = []
-                    print(f"Inserted {inserted_count} rows...")
-            
-            # Insert remaining rows
-            if batch:
-                cursor.executemany(insert_sql, batch)
-                inserted_count += len(batch)
-                print(f"Inserted {inserted_count} rows...")
-    
+        with bulk_load_pragmas(conn, bulk):
+            for chunk in read_chunks(csv_file, clean_columns):
+                hasher.add(chunk)
+                data, new_protein_groups, new_runs = convert_measurement_chunk(chunk, protein_group_ids, run_ids)
+                cursor.executemany("INSERT INTO protein_groups VALUES (?, ?)", new_protein_groups)
+                cursor.executemany("INSERT INTO protein_group_member VALUES (?, ?)", split_protein_groups(new_protein_groups))
+                cursor.executemany("INSERT INTO runs VALUES (?, ?)", new_runs)
+                cursor.executemany(insert_sql, to_sql_values(data[value_columns]))
+                reporter.add(len(data))
+            record_runs(conn, hasher, csv_file)
+
+            # Commit changes
+            conn.commit()
     except Exception as e:
         print(f"Error reading CSV file: {e}")
+        conn.rollback()
+        conn.close()
         return False
-    
-    # Commit changes
-    conn.commit()
-    
+
+    reporter.finish()
+    print(f"Stored {len(protein_group_ids)} protein groups and {len(run_ids)} runs")
+
+    # Build indexes after the bulk insert and refresh planner statistics
+    with bulk_load_pragmas(conn, bulk):
+        create_indexes(conn, MEASUREMENT_INDEXES)
+    analyze_database(conn)
+    # Summarize per protein and cancer type when the sample table is already loaded
+    refresh_if_ready(conn)
+
     # Verify the data
-    cursor.execute("SELECT COUNT(*) FROM measurement")
+    cursor.execute("SELECT COUNT(*) FROM measurement_data")
+    count = cursor.fetchone()[0]
+    print(f"Total records in measurement_data: {count}")
+    cursor.execute("SELECT COUNT(*) FROM protein_group_member")
     count = cursor.fetchone()[0]
-    print(f"Total records in measurement table: {count}")
-    
+    print(f"Total protein group members: {count}")
+
     # Show a sample record
-    cursor.execute("SELECT protein_group, genes, citrullination_r, run, intensity FROM measurement LIMIT 1")
+    cursor.execute("SELECT * FROM measurement LIMIT 1")
     sample = cursor.fetchone()
     if sample:
         print(f"Sample record: {sample}")
-    
+
     # Show table schema
-    cursor.execute("PRAGMA table_info(measurement)")
+    cursor.execute("PRAGMA table_info(measurement_data)")
     schema = cursor.fetchall()
     print("Table schema:")
     for col in schema:
         print(f"  {col}")
-    
+
     conn.close()
     print(f"Measurement table added to database '{db_file}' successfully!")
     return True
 
 if __name__ == "__main__":
-    add_measurement_table('database/nextgen.db', 'data/protein_level_Citrullination_expanded.csv') 
\ No newline at end of file
+    add_measurement_table('database/nextgen.db', 'data/protein_level_Citrullination.csv')
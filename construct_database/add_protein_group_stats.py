@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Script to build the protein_group_stats summary table of the nextgen database.
+
+Most questions reduce to the count, mean and variance of the intensity of every protein
+in every cancer type. protein_group_stats stores the additive sufficient statistics per
+(protein_group, cancer_type), with protein_group the member accession as in the
+measurement view:
+
+- n_runs: runs with a measured intensity, n: measured intensities;
+- sum_intensity, sum_sq_intensity: sum and sum of squares of the intensity;
+- n_log, sum_log2_intensity, sum_sq_log2_intensity: the same for log2 of the positive
+  intensities.
+
+cancer_type_runs holds the number of measured runs per cancer type, and the
+protein_group_summary view turns both into means, variances and missingness.
+
+Because every column is a sum over runs, ingest_runs.py keeps the table up to date by
+subtracting the contribution of the runs it replaces and adding that of the new rows
+(see update_run_stats). The table scripts build it once both the measurement and the
+sample tables exist; this script rebuilds it from scratch.
+
+Usage:
+    python construct_database/add_protein_group_stats.py [--db database/nextgen.db]
+"""
+
+import argparse
+import math
+import sqlite3
+import sys
+import time
+from typing import Iterable, Optional
+
+from optimize_database import table_exists
+
+STATS_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS protein_group_stats (
+    protein_group TEXT NOT NULL,
+    cancer_type TEXT NOT NULL,
+    n_runs INTEGER NOT NULL,
+    n INTEGER NOT NULL,
+    sum_intensity REAL NOT NULL,
+    sum_sq_intensity REAL NOT NULL,
+    n_log INTEGER NOT NULL,
+    sum_log2_intensity REAL NOT NULL,
+    sum_sq_log2_intensity REAL NOT NULL,
+    PRIMARY KEY (protein_group, cancer_type)
+) WITHOUT ROWID""",
+    """CREATE TABLE IF NOT EXISTS cancer_type_runs (
+    cancer_type TEXT PRIMARY KEY,
+    n_runs INTEGER NOT NULL
+)""",
+    """CREATE VIEW IF NOT EXISTS protein_group_summary AS
+SELECT st.protein_group, st.cancer_type, st.n AS n_measurements,
+    st.sum_intensity / st.n AS mean_intensity,
+    (st.sum_sq_intensity - st.sum_intensity * st.sum_intensity / st.n) / (st.n - 1) AS var_intensity,
+    st.sum_log2_intensity / st.n_log AS mean_log2_intensity,
+    (st.sum_sq_log2_intensity - st.sum_log2_intensity * st.sum_log2_intensity / st.n_log) / (st.n_log - 1) AS var_log2_intensity,
+    ct.n_runs - st.n_runs AS missing_runs,
+    1.0 * (ct.n_runs - st.n_runs) / ct.n_runs AS missing_fraction
+FROM protein_group_stats st
+JOIN cancer_type_runs ct ON ct.cancer_type = st.cancer_type""",
+]
+
+# Sufficient statistics of the selected runs, multiplied by :sign (1 to add, -1 to remove)
+_RUN_FILTER = "m.run_id IN (SELECT run_id FROM temp.stats_runs)"
+_PROTEIN_STATS_SQL = """INSERT INTO protein_group_stats
+SELECT pgm.accession, s.cancer_type,
+    :sign * COUNT(DISTINCT m.run_id), :sign * COUNT(*),
+    :sign * TOTAL(m.intensity), :sign * TOTAL(m.intensity * m.intensity),
+    :sign * SUM(m.intensity > 0),
+    :sign * TOTAL(CASE WHEN m.intensity > 0 THEN log2(m.intensity) END),
+    :sign * TOTAL(CASE WHEN m.intensity > 0 THEN log2(m.intensity) * log2(m.intensity) END)
+FROM measurement_data m
+JOIN protein_group_member pgm ON pgm.protein_group_id = m.protein_group_id
+JOIN runs r ON r.run_id = m.run_id
+JOIN sample s ON s.run = r.run
+WHERE m.intensity IS NOT NULL AND s.cancer_type IS NOT NULL AND {run_filter}
+GROUP BY pgm.accession, s.cancer_type
+ON CONFLICT (protein_group, cancer_type) DO UPDATE SET
+    n_runs = n_runs + excluded.n_runs, n = n + excluded.n,
+    sum_intensity = sum_intensity + excluded.sum_intensity,
+    sum_sq_intensity = sum_sq_intensity + excluded.sum_sq_intensity,
+    n_log = n_log + excluded.n_log,
+    sum_log2_intensity = sum_log2_intensity + excluded.sum_log2_intensity,
+    sum_sq_log2_intensity = sum_sq_log2_intensity + excluded.sum_sq_log2_intensity"""
+_CANCER_TYPE_RUNS_SQL = """INSERT INTO cancer_type_runs
+SELECT s.cancer_type, :sign * COUNT(DISTINCT m.run_id)
+FROM measurement_data m
+JOIN runs r ON r.run_id = m.run_id
+JOIN sample s ON s.run = r.run
+WHERE s.cancer_type IS NOT NULL AND {run_filter}
+GROUP BY s.cancer_type
+ON CONFLICT (cancer_type) DO UPDATE SET n_runs = n_runs + excluded.n_runs"""
+
+
+def ensure_log2(conn: sqlite3.Connection) -> None:
+    """Register a log2 SQL function when SQLite was built without its math functions."""
+    try:
+        conn.execute("SELECT log2(2.0)")
+    except sqlite3.OperationalError:
+        conn.create_function("log2", 1, lambda x: math.log2(x) if x is not None and x > 0 else None,
+                             deterministic=True)
+
+
+def stats_tables_exist(conn: sqlite3.Connection) -> bool:
+    return table_exists(conn, 'protein_group_stats') and table_exists(conn, 'cancer_type_runs')
+
+
+def drop_stats_schema(conn: sqlite3.Connection) -> None:
+    conn.execute("DROP VIEW IF EXISTS protein_group_summary")
+    conn.execute("DROP TABLE IF EXISTS protein_group_stats")
+    conn.execute("DROP TABLE IF EXISTS cancer_type_runs")
+
+
+def _apply_stats(conn: sqlite3.Connection, sign: int, run_filter: str) -> None:
+    ensure_log2(conn)
+    conn.execute(_PROTEIN_STATS_SQL.format(run_filter=run_filter), {'sign': sign})
+    conn.execute(_CANCER_TYPE_RUNS_SQL.format(run_filter=run_filter), {'sign': sign})
+
+
+def update_run_stats(conn: sqlite3.Connection, run_ids: Iterable[int], sign: int) -> None:
+    """
+    Add (sign=1) or remove (sign=-1) the contribution of some runs to the summary tables.
+
+    Call with -1 before the measurement rows or the cancer type of runs change and with
+    1 after. Does nothing when the summary tables have not been built.
+    """
+    run_ids = list(run_ids)
+    if not run_ids or not stats_tables_exist(conn):
+        return
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS stats_runs (run_id INTEGER PRIMARY KEY)")
+    conn.execute("DELETE FROM temp.stats_runs")
+    conn.executemany("INSERT OR IGNORE INTO temp.stats_runs VALUES (?)", [(run_id,) for run_id in run_ids])
+    _apply_stats(conn, sign, _RUN_FILTER)
+    if sign < 0:
+        conn.execute("DELETE FROM protein_group_stats WHERE n_runs <= 0")
+        conn.execute("DELETE FROM cancer_type_runs WHERE n_runs <= 0")
+
+
+def build_protein_group_stats(conn: sqlite3.Connection) -> int:
+    """
+    Rebuild the summary tables from all measurement and sample rows.
+
+    Returns:
+        Number of (protein_group, cancer_type) rows
+    """
+    print("Building protein_group_stats...")
+    start = time.perf_counter()
+    drop_stats_schema(conn)
+    for statement in STATS_SCHEMA:
+        conn.execute(statement)
+    _apply_stats(conn, 1, "1")
+    conn.commit()
+    count = conn.execute("SELECT COUNT(*) FROM protein_group_stats").fetchone()[0]
+    print(f"Stored {count} protein_group_stats rows in {time.perf_counter() - start:.1f}s")
+    return count
+
+
+def add_protein_group_stats(db_file: str) -> bool:
+    """
+    Main function to (re)build the summary tables.
+
+    Args:
+        db_file: Path to the SQLite database file
+
+    Returns:
+        True if the tables were built, False on error
+    """
+    conn = sqlite3.connect(db_file)
+    try:
+        for table in ('measurement_data', 'protein_group_member', 'sample'):
+            if not table_exists(conn, table):
+                print(f"Error: the database has no {table} table; build the measurement and sample tables first")
+                return False
+        build_protein_group_stats(conn)
+    except Exception as e:
+        print(f"Error building protein_group_stats: {e}")
+        conn.rollback()
+        return False
+    finally:
+        conn.close()
+    return True
+
+
+def refresh_if_ready(conn: sqlite3.Connection) -> Optional[int]:
+    """Rebuild the summary tables if the measurement and sample tables both exist."""
+    if all(table_exists(conn, table) for table in ('measurement_data', 'protein_group_member', 'sample')):
+        return build_protein_group_stats(conn)
+    return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the protein_group_stats summary table")
+    parser.add_argument('--db', default='database/nextgen.db', help="SQLite database file")
+    args = parser.parse_args()
+    sys.exit(0 if add_protein_group_stats(args.db) else 1)
@@ -9,6 +9,9 @@ import csv
 from typing import List
 from pathlib import Path
 
+from bulk_loader import ThroughputReporter, bulk_load_pragmas, read_chunks
+from optimize_database import analyze_database
+
 def get_column_names(tsv_file: str) -> List[str]:
     """Extract column names from the first line of the TSV file."""
     with open(tsv_file, 'r', encoding='utf-8') as f:
@@ -34,15 +37,17 @@ def create_database_schema(columns: List[str]) -> str:
         else:
             sql_columns.append(f'"{col}" TEXT')
     
-    return f"CREATE TABLE proteins (\n    {',\n    '.join(sql_columns)}\n)"
+    column_sql = ',\n    '.join(sql_columns)
+    return f"CREATE TABLE proteins (\n    {column_sql}\n)"
 
-def create_proteins_table(db_file: str, tsv_file: str) -> bool:
+def create_proteins_table(db_file: str, tsv_file: str, bulk: bool = True) -> bool:
     """
     Create and populate the proteins table in the database.
     
     Args:
         db_file (str): Path to the SQLite database file
         tsv_file (str): Path to the TSV file containing protein data
+        bulk (bool): Load with an in-memory journal and synchronous writes disabled (see bulk_load_pragmas)
         
     Returns:
         bool: True if successful, False otherwise
@@ -91,39 +96,19 @@ def create_proteins_table(db_file: str, tsv_file: str) -> bool:
         
         print("Reading and inserting data...")
         
-        # Read and insert data
-        inserted_count = 0
-        with open(tsv_file, 'r', encoding='utf-8') as f:
-            reader = csv.reader(f, delimiter='\t')
-            next(reader)  # Skip header
-            
-            batch_size = 1000
-            batch = []
-            
-            for row_num, row in enumerate(reader, 1):
-                # Pad row with empty strings if needed
-                while len(row) < len(columns):
-                    row.append('')
-                
-                # Truncate row if too long
-                row = row[:len(columns)]
-                
-                batch.append(row)
-                
-                if len(batch) >= batch_size:
-                    cursor.executemany(insert_sql, batch)
-                    inserted_count += len(batch)
-                    batch = []
-                    print(f"Inserted {inserted_count} rows...")
-            
-            # Insert remaining rows
-            if batch:
-                cursor.executemany(insert_sql, batch)
-                inserted_count += len(batch)
-                print(f"Inserted {inserted_count} rows...")
-        
-        # Commit changes
-        conn.commit()
+        # Stream the file once and insert every chunk in a single transaction
+        reporter = ThroughputReporter('proteins')
+        with bulk_load_pragmas(conn, bulk):
+            for chunk in read_chunks(tsv_file, clean_columns, sep='\t'):
+                cursor.executemany(insert_sql, chunk.itertuples(index=False, name=None))
+                reporter.add(len(chunk))
+
+            # Commit changes
+            conn.commit()
+        reporter.finish()
+
+        # Refresh planner statistics
+        analyze_database(conn)
         
         # Verify the data
         cursor.execute("SELECT COUNT(*) FROM proteins")
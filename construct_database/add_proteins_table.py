@@ -9,6 +9,8 @@ import csv
 import sys
 from typing import List, Dict
 
+from bulk_loader import ThroughputReporter, bulk_load_pragmas, read_chunks
+
 def get_column_names(tsv_file: str) -> List[str]:
     """Extract column names from the first line of the TSV file."""
     with open(tsv_file, 'r', encoding='utf-8') as f:
@@ -34,9 +36,10 @@ def create_database_schema(columns: List[str]) -> str:
         else:
             sql_columns.append(f'"{col}" TEXT')
     
-    return f"CREATE TABLE proteins (\n    {',\n    '.join(sql_columns)}\n)"
+    column_sql = ',\n    '.join(sql_columns)
+    return f"CREATE TABLE proteins (\n    {column_sql}\n)"
 
-def create_proteins_database():
+def create_proteins_database(bulk: bool = True):
     """Main function to create the database."""
     tsv_file = "human_canonical_proteins.tsv"
     db_file = "test.db"
@@ -75,44 +78,20 @@ def create_proteins_database():
     
     print("Reading and inserting data...")
     
-    # Read and insert data
-    inserted_count = 0
+    # Stream the file once and insert every chunk in a single transaction
+    reporter = ThroughputReporter('proteins')
     try:
-        with open(tsv_file, 'r', encoding='utf-8') as f:
-            reader = csv.reader(f, delimiter='\t')
-            next(reader)  # Skip header
-            
-            batch_size = 1000
-            batch = []
-            
-            for row_num, row in enumerate(reader, 1):
-                # Pad row with empty strings if needed
-                while len(row) < len(columns):
-                    row.append('')
-                
-                # Truncate row if too long
-                row = row[:len(columns)]
-                
-                batch.append(row)
-                
-                if len(batch) >= batch_size:
-                    cursor.executemany(insert_sql, batch)
-                    inserted_count += len(batch)
-                    batch = []
-                    print(f"Inserted {inserted_count} rows...")
-            
-            # Insert remaining rows
-            if batch:
-                cursor.executemany(insert_sql, batch)
-                inserted_count += len(batch)
-                print(f"Inserted {inserted_count} rows...")
-    
+        with bulk_load_pragmas(conn, bulk):
+            for chunk in read_chunks(tsv_file, clean_columns, sep='\t'):
+                cursor.executemany(insert_sql, chunk.itertuples(index=False, name=None))
+                reporter.add(len(chunk))
+
+            # Commit changes
+            conn.commit()
     except Exception as e:
         print(f"Error reading TSV file: {e}")
         return False
-    
-    # Commit changes
-    conn.commit()
+    reporter.finish()
     
     # Verify the data
     cursor.execute("SELECT COUNT(*) FROM proteins")
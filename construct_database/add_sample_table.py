@@ -9,22 +9,28 @@ import csv
 import sys
 from typing import List, Dict
 
+import pandas as pd
+
+from bulk_loader import ThroughputReporter, bulk_load_pragmas, read_chunks, to_sql_values
+from add_protein_group_stats import refresh_if_ready
+from optimize_database import SAMPLE_INDEXES, analyze_database, create_indexes
+
 def get_column_names(csv_file: str) -> List[str]:
     """Extract column names from the first line of the CSV file."""
     with open(csv_file, 'r', encoding='utf-8') as f:
         reader = csv.reader(f)
         return next(reader)
 
+def clean_column_name(col: str) -> str:
+    """Replace spaces and special characters in a column name and convert it to lowercase."""
+    clean_col = col.replace(' ', '_').replace('(', '').replace(')', '').replace('[', '').replace(']', '').replace('-', '_').replace('.', '_').replace(';', '_').lower()
+    # Remove multiple underscores
+    return '_'.join(filter(None, clean_col.split('_')))
+
 def create_sample_table_schema(columns: List[str]) -> str:
     """Create the SQL CREATE TABLE statement for sample table."""
     # Clean column names - replace spaces and special characters, and convert to lowercase
-    clean_columns = []
-    for col in columns:
-        # Replace problematic characters and convert to lowercase
-        clean_col = col.replace(' ', '_').replace('(', '').replace(')', '').replace('[', '').replace(']', '').replace('-', '_').replace('.', '_').replace(';', '_').lower()
-        # Remove multiple underscores
-        clean_col = '_'.join(filter(None, clean_col.split('_')))
-        clean_columns.append(clean_col)
+    clean_columns = [clean_column_name(col) for col in columns]
     
     # Define column types based on the data structure (using lowercase names)
     sql_columns = []
@@ -42,10 +48,37 @@ def create_sample_table_schema(columns: List[str]) -> str:
             # All other columns as TEXT
             sql_columns.append(f'"{col}" TEXT')
     
-    return f"CREATE TABLE sample (\n    {',\n    '.join(sql_columns)}\n)"
+    column_sql = ',\n    '.join(sql_columns)
+    return f"CREATE TABLE sample (\n    {column_sql}\n)"
+
+def convert_sample_chunk(chunk: pd.DataFrame) -> pd.DataFrame:
+    """Convert a chunk of CSV text columns to the sample table column types."""
+    data = pd.DataFrame(index=chunk.index)
+    for col in chunk.columns:
+        values = chunk[col]
+        if col in ['is_case', 'check']:
+            # Convert to boolean - handle various formats
+            upper = values.str.upper()
+            data[col] = upper.map({'TRUE': True, '1': True, 'FALSE': False, '0': False}).astype(object)
+        elif col in ['sex_1_male_0_female', 'age']:
+            # Convert to integer
+            data[col] = pd.to_numeric(values.where(~values.isin(['', 'NA', '-'])), errors='coerce').apply(
+                lambda value: None if pd.isna(value) else int(value)
+            ).astype(object)
+        else:
+            # Keep as text, but handle NA/NULL values
+            data[col] = values.where(~values.isin(['', 'NA']), None)
+    return data
 
-def add_sample_table(db_file: str, csv_file: str):
-    """Main function to add the sample table."""
+def add_sample_table(db_file: str, csv_file: str, bulk: bool = True):
+    """
+    Main function to add the sample table.
+
+    Args:
+        db_file: Path to the SQLite database file
+        csv_file: Path to the sample metadata CSV
+        bulk: Load with an in-memory journal and synchronous writes disabled (see bulk_load_pragmas)
+    """
     
     print("Reading column names from CSV file...")
     columns = get_column_names(csv_file)
@@ -56,11 +89,7 @@ def add_sample_table(db_file: str, csv_file: str):
     print(f"CREATE TABLE SQL:\n{create_table_sql}")
     
     # Clean column names for insertion
-    clean_columns = []
-    for col in columns:
-        clean_col = col.replace(' ', '_').replace('(', '').replace(')', '').replace('[', '').replace(']', '').replace('-', '_').replace('.', '_').replace(';', '_').lower()
-        clean_col = '_'.join(filter(None, clean_col.split('_')))
-        clean_columns.append(clean_col)
+    clean_columns = [clean_column_name(col) for col in columns]
     
     print("Connecting to existing SQLite database...")
     
@@ -89,65 +118,28 @@ def add_sample_table(db_file: str, csv_file: str):
     
     print("Reading and inserting data...")
     
-    # Read and insert data
-    inserted_count = 0
+    # Stream the file once and insert every chunk in a single transaction
+    reporter = ThroughputReporter('sample')
     try:
-        with open(csv_file, 'r', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            next(reader)  # Skip header
-            
-            batch_size = 1000
-            batch = []
-            
-            for row_num, row in enumerate(reader, 1):
-                # Pad row with empty strings if needed
-                while len(row) < len(columns):
-                    row.append('')
-                
-                # Truncate row if too long
-                row = row[:len(columns)]
-                
-                # Convert data types
-                processed_row = []
-                for i, value in enumerate(row):
-                    if clean_columns[i] in ['is_case', 'check']:
-                        # Convert to boolean - handle various formats
-                        if value.upper() in ['TRUE', '1']:
-                            processed_row.append(True)
-                        elif value.upper() in ['FALSE', '0']:
-                            processed_row.append(False)
-                        else:
-                            processed_row.append(None)
-                    elif clean_columns[i] in ['sex_1_male_0_female', 'age']:
-                        # Convert to integer
-                        try:
-                            processed_row.append(int(float(value)) if value and value != 'NA' and value != '-' else None)
-                        except ValueError:
-                            processed_row.append(None)
-                    else:
-                        # Keep as text, but handle NA/NULL values
-                        processed_row.append(value if value and value != 'NA' else None)
-                
-                batch.append(processed_row)
-                
-                if len(batch) >= batch_size:
-                    cursor.executemany(insert_sql, batch)
-                    inserted_count += len(batch)
-                    batch = []
-                    print(f"Inserted {inserted_count} rows...")
-            
-            # Insert remaining rows
-            if batch:
-                cursor.executemany(insert_sql, batch)
-                inserted_count += len(batch)
-                print(f"Inserted {inserted_count} rows...")
-    
+        with bulk_load_pragmas(conn, bulk):
+            for chunk in read_chunks(csv_file, clean_columns):
+                cursor.executemany(insert_sql, to_sql_values(convert_sample_chunk(chunk)))
+                reporter.add(len(chunk))
+
+            # Commit changes
+            conn.commit()
     except Exception as e:
         print(f"Error reading CSV file: {e}")
+        conn.close()
         return False
-    
-    # Commit changes
-    conn.commit()
+
+    reporter.finish()
+
+    # Build indexes after the bulk insert and refresh planner statistics
+    create_indexes(conn, SAMPLE_INDEXES)
+    analyze_database(conn)
+    # Summarize per protein and cancer type when the measurement table is already loaded
+    refresh_if_ready(conn)
     
     # Verify the data
     cursor.execute("SELECT COUNT(*) FROM sample")
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Helpers shared by the table scripts to bulk load large CSV/TSV exports into SQLite.
+
+Files are streamed once in chunks with pandas, so type conversion happens column-wise
+instead of per cell, and every chunk is inserted inside a single transaction. In bulk
+mode the connection also uses pragmas that trade durability for speed while loading.
+"""
+
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+import pandas as pd
+
+# Rows parsed and inserted per chunk
+CHUNK_SIZE = 100_000
+
+# Page cache used during the load, in KiB (negative values are sizes, not page counts)
+BULK_CACHE_SIZE = -512 * 1024
+
+
+@contextmanager
+def bulk_load_pragmas(conn: sqlite3.Connection, bulk: bool = True):
+    """
+    Tune the connection for a one-off bulk load and restore the previous settings after.
+
+    With ``bulk=True`` the rollback journal is kept in memory instead of a file and SQLite
+    does not wait for data to reach the disk. A failed load still rolls back cleanly, but a
+    crash or power loss during the load can leave a corrupt database that must be rebuilt
+    from the source files. Commit inside the block; uncommitted work is rolled back on exit.
+    """
+    if not bulk:
+        yield
+        return
+
+    journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+    synchronous = conn.execute("PRAGMA synchronous").fetchone()[0]
+    cache_size = conn.execute("PRAGMA cache_size").fetchone()[0]
+    conn.execute("PRAGMA journal_mode = MEMORY")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute(f"PRAGMA cache_size = {BULK_CACHE_SIZE}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    try:
+        yield
+    finally:
+        # The journal mode cannot change inside a transaction; work not committed by the
+        # caller is undone from the in-memory journal
+        if conn.in_transaction:
+            conn.rollback()
+        conn.execute(f"PRAGMA journal_mode = {journal_mode}")
+        conn.execute(f"PRAGMA synchronous = {synchronous}")
+        conn.execute(f"PRAGMA cache_size = {cache_size}")
+
+
+def read_chunks(path: str, columns, sep: str = ',', chunksize: int = CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """
+    Stream a delimited file as string DataFrames with the given column names.
+
+    Empty fields stay empty strings so each table script decides how to convert them.
+    Short rows are padded with empty strings, rows with too many fields are skipped with a
+    warning.
+    """
+    reader = pd.read_csv(
+        path,
+        sep=sep,
+        header=0,
+        names=columns,
+        dtype=str,
+        keep_default_na=False,
+        chunksize=chunksize,
+        on_bad_lines='warn',
+    )
+    for chunk in reader:
+        yield chunk.fillna('')
+
+
+def assign_surrogate_keys(values: pd.Series, keys: dict):
+    """
+    Map text values to integer keys, assigning the next free key to values not seen before.
+
+    Args:
+        values: Text values of one chunk
+        keys: Mapping of already assigned keys, updated in place
+
+    Returns:
+        Tuple of (integer keys for ``values``, list of (key, value) rows for the new values)
+    """
+    new_rows = []
+    for value in pd.unique(values):
+        if value not in keys:
+            keys[value] = len(keys) + 1
+            new_rows.append((keys[value], value))
+    return values.map(keys), new_rows
+
+
+def to_sql_values(df: pd.DataFrame):
+    """Rows of a DataFrame as tuples for executemany, with missing values as None."""
+    return df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+
+
+class ThroughputReporter:
+    """Report the number of inserted rows and the load speed."""
+
+    def __init__(self, table: str, every: int = 500_000):
+        self.table = table
+        self.every = every
+        self.rows = 0
+        self.start = time.perf_counter()
+        self._next_report = every
+
+    def add(self, rows: int) -> None:
+        self.rows += rows
+        if self.rows >= self._next_report:
+            self._next_report += self.every
+            print(f"Inserted {self.rows:,} rows into {self.table} ({self.rate():,.0f} rows/sec)...")
+
+    def rate(self) -> float:
+        elapsed = time.perf_counter() - self.start
+        return self.rows / elapsed if elapsed > 0 else 0.0
+
+    def finish(self) -> None:
+        elapsed = time.perf_counter() - self.start
+        print(f"Loaded {self.rows:,} rows into {self.table} in {elapsed:.1f}s ({self.rate():,.0f} rows/sec)")
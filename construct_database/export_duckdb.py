@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Script to copy the nextgen SQLite database into a DuckDB database file.
+
+Every table is streamed from SQLite as Arrow batches, so the copy does not need DuckDB's
+sqlite extension, and the views are recreated from their SQLite definitions. Point the
+"duckdb" SQL engine of the data scientist agent at the resulting .duckdb file to run
+queries on DuckDB's native columnar storage instead of attaching the SQLite file.
+Rerun this script after rebuilding or ingesting into the SQLite database.
+"""
+
+import os
+import sqlite3
+import time
+
+import pyarrow as pa
+
+from bulk_loader import CHUNK_SIZE
+from export_parquet import iter_batches, table_schema
+
+# Bookkeeping tables of ingest_runs.py that queries never use
+SKIPPED_TABLES = ['ingested_files', 'ingested_runs']
+
+
+def copy_table(conn: sqlite3.Connection, duck, name: str, chunk_size: int = CHUNK_SIZE) -> int:
+    """Copy one SQLite table into DuckDB."""
+    schema = table_schema(conn, name)
+    duck.register('batch', pa.Table.from_batches([], schema))
+    duck.execute(f'CREATE TABLE "{name}" AS SELECT * FROM batch')
+    duck.unregister('batch')
+
+    rows = 0
+    for batch in iter_batches(conn.execute(f'SELECT * FROM "{name}"'), schema, chunk_size):
+        duck.register('batch', batch)
+        duck.execute(f'INSERT INTO "{name}" SELECT * FROM batch')
+        duck.unregister('batch')
+        rows += batch.num_rows
+    print(f"Copied {rows:,} rows of table '{name}'")
+    return rows
+
+
+def export_duckdb(db_file: str, duckdb_file: str = 'database/nextgen.duckdb') -> bool:
+    """
+    Main function to copy the database to DuckDB.
+
+    Args:
+        db_file: Path to the SQLite database file
+        duckdb_file: Output DuckDB file, replaced if it exists
+    """
+    import duckdb
+
+    start = time.perf_counter()
+    conn = sqlite3.connect(f"file:{db_file}?mode=ro", uri=True)
+    if os.path.exists(duckdb_file):
+        print(f"File '{duckdb_file}' already exists. Replacing it...")
+        os.remove(duckdb_file)
+    duck = duckdb.connect(duckdb_file)
+    try:
+        tables = conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+        ).fetchall()
+        for (name,) in tables:
+            if name not in SKIPPED_TABLES:
+                copy_table(conn, duck, name)
+
+        views = conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'view' ORDER BY name").fetchall()
+        for name, sql in views:
+            print(f"Creating view '{name}'")
+            duck.execute(sql)
+        duck.execute("CHECKPOINT")
+    finally:
+        duck.close()
+        conn.close()
+
+    print(f"DuckDB copy written to '{duckdb_file}' in {time.perf_counter() - start:.1f}s")
+    return True
+
+
+if __name__ == "__main__":
+    export_duckdb('database/nextgen.db', 'database/nextgen.duckdb')
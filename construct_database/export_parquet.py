@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Script to export the nextgen SQLite database to a columnar Parquet dataset.
+
+The measurement view is written as a Hive-partitioned dataset keyed by the cancer type of
+each run (measurement/partition_cancer_type=<type>/part-*.parquet), rows sorted by run
+within each partition. The rows are read sorted by partition and written in one pass, so
+every partition gets a few large files. The measurement view of the parquet SQL engine
+exposes the key as partition_cancer_type, so filters on it skip whole partitions; the
+name differs from sample.cancer_type so SQL joining the two tables stays unambiguous. The
+smaller sample and proteins tables are written as single Parquet files next to it.
+
+The dataset is read by the "parquet" SQL engine of the data scientist agent
+(see nextgen.vanna.engines). Rerun this script after rebuilding or ingesting into the
+SQLite database.
+"""
+
+import shutil
+import sqlite3
+import time
+from pathlib import Path
+from typing import List
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from bulk_loader import CHUNK_SIZE
+from optimize_database import table_exists
+
+# Tables exported as single files
+TABLES = ['sample', 'proteins']
+
+# Hive partition key of the measurement dataset
+PARTITION_COLUMN = 'partition_cancer_type'
+
+
+def arrow_type(declared_type: str) -> pa.DataType:
+    """Arrow type for a declared SQLite column type."""
+    declared_type = (declared_type or '').upper()
+    if 'INT' in declared_type or 'BOOL' in declared_type:
+        return pa.int64()
+    if 'REAL' in declared_type or 'FLOA' in declared_type or 'DOUB' in declared_type:
+        return pa.float64()
+    return pa.string()
+
+
+def table_schema(conn: sqlite3.Connection, name: str) -> pa.Schema:
+    """Arrow schema of a SQLite table or view from its declared column types."""
+    columns = conn.execute(f'PRAGMA table_info("{name}")').fetchall()
+    return pa.schema([(col[1], arrow_type(col[2])) for col in columns])
+
+
+def iter_batches(cursor: sqlite3.Cursor, schema: pa.Schema, chunk_size: int = CHUNK_SIZE):
+    """Fetch the rows of an executed query as Arrow record batches."""
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        columns = list(zip(*rows))
+        yield pa.RecordBatch.from_arrays(
+            [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+            schema=schema,
+        )
+
+
+def export_measurement(conn: sqlite3.Connection, out_dir: Path, chunk_size: int = CHUNK_SIZE) -> int:
+    """Write the measurement view partitioned by the cancer type of every run, sorted by run."""
+    schema = table_schema(conn, 'measurement').append(pa.field(PARTITION_COLUMN, pa.string()))
+    cursor = conn.execute(
+        f"SELECT m.*, s.cancer_type AS {PARTITION_COLUMN} FROM measurement m "
+        f"LEFT JOIN sample s ON s.run = m.run ORDER BY {PARTITION_COLUMN}, m.run"
+    )
+
+    rows = 0
+    start = time.perf_counter()
+
+    def counted_batches():
+        nonlocal rows
+        for batch in iter_batches(cursor, schema, chunk_size):
+            yield batch
+            rows += batch.num_rows
+            print(f"Exported {rows:,} measurement rows...")
+
+    ds.write_dataset(
+        pa.RecordBatchReader.from_batches(schema, counted_batches()),
+        out_dir / 'measurement',
+        format='parquet',
+        partitioning=ds.partitioning(pa.schema([(PARTITION_COLUMN, pa.string())]), flavor='hive'),
+        basename_template='part-{i}.parquet',
+        # Keeps the rows in run order; reading from SQLite is the bottleneck anyway
+        use_threads=False,
+    )
+    print(f"Exported {rows:,} measurement rows in {time.perf_counter() - start:.1f}s")
+    return rows
+
+
+def export_table(conn: sqlite3.Connection, name: str, out_dir: Path, chunk_size: int = CHUNK_SIZE) -> int:
+    """Write a table to a single Parquet file."""
+    schema = table_schema(conn, name)
+    cursor = conn.execute(f'SELECT * FROM "{name}"')
+    rows = 0
+    with pq.ParquetWriter(out_dir / f'{name}.parquet', schema) as writer:
+        for batch in iter_batches(cursor, schema, chunk_size):
+            writer.write_batch(batch)
+            rows += batch.num_rows
+    print(f"Exported {rows:,} rows of table '{name}'")
+    return rows
+
+
+def export_parquet(db_file: str, out_dir: str = 'database/parquet', tables: List[str] = TABLES) -> bool:
+    """
+    Main function to export the database to Parquet.
+
+    Args:
+        db_file: Path to the SQLite database file
+        out_dir: Output directory, replaced if it exists
+        tables: Tables exported as single files in addition to the measurement dataset
+    """
+    out_path = Path(out_dir)
+    # The dataset writer pulls the measurement batches from its own thread, one at a time
+    conn = sqlite3.connect(f"file:{db_file}?mode=ro", uri=True, check_same_thread=False)
+    try:
+        if not table_exists(conn, 'measurement') or not table_exists(conn, 'sample'):
+            print("Error: the database must contain the measurement and sample tables")
+            return False
+
+        if out_path.exists():
+            print(f"Directory '{out_dir}' already exists. Replacing it...")
+            shutil.rmtree(out_path)
+        out_path.mkdir(parents=True)
+
+        export_measurement(conn, out_path)
+        for name in tables:
+            if table_exists(conn, name):
+                export_table(conn, name, out_path)
+            else:
+                print(f"Table '{name}' does not exist. Skipping it.")
+    finally:
+        conn.close()
+
+    print(f"Parquet dataset written to '{out_dir}' successfully!")
+    return True
+
+
+if __name__ == "__main__":
+    export_parquet('database/nextgen.db', 'database/parquet')
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Script to incrementally ingest new batches of runs into an existing nextgen database.
+
+Instead of rebuilding the measurement and sample tables, only runs that are new or whose
+rows changed are written:
+
+- every input file is hashed and recorded in the ingested_files manifest, so a file that
+  was already ingested unchanged is skipped without parsing it;
+- every run in a measurement file gets a content hash (an order independent combination
+  of its row hashes) recorded in the ingested_runs manifest. Runs with a new hash have
+  their measurement rows replaced, runs with a known hash are left alone;
+- sample rows are upserted on their run key;
+- the protein_group_stats summary is updated by removing the contribution of the replaced
+  runs (and of runs whose cancer type changed) and adding that of their new rows, or
+  built from scratch if the database does not have it yet.
+
+Indexes are (re)created if missing and planner statistics refreshed at the end. Creates
+the measurement and sample tables if the database does not have them yet.
+
+Usage:
+    python construct_database/ingest_runs.py <measurement.csv> [<sample.csv>] [--db database/nextgen.db]
+"""
+
+import argparse
+import hashlib
+import os
+import sqlite3
+import sys
+import time
+from typing import Dict, List, Optional, Set
+
+from add_measurement_table import (
+    clean_column_name,
+    convert_measurement_chunk,
+    create_measurement_table_schema,
+    get_column_names,
+    split_protein_groups,
+)
+from add_protein_group_stats import refresh_if_ready, stats_tables_exist, update_run_stats
+from add_sample_table import clean_column_name as clean_sample_column_name
+from add_sample_table import convert_sample_chunk, create_sample_table_schema
+from bulk_loader import ThroughputReporter, read_chunks, to_sql_values
+from optimize_database import MEASUREMENT_INDEXES, SAMPLE_INDEXES, create_indexes, table_exists
+from run_manifest import RunHasher, create_manifest_schema, record_runs
+
+# Rows sampled per index by ANALYZE after an ingest; a full ANALYZE rescans every table
+ANALYSIS_LIMIT = 1000
+
+
+def file_sha256(path: str, block_size: int = 1 << 20) -> str:
+    """SHA-256 of a file's contents, read in blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_already_ingested(conn: sqlite3.Connection, path: str, sha256: str) -> bool:
+    """Check the manifest for a file ingested earlier with the same contents."""
+    row = conn.execute("SELECT sha256 FROM ingested_files WHERE path = ?", (os.path.abspath(path),)).fetchone()
+    return row is not None and row[0] == sha256
+
+
+def record_file(conn: sqlite3.Connection, path: str, sha256: str, table_name: str) -> None:
+    """Add or update a file in the manifest."""
+    conn.execute(
+        "INSERT INTO ingested_files (path, sha256, size, table_name, ingested_at) VALUES (?, ?, ?, ?, datetime('now')) "
+        "ON CONFLICT(path) DO UPDATE SET sha256 = excluded.sha256, size = excluded.size, "
+        "table_name = excluded.table_name, ingested_at = excluded.ingested_at",
+        (os.path.abspath(path), sha256, os.path.getsize(path), table_name),
+    )
+
+
+def load_keys(conn: sqlite3.Connection, table: str, key_column: str, value_column: str) -> Dict[str, int]:
+    """Existing surrogate keys of a dictionary table as a value -> key mapping."""
+    rows = conn.execute(f"SELECT {value_column}, {key_column} FROM {table}").fetchall()
+    return dict(rows)
+
+
+def ensure_measurement_schema(conn: sqlite3.Connection, columns: List[str]) -> List[str]:
+    """
+    Create the measurement tables if missing and check the file columns against them.
+
+    Returns:
+        The measurement_data value columns to insert
+    """
+    clean_columns = [clean_column_name(col) for col in columns]
+    if 'protein_group' not in clean_columns or 'run' not in clean_columns:
+        raise ValueError("CSV file must contain Protein.Group and Run columns")
+
+    if not table_exists(conn, 'measurement_data'):
+        print("Table 'measurement_data' does not exist yet. Creating the measurement schema...")
+        for statement in create_measurement_table_schema(columns):
+            conn.execute(statement)
+
+    if not table_exists(conn, 'protein_group_member'):
+        raise ValueError("The database has no protein_group_member table; rebuild it with add_measurement_table.py")
+
+    table_columns = [row[1] for row in conn.execute("PRAGMA table_info(measurement_data)")]
+    value_columns = ['protein_group_id', 'run_id'] + [col for col in clean_columns if col not in ('protein_group', 'run')]
+    unknown = [col for col in value_columns if col not in table_columns]
+    if unknown:
+        raise ValueError(f"Columns {unknown} are not in the measurement_data table; rebuild it with add_measurement_table.py")
+    return value_columns
+
+
+def changed_runs(conn: sqlite3.Connection, run_hashes: Dict[str, str]) -> Set[str]:
+    """Runs whose content hash is not the one recorded in the manifest."""
+    known = dict(conn.execute("SELECT run, content_hash FROM ingested_runs").fetchall())
+    return {run for run, content_hash in run_hashes.items() if known.get(run) != content_hash}
+
+
+def ingest_measurements(conn: sqlite3.Connection, csv_file: str) -> int:
+    """
+    Replace the measurement rows of new or changed runs from a measurement CSV.
+
+    The file is read twice: once to hash every run and once to insert the rows of the runs
+    that changed. Runs that are unchanged cost only the hashing pass.
+
+    Returns:
+        Number of runs written
+    """
+    columns = get_column_names(csv_file)
+    clean_columns = [clean_column_name(col) for col in columns]
+    value_columns = ensure_measurement_schema(conn, columns)
+
+    print(f"Hashing runs in {csv_file}...")
+    hasher = RunHasher()
+    for chunk in read_chunks(csv_file, clean_columns):
+        hasher.add(chunk)
+    run_hashes = hasher.hashes()
+    runs = changed_runs(conn, run_hashes)
+    print(f"Found {len(run_hashes)} runs, {len(runs)} new or changed")
+    if not runs:
+        return 0
+
+    protein_group_ids = load_keys(conn, 'protein_groups', 'protein_group_id', 'protein_group')
+    run_ids = load_keys(conn, 'runs', 'run_id', 'run')
+
+    # Drop the old rows of changed runs, and their share of the summary, before inserting
+    # their new contents
+    existing = [(run_ids[run],) for run in runs if run in run_ids]
+    update_run_stats(conn, [run_id for run_id, in existing], -1)
+    conn.executemany("DELETE FROM measurement_data WHERE run_id = ?", existing)
+    if existing:
+        print(f"Deleted the previous rows of {len(existing)} runs")
+
+    column_list = ",".join([f'"{col}"' for col in value_columns])
+    placeholders = ','.join(['?' for _ in value_columns])
+    insert_sql = f'INSERT INTO measurement_data ({column_list}) VALUES ({placeholders})'
+
+    reporter = ThroughputReporter('measurement_data')
+    for chunk in read_chunks(csv_file, clean_columns):
+        chunk = chunk[chunk['run'].isin(runs)]
+        if chunk.empty:
+            continue
+        data, new_protein_groups, new_runs = convert_measurement_chunk(chunk, protein_group_ids, run_ids)
+        conn.executemany("INSERT INTO protein_groups VALUES (?, ?)", new_protein_groups)
+        conn.executemany("INSERT INTO protein_group_member VALUES (?, ?)", split_protein_groups(new_protein_groups))
+        conn.executemany("INSERT INTO runs VALUES (?, ?)", new_runs)
+        conn.executemany(insert_sql, to_sql_values(data[value_columns]))
+        reporter.add(len(data))
+    reporter.finish()
+    update_run_stats(conn, [run_ids[run] for run in runs], 1)
+
+    record_runs(conn, hasher, csv_file, runs)
+    return len(runs)
+
+
+def ingest_samples(conn: sqlite3.Connection, csv_file: str) -> int:
+    """
+    Upsert sample metadata rows on their run key.
+
+    Returns:
+        Number of rows inserted or updated
+    """
+    columns = get_column_names(csv_file)
+    clean_columns = [clean_sample_column_name(col) for col in columns]
+    if not table_exists(conn, 'sample'):
+        print("Table 'sample' does not exist yet. Creating it...")
+        conn.execute(create_sample_table_schema(columns))
+
+    column_list = ",".join([f'"{col}"' for col in clean_columns])
+    placeholders = ','.join(['?' for _ in clean_columns])
+    updates = ", ".join([f'"{col}" = excluded."{col}"' for col in clean_columns if col != 'run'])
+    # Rows whose values did not change are not rewritten
+    changed = " OR ".join([f'"{col}" IS NOT excluded."{col}"' for col in clean_columns if col != 'run'])
+    upsert_sql = (
+        f'INSERT INTO sample ({column_list}) VALUES ({placeholders}) '
+        f'ON CONFLICT(run) DO UPDATE SET {updates} WHERE {changed}'
+    )
+
+    # Measured runs and their current cancer type, to move the summary statistics of runs
+    # whose cancer type is set or changed
+    measured = {}
+    if stats_tables_exist(conn) and 'cancer_type' in clean_columns:
+        measured = {
+            run: (run_id, cancer_type) for run, run_id, cancer_type in
+            conn.execute("SELECT r.run, r.run_id, s.cancer_type FROM runs r LEFT JOIN sample s ON s.run = r.run")
+        }
+
+    written = 0
+    for chunk in read_chunks(csv_file, clean_columns):
+        data = convert_sample_chunk(chunk)
+        moved = []
+        if measured:
+            moved = [
+                measured[run][0] for run, cancer_type in zip(data['run'], data['cancer_type'])
+                if run in measured and measured[run][1] != cancer_type
+            ]
+        update_run_stats(conn, moved, -1)
+        before = conn.total_changes
+        conn.executemany(upsert_sql, to_sql_values(data))
+        written += conn.total_changes - before
+        update_run_stats(conn, moved, 1)
+    print(f"Inserted or updated {written} sample rows")
+    return written
+
+
+def refresh_statistics(conn: sqlite3.Connection) -> None:
+    """Create missing indexes and refresh planner statistics with a bounded ANALYZE."""
+    if table_exists(conn, 'measurement_data'):
+        create_indexes(conn, MEASUREMENT_INDEXES)
+    if table_exists(conn, 'sample'):
+        create_indexes(conn, SAMPLE_INDEXES)
+    print(f"Running ANALYZE (analysis_limit={ANALYSIS_LIMIT})...")
+    conn.execute(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}")
+    conn.execute("ANALYZE")
+    conn.commit()
+
+
+def ingest_runs(db_file: str, measurement_csv: Optional[str] = None, sample_csv: Optional[str] = None) -> bool:
+    """
+    Main function to ingest a batch of runs.
+
+    Args:
+        db_file: Path to the SQLite database file
+        measurement_csv: Measurement CSV export containing the new runs
+        sample_csv: Sample metadata CSV for the new runs
+
+    Returns:
+        True if the batch was ingested (or had nothing new), False on error
+    """
+    start = time.perf_counter()
+    conn = sqlite3.connect(db_file)
+    conn.execute("PRAGMA foreign_keys = ON")
+    try:
+        create_manifest_schema(conn)
+        conn.commit()
+
+        changed = False
+        for path, table_name, ingest in ((measurement_csv, 'measurement', ingest_measurements),
+                                         (sample_csv, 'sample', ingest_samples)):
+            if path is None:
+                continue
+            sha256 = file_sha256(path)
+            if file_already_ingested(conn, path, sha256):
+                print(f"File '{path}' was already ingested unchanged. Skipping it.")
+                continue
+            # Every file is ingested in one transaction together with its manifest entry
+            written = ingest(conn, path)
+            record_file(conn, path, sha256, table_name)
+            conn.commit()
+            changed = changed or written > 0
+
+        if changed:
+            if not stats_tables_exist(conn):
+                refresh_if_ready(conn)
+            refresh_statistics(conn)
+    except Exception as e:
+        print(f"Error ingesting runs: {e}")
+        conn.rollback()
+        return False
+    finally:
+        conn.close()
+
+    print(f"Ingested batch into '{db_file}' in {time.perf_counter() - start:.1f}s")
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest new or changed runs into the nextgen database")
+    parser.add_argument('measurement_csv', help="Measurement CSV export with the new runs")
+    parser.add_argument('sample_csv', nargs='?', help="Sample metadata CSV for the new runs")
+    parser.add_argument('--db', default='database/nextgen.db', help="SQLite database file")
+    args = parser.parse_args()
+    sys.exit(0 if ingest_runs(args.db, args.measurement_csv, args.sample_csv) else 1)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Script to create the query indexes and refresh the planner statistics of the
+nextgen SQLite database.
+
+The table scripts call these helpers after loading their data; running this script
+directly (re)creates every index that is missing and runs ANALYZE.
+"""
+
+import sqlite3
+from typing import List
+
+# Covering indexes for the joins and filters the data scientist agent generates:
+# measurement rows are looked up by run (joined to sample.run) and by protein group
+MEASUREMENT_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_measurement_data_run "
+    "ON measurement_data (run_id, protein_group_id, intensity)",
+    "CREATE INDEX IF NOT EXISTS idx_measurement_data_protein_group_run "
+    "ON measurement_data (protein_group_id, run_id, intensity)",
+    # Accession lookups through the protein group mapping
+    "CREATE INDEX IF NOT EXISTS idx_protein_group_member_accession "
+    "ON protein_group_member (accession, protein_group_id)",
+]
+
+SAMPLE_INDEXES = [
+    'CREATE INDEX IF NOT EXISTS idx_sample_cancer_type ON sample (cancer_type, run)',
+]
+
+
+def table_exists(conn: sqlite3.Connection, name: str) -> bool:
+    """Check whether a table or view exists in the database."""
+    cursor = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type IN ('table', 'view') AND name = ?", (name,)
+    )
+    return cursor.fetchone() is not None
+
+
+def create_indexes(conn: sqlite3.Connection, statements: List[str]) -> None:
+    """Run CREATE INDEX statements and report each one."""
+    for statement in statements:
+        print(f"Creating index: {statement}")
+        conn.execute(statement)
+    conn.commit()
+
+
+def analyze_database(conn: sqlite3.Connection) -> None:
+    """Refresh the statistics the SQLite query planner uses to pick index plans."""
+    print("Running ANALYZE...")
+    conn.execute("ANALYZE")
+    conn.commit()
+
+
+def optimize_database(db_file: str) -> bool:
+    """Create all missing indexes and run ANALYZE on an existing database."""
+    conn = sqlite3.connect(db_file)
+    try:
+        if table_exists(conn, 'measurement_data'):
+            create_indexes(conn, MEASUREMENT_INDEXES)
+        if table_exists(conn, 'sample'):
+            create_indexes(conn, SAMPLE_INDEXES)
+        analyze_database(conn)
+    finally:
+        conn.close()
+    print(f"Database '{db_file}' optimized successfully!")
+    return True
+
+
+if __name__ == "__main__":
+    optimize_database('database/nextgen.db')
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Manifest of the runs loaded into the measurement tables.
+
+Every run gets a content hash, an order independent combination of its row hashes, so a
+later ingest (ingest_runs.py) can tell which runs of a file are new or changed. The full
+loader (add_measurement_table.py) records the hashes of the runs it loads, which makes
+ingesting the same files right after a rebuild a no-op.
+"""
+
+import hashlib
+import os
+import sqlite3
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+MANIFEST_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS ingested_files (
+    path TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    table_name TEXT NOT NULL,
+    ingested_at TEXT NOT NULL
+)""",
+    """CREATE TABLE IF NOT EXISTS ingested_runs (
+    run TEXT PRIMARY KEY,
+    content_hash TEXT NOT NULL,
+    row_count INTEGER NOT NULL,
+    source_file TEXT NOT NULL,
+    ingested_at TEXT NOT NULL
+)""",
+]
+
+_UINT64_MASK = (1 << 64) - 1
+
+
+class RunHasher:
+    """
+    Accumulate a content hash per run over streamed chunks.
+
+    Each row is hashed with pandas and the row hashes of a run are combined with a
+    wrapping sum and an XOR, so the result does not depend on row order or chunking.
+    Chunks must be the raw text columns from read_chunks, before any type conversion.
+    """
+
+    def __init__(self):
+        self.counts: Dict[str, int] = {}
+        self.sums: Dict[str, int] = {}
+        self.xors: Dict[str, int] = {}
+
+    def add(self, chunk: pd.DataFrame) -> None:
+        row_hashes = pd.util.hash_pandas_object(chunk, index=False).to_numpy()
+        codes, runs = pd.factorize(chunk['run'])
+        order = np.argsort(codes, kind='stable')
+        sorted_codes = codes[order]
+        sorted_hashes = row_hashes[order]
+        starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+        # uint64 addition wraps around, which is what we want here
+        sums = np.add.reduceat(sorted_hashes, starts)
+        xors = np.bitwise_xor.reduceat(sorted_hashes, starts)
+        counts = np.diff(np.r_[starts, len(sorted_codes)])
+        for run, count, total, xor in zip(runs[sorted_codes[starts]], counts, sums, xors):
+            self.counts[run] = self.counts.get(run, 0) + int(count)
+            self.sums[run] = (self.sums.get(run, 0) + int(total)) & _UINT64_MASK
+            self.xors[run] = self.xors.get(run, 0) ^ int(xor)
+
+    def hashes(self) -> Dict[str, str]:
+        """Content hash per run."""
+        return {
+            run: hashlib.sha256(f"{self.counts[run]}:{self.sums[run]:016x}:{self.xors[run]:016x}".encode()).hexdigest()
+            for run in self.counts
+        }
+
+
+def create_manifest_schema(conn: sqlite3.Connection) -> None:
+    """Create the manifest tables if missing."""
+    for statement in MANIFEST_SCHEMA:
+        conn.execute(statement)
+
+
+def record_runs(conn: sqlite3.Connection, hasher: RunHasher, source_file: str,
+                runs: Optional[Iterable[str]] = None) -> None:
+    """
+    Add or update runs in the manifest.
+
+    Args:
+        conn: Database connection
+        hasher: Hasher that has seen every row of the runs
+        source_file: File the runs were loaded from
+        runs: Runs to record; defaults to every run the hasher has seen
+    """
+    run_hashes = hasher.hashes()
+    conn.executemany(
+        "INSERT INTO ingested_runs (run, content_hash, row_count, source_file, ingested_at) "
+        "VALUES (?, ?, ?, ?, datetime('now')) "
+        "ON CONFLICT(run) DO UPDATE SET content_hash = excluded.content_hash, row_count = excluded.row_count, "
+        "source_file = excluded.source_file, ingested_at = excluded.ingested_at",
+        [(run, run_hashes[run], hasher.counts[run], os.path.abspath(source_file))
+         for run in sorted(run_hashes if runs is None else runs)],
+    )
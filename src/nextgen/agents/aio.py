@@ -0,0 +1,36 @@
+"""asyncio helpers for running the blocking parts of the agents off the event loop."""
+
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Iterator, TypeVar
+
+T = TypeVar("T")
+
+
+async def iterate_in_thread(iterator: Iterator[T]) -> AsyncIterator[T]:
+    """
+    Iterate a blocking iterator from a coroutine.
+
+    Every ``next`` runs on the same dedicated worker thread, so iterators holding
+    thread-bound resources such as SQLite connections work, and the event loop keeps
+    serving other sessions while the iterator waits. The iterator runs in a copy of the
+    caller's context, so context variables (such as the session id logged with every
+    record) carry over. Closing the async iterator closes
+    ``iterator`` on that thread.
+    """
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="nextgen-iterate")
+    context = contextvars.copy_context()
+    done = object()
+    try:
+        while True:
+            item = await loop.run_in_executor(executor, context.run, next, iterator, done)
+            if item is done:
+                return
+            yield item
+    finally:
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            await loop.run_in_executor(executor, context.run, close)
+        executor.shutdown(wait=False)
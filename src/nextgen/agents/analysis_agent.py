@@ -2,8 +2,9 @@
 import os
 import re
 from typing import List, Dict
-from openai import OpenAI
 from nextgen.agents.agents import Agent
+from nextgen.openai.registry import get_async_openai_client, get_openai_client
+from nextgen.openai.cache import acached_chat_completion, cached_chat_completion
 import pandas as pd
 import ast
 import re
@@ -18,19 +19,7 @@ class AnalysisAgent(Agent):
         
         # Instantiate the client. Make sure the client points to the self-hosted LLM.
         self.model = model
-        if model == "md_anderson":
-            self.client = OpenAI(
-                api_key="unused",
-                base_url="https://apimd.mdanderson.edu/dig/llm/llama31-70b/v1/",
-                default_headers={"Ocp-Apim-Subscription-Key": os.environ["APIM_SUBSCRIPTION_KEY"]},
-            )
-        elif model == "openai":
-            self.client = OpenAI(
-                api_key=os.environ["OPENAI_API_KEY"],
-                base_url="https://api.openai.com/v1",
-            )
-        else:
-            raise ValueError(f"Invalid model: {model}")
+        self.client = get_openai_client(model)
 
     
     def make_message(self, question: str, sql: str, data) -> str:
@@ -67,7 +56,7 @@ class AnalysisAgent(Agent):
         ]
 
 
-    def analyze(self, question: str, sql: str, df: pd.DataFrame) -> str:
+    def build_messages(self, question: str, sql: str, df: pd.DataFrame):
         # 1. Preprocess the data
         processed_data = self._preprocess_dataframe(df)
         
@@ -83,23 +72,36 @@ class AnalysisAgent(Agent):
         }
         
         # 3. Create message for LLM
-        messages = self.make_message(question, sql, formatted_data)
-        
+        return self.make_message(question, sql, formatted_data)
+
+    def model_name(self) -> str:
+        return "unused" if self.model == "md_anderson" else "gpt-4.1"
+
+    def analyze(self, question: str, sql: str, df: pd.DataFrame) -> str:
+        messages = self.build_messages(question, sql, df)
+
         # 4. Get LLM response
-        if self.model == "md_anderson":
-            completion = self.client.chat.completions.create(
-                messages=messages,
-                model="unused",
-                temperature=0
-            )
-        elif self.model == "openai":
-            completion = self.client.chat.completions.create(
-                messages=messages,
-                model="gpt-4.1",
-                temperature=0
-            )
-        
-        return ast.literal_eval(completion.choices[0].message.content)
+        content = cached_chat_completion(
+            self.client.chat.completions,
+            messages=messages,
+            model=self.model_name(),
+            backend=self.model,
+            temperature=0
+        )
+        return ast.literal_eval(content)
+
+    async def aanalyze(self, question: str, sql: str, df: pd.DataFrame) -> str:
+        """Async :meth:`analyze`: the request waits on the event loop instead of blocking a thread."""
+        messages = self.build_messages(question, sql, df)
+        client = get_async_openai_client(self.model)
+        content = await acached_chat_completion(
+            client.chat.completions,
+            messages=messages,
+            model=self.model_name(),
+            backend=self.model,
+            temperature=0
+        )
+        return ast.literal_eval(content)
 
     def _preprocess_dataframe(self, df: pd.DataFrame, max_rows=100):
         # Convert to records format
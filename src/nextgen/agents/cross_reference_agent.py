@@ -4,10 +4,9 @@ import re
 import math
 import json
 from typing import List, Dict
-from openai import OpenAI
-import openai
 import chromadb
 from nextgen.agents.agents import Agent
+from nextgen.openai.registry import LLM_BACKENDS, get_async_openai_client, get_openai_client
 import pandas as pd
 from IPython.display import Markdown
 
@@ -22,16 +21,8 @@ class CrossReferenceAgent(Agent):
         # Instantiate the client. Make sure the client points to the self-hosted LLM.
         self.client = None
         self.model = model
-        if model == "md_anderson":
-            self.client = OpenAI(
-                api_key="unused",
-                base_url="https://apimd.mdanderson.edu/dig/llm/llama31-70b/v1/",
-                default_headers={"Ocp-Apim-Subscription-Key": os.environ["APIM_SUBSCRIPTION_KEY"]},
-            )
-        elif model == "openai":
-            self.client = OpenAI(
-                api_key=os.environ["OPENAI_API_KEY"],
-            )
+        if model in LLM_BACKENDS:
+            self.client = get_openai_client(model)
 
     
     def make_message(self, question: str, proteins: List[str]) -> str:
@@ -72,25 +63,26 @@ class CrossReferenceAgent(Agent):
         ]
 
 
+    def completion_params(self) -> Dict:
+        """Model and options of the completion request for the backend."""
+        if self.model == "openai":
+            return {"model": "gpt-4o-search-preview", "web_search_options": {}}
+        return {"model": "unused"}
+
     def analyze(self, question: str, proteins: List[str]) -> str:
 
         # 3. Create message for LLM
         messages = self.make_message(question, proteins)
         
         # 4. Get LLM response
-        if self.model == "md_anderson": 
-            completion = self.client.chat.completions.create(
-                messages=messages,
-                model="unused"
-            )
-        elif self.model == "openai":
-            completion = self.client.chat.completions.create(
-                messages=messages,
-                web_search_options={},
-                model="gpt-4o-search-preview"
-            )
+        completion = self.client.chat.completions.create(messages=messages, **self.completion_params())
+        return completion.choices[0].message.content
 
-        
+    async def aanalyze(self, question: str, proteins: List[str]) -> str:
+        """Async :meth:`analyze`: the web search request waits on the event loop instead of blocking a thread."""
+        messages = self.make_message(question, proteins)
+        client = get_async_openai_client(self.model)
+        completion = await client.chat.completions.create(messages=messages, **self.completion_params())
         return completion.choices[0].message.content
 
 # Get the cross reference agent
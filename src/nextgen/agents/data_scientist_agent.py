@@ -4,10 +4,17 @@
 # is: extract protein expression data and sample type for protein and rename other type to other
 
 import os
+from typing import AsyncIterator, Iterator, Optional, Tuple
+
+import pandas as pd
 from vanna.chromadb import ChromaDB_VectorStore
 from nextgen.agents.agents import Agent
+from nextgen.agents.aio import iterate_in_thread
 from nextgen.vanna.client import MDAndersonLLM_Chat
 from vanna.openai import OpenAI_Chat
+from nextgen.openai.registry import get_openai_client
+from nextgen.vanna.query_cache import QueryCache
+from nextgen.vanna.engines import STREAM_CHUNK_SIZE, connect_sql_engine, resolve_sql_engine
 
 
 initial_prompt = f"""
@@ -38,7 +45,19 @@ initial_prompt = f"""
 
 
 
-def get_vanna_instance(model: str = 'md_anderson', chroma_path: str = 'database/data_scientist_chroma', sql_path: str = 'database/nextgen.db'):
+def get_vanna_instance(model: str = 'md_anderson', chroma_path: str = 'database/data_scientist_chroma', sql_path: str = 'database/nextgen.db',
+                       engine: Optional[str] = None, parquet_path: str = 'database/parquet'):
+    """
+    Create a Vanna instance for the given LLM backend and connect it to a SQL engine.
+
+    Args:
+        model: LLM backend, "md_anderson" or "openai"
+        chroma_path: Directory of the Vanna ChromaDB vector store
+        sql_path: SQLite database
+        engine: SQL engine from nextgen.vanna.engines.SQL_ENGINES, defaults to the
+            NEXTGEN_SQL_ENGINE environment variable or "sqlite"
+        parquet_path: Parquet dataset directory used by the parquet engine
+    """
     
     if model == 'md_anderson':
         api_key = os.getenv('APIM_SUBSCRIPTION_KEY')
@@ -53,13 +72,14 @@ def get_vanna_instance(model: str = 'md_anderson', chroma_path: str = 'database/
         config = {
             'APIM_SUBSCRIPTION_KEY': api_key,
             'path': chroma_path,
-            'initial_prompt': initial_prompt
+            'initial_prompt': initial_prompt,
+            'temperature': 0.0
             }
 
     elif model == 'openai':
         class MyVanna(ChromaDB_VectorStore, OpenAI_Chat):
             def __init__(self, config=None):
-                OpenAI_Chat.__init__(self, config=config)
+                OpenAI_Chat.__init__(self, client=get_openai_client('openai'), config=config)
                 ChromaDB_VectorStore.__init__(self, config=config)
 
         config={'api_key': os.getenv('OPENAI_API_KEY'),
@@ -68,22 +88,151 @@ def get_vanna_instance(model: str = 'md_anderson', chroma_path: str = 'database/
                 'initial_prompt': initial_prompt,
                 'temperature': 0.0}
     vn = MyVanna(config=config)
-    vn.connect_to_sqlite(sql_path)
+    connect_sql_engine(vn, engine=resolve_sql_engine(engine), sql_path=sql_path, parquet_path=parquet_path)
     return vn
 
 class DataScientistAgent(Agent):
 
-    def __init__(self, vanna_instance=None):
+    name: str = "Data Scientist Agent"
+    color: str = '\033[34m'
+
+    def __init__(self, vanna_instance=None, query_cache: Optional[QueryCache] = None):
         super().__init__()
         
         self.vn = vanna_instance
+        self.query_cache = query_cache
+
+    def generate_sql(self, question: str) -> Tuple[str, bool]:
+        """
+        SQL for the question, from the query cache when possible.
+
+        Returns:
+            Tuple of (sql, whether the SQL is valid)
+        """
+        if self.query_cache is not None:
+            sql = self.query_cache.get_sql(question)
+            if sql is not None:
+                self.log("Using cached SQL for question")
+                return sql, True
+
+        sql = self.vn.generate_sql(question=question, allow_llm_to_see_data=True)
+        if not self.vn.is_sql_valid(sql):
+            return sql, False
+        if self.query_cache is not None:
+            self.query_cache.set_sql(question, sql)
+        return sql, True
 
     def analyze(self, question: str) -> str:
-        sql, df, _ = self.vn.ask(question=question, auto_train=False, allow_llm_to_see_data=True)
+        if self.query_cache is None:
+            sql, df, _ = self.vn.ask(question=question, auto_train=False, allow_llm_to_see_data=True)
+            return df, sql
+
+        sql, valid = self.generate_sql(question)
+        if not valid:
+            return None, sql
+
+        df = self.query_cache.get_result(sql)
+        if df is None:
+            try:
+                df = self.vn.run_sql(sql)
+            except Exception as e:
+                # Same result as vn.ask when the query fails
+                self.log(f"Couldn't run sql: {e}")
+                return None, sql
+            self.query_cache.set_result(sql, df)
+        else:
+            self.log("Using cached query result")
         return df, sql
+
+    def analyze_stream(self, question: str, chunk_size: int = STREAM_CHUNK_SIZE,
+                       max_rows: Optional[int] = None) -> Iterator[Tuple[Optional[pd.DataFrame], str, bool]]:
+        """
+        Generate SQL for the question and yield its result in chunks.
+
+        The first chunk arrives as soon as the database returns it, so callers can show a
+        preview before the whole result is read. Stopping the iteration stops the query.
+
+        Args:
+            question: The research question
+            chunk_size: Rows per chunk
+            max_rows: Stop after this many rows; None reads the whole result
+
+        Yields:
+            Tuples of (chunk, sql, truncated). truncated is True only for the last chunk of a
+            result that had more than ``max_rows`` rows; that chunk holds the rows up to the
+            limit and may be empty. If the generated SQL is not valid a single
+            (None, sql, False) is yielded.
+        """
+        sql, valid = self.generate_sql(question)
+        if not valid:
+            yield None, sql, False
+            return
+
+        chunks = self.query_cache.iter_result(sql, chunk_size) if self.query_cache is not None else None
+        writer = None
+        if chunks is not None:
+            self.log("Using cached query result")
+        elif hasattr(self.vn.run_sql, "stream"):
+            chunks = self.vn.run_sql.stream(sql, chunk_size)
+            writer = self.query_cache.result_writer(sql) if self.query_cache is not None else None
+        else:
+            df = self.vn.run_sql(sql)
+            chunks = (df.iloc[start:start + chunk_size] for start in range(0, len(df), chunk_size))
+
+        rows = 0
+        complete = False
+        try:
+            for chunk in chunks:
+                if max_rows is not None and rows + len(chunk) > max_rows:
+                    # Rows are dropped, so the result is not cached
+                    if writer is not None:
+                        writer.abort()
+                        writer = None
+                    self.log(f"Stopped reading the result at {max_rows:,} rows")
+                    yield chunk.iloc[:max_rows - rows], sql, True
+                    return
+                rows += len(chunk)
+                if writer is not None:
+                    writer.write(chunk)
+                yield chunk, sql, False
+            complete = True
+        finally:
+            if hasattr(chunks, "close"):
+                chunks.close()
+            if writer is not None:
+                writer.commit() if complete else writer.abort()
+
+    def aanalyze_stream(self, question: str, chunk_size: int = STREAM_CHUNK_SIZE,
+                        max_rows: Optional[int] = None) -> AsyncIterator[Tuple[Optional[pd.DataFrame], str, bool]]:
+        """
+        Async :meth:`analyze_stream`. SQL generation and the query run on a worker thread of
+        their own, so the event loop is free while the LLM and the database work.
+        """
+        return iterate_in_thread(self.analyze_stream(question, chunk_size, max_rows))
     
-def get_data_scientist_agent(model: str = 'md_anderson', chroma_path: str = 'database/data_scientist_chroma'):
-    return DataScientistAgent(vanna_instance=get_vanna_instance(model=model, chroma_path=chroma_path))
+def get_data_scientist_agent(model: str = 'md_anderson', chroma_path: str = 'database/data_scientist_chroma',
+                             sql_path: str = 'database/nextgen.db', query_cache_path: Optional[str] = 'database/query_cache',
+                             engine: Optional[str] = None, parquet_path: str = 'database/parquet'):
+    """
+    Create a DataScientistAgent.
+
+    Args:
+        model: LLM backend, "md_anderson" or "openai"
+        chroma_path: Directory of the Vanna ChromaDB vector store
+        sql_path: SQLite database the generated SQL runs against
+        query_cache_path: Directory of the question/SQL/result cache, or None to disable it
+        engine: SQL engine from nextgen.vanna.engines.SQL_ENGINES, defaults to the
+            NEXTGEN_SQL_ENGINE environment variable or "sqlite"
+        parquet_path: Parquet dataset directory used by the parquet engine
+    """
+    engine = resolve_sql_engine(engine)
+    data_path = parquet_path if engine == 'parquet' else sql_path
+    query_cache = QueryCache(data_path, query_cache_path) if query_cache_path else None
+    return DataScientistAgent(
+        vanna_instance=get_vanna_instance(model=model, chroma_path=chroma_path, sql_path=sql_path,
+                                          engine=engine, parquet_path=parquet_path),
+        query_cache=query_cache,
+    )
 
 
 if __name__ == "__main__":
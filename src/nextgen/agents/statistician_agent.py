@@ -1,11 +1,100 @@
 from typing import Optional, Union, List
 import pandas as pd
 import os
+import re
+import logging
+import hashlib
+import inspect
+import threading
 from pandasai import Agent
 from pandasai.llm import OpenAI
 from pandasai.ee.vectorstores import ChromaDB
 from nextgen.pandas.client import MDAndersonLLM
 from nextgen.analysis.t_test import perform_t_test
+from nextgen.analysis import (
+    DifferentialExpressionAccumulator,
+    differential_expression,
+    multi_group_differential_expression,
+    permutation_test,
+    read_protein_group_stats,
+    summary_differential_expression,
+)
+
+# Columns required by the built-in differential expression analysis
+DIFFERENTIAL_EXPRESSION_COLUMNS = ["protein_group", "cancer_type", "intensity"]
+# Questions that explicitly ask for the standard two-group comparison
+DIFFERENTIAL_EXPRESSION_PATTERN = re.compile(
+    r"\bt[- ]?tests?\b|\bdifferential(?:ly)?[- ](?:expression|expressed|abundan(?:ce|t))\b|\bfold[- ]changes?\b",
+    re.IGNORECASE,
+)
+# Otherwise a question must be about protein levels and compare groups
+PROTEIN_LEVEL_PATTERN = re.compile(r"\bproteins?\b|\bintensit(?:y|ies)\b|\bexpression\b|\babundan(?:ce|t)\b", re.IGNORECASE)
+COMPARISON_PATTERN = re.compile(r"\bcompar(?:e|es|ed|ing|ison|isons)\b|\bdistinguish|\bdiffer(?:s|ed|ence|ences)?\b|\bversus\b|\bvs\b",
+                                re.IGNORECASE)
+# Questions that ask for a permutation test instead of the parametric t-test
+PERMUTATION_PATTERN = re.compile(r"permut", re.IGNORECASE)
+# Column identifying the sample whose cancer type label is permuted
+SAMPLE_COLUMN = "run"
+# Questions about more than two groups that compare every pair of groups; the others
+# compare each group with all the rest
+ALL_PAIRS_PATTERN = re.compile(
+    r"\b(?:all|every|each)\s+pairs?\b|\bpair[- ]?wise\b|\ball[- ]pairs\b|\beach\s+other\b",
+    re.IGNORECASE,
+)
+
+# Example question/code pairs the pandasai vector store is trained on
+TRAINING_QUERIES = ["The data is protein expression data with each row is a protein in a sample of cancer type. Perform t-test for each protein between the two group"]
+TRAINING_CODES = [inspect.getsource(perform_t_test)]
+# File in the vector store directory listing the hashes of the examples already trained
+TRAINED_EXAMPLES_FILE = "trained_examples.txt"
+
+logger = logging.getLogger(__name__)
+
+_vector_stores = {}
+_vector_stores_lock = threading.Lock()
+
+
+def _example_hash(query: str, code: str) -> str:
+    return hashlib.sha256(f"{query}\n{code}".encode("utf-8")).hexdigest()
+
+
+def get_vector_store(persist_path: str) -> ChromaDB:
+    """
+    Return the process-wide ChromaDB vector store for ``persist_path``.
+
+    The store is created once per process and trained with the example queries the first
+    time it is requested. Examples whose content hash is already recorded in the store
+    directory are not embedded again, so the store does not grow across restarts.
+    """
+    with _vector_stores_lock:
+        if persist_path not in _vector_stores:
+            vector_store = ChromaDB(persist_path=persist_path)
+            _train_vector_store(vector_store, persist_path)
+            _vector_stores[persist_path] = vector_store
+        return _vector_stores[persist_path]
+
+
+def _train_vector_store(vector_store: ChromaDB, persist_path: str) -> None:
+    """Add the training examples that are not yet in the vector store."""
+    manifest = os.path.join(persist_path, TRAINED_EXAMPLES_FILE)
+    trained = set()
+    if os.path.exists(manifest):
+        with open(manifest, "r", encoding="utf-8") as f:
+            trained = {line.strip() for line in f if line.strip()}
+
+    new_examples = [
+        (query, code, _example_hash(query, code))
+        for query, code in zip(TRAINING_QUERIES, TRAINING_CODES)
+        if _example_hash(query, code) not in trained
+    ]
+    if not new_examples:
+        return
+
+    queries, codes, hashes = (list(values) for values in zip(*new_examples))
+    vector_store.add_question_answer(queries, codes, ids=hashes)
+    os.makedirs(persist_path, exist_ok=True)
+    with open(manifest, "a", encoding="utf-8") as f:
+        f.writelines(f"{example_hash}\n" for example_hash in hashes)
 
 class StatisticianAgent:
     """
@@ -31,12 +120,24 @@ class StatisticianAgent:
         self.dependencies = ["scipy", "statistics", "numpy", "pandas", "scikit-learn", "warnings"]
         if additional_dependencies:
             self.dependencies.extend(additional_dependencies)
+
+        self.config = {
+            "llm": self.client,
+            "custom_whitelisted_dependencies": self.dependencies,
+            "enable_cache": True,
+            'enable_charts': False,
+            "save_charts": False,
+            "verbose": True  # Enable verbose mode for debugging
+        }
+        # Shared by every analyze() call; only the dataframe binding is created per call
+        self.vector_store = None
             
 
     def analyze(
         self,
         question: str,
-        df: pd.DataFrame
+        df: pd.DataFrame,
+        method: str = "auto"
     ) -> Union[str, pd.DataFrame]:
         """
         Analyze a pandas dataframe based on a natural language question.
@@ -44,7 +145,10 @@ class StatisticianAgent:
         Args:
             df: The pandas dataframe to analyze
             question: The question to answer about the data
-            enable_cache: Whether to enable caching of results
+            method: "differential_expression" runs the built-in comparison of the groups,
+                "permutation" runs the built-in permutation test, "llm" always generates the
+                analysis code with pandasai, and "auto" uses a built-in analysis when the
+                question and the data allow it
             
         Returns:
             The answer to the question, either as a string or a pandas dataframe
@@ -57,31 +161,26 @@ class StatisticianAgent:
             raise ValueError("The provided dataframe is empty")
         if not question.strip():
             raise ValueError("Please provide a valid question")
+        if method not in ("auto", "differential_expression", "permutation", "llm"):
+            raise ValueError(f"Invalid method: {method}")
+
+        if method == "permutation" or (
+            method == "auto" and self.supports_permutation_test(question, df)
+        ):
+            return self.permutation_test(df)
+        if method == "differential_expression" or (
+            method == "auto" and self.supports_differential_expression(question, df)
+        ):
+            return self.differential_expression(df, self.comparison_mode(question))
             
         try:
-            # Print data info for debugging
-            print("\nDataframe Info:")
-            print(df.info())
-            print("\nDataframe Head:")
-            print(df.head())
-            print("\nColumn Names:", df.columns.tolist())
-            print("\nData Types:\n", df.dtypes)
+            # Only metadata is logged; formatting rows would materialize Arrow and
+            # categorical columns as Python objects
+            logger.debug("Analyzing %d rows with dtypes %s", len(df), df.dtypes.astype(str).to_dict())
             
-            config = {
-                "llm": self.client,
-                "custom_whitelisted_dependencies": self.dependencies,
-                "enable_cache": True,
-                'enable_charts': False,
-                "save_charts": False,
-                "verbose": True  # Enable verbose mode for debugging
-            }
-            
-            # create chroma vectorstore
-            vector_store = ChromaDB(persist_path=self.vector_store_path)
-            agent = Agent(df, memory_size=100, config=config, vectorstore=vector_store)
-
-            agent.train(queries=["The data is protein expression data with each row is a protein in a sample of cancer type. Perform t-test for each protein between the two group"],
-                         codes=[perform_t_test.__code__])
+            if self.vector_store is None:
+                self.vector_store = get_vector_store(self.vector_store_path)
+            agent = Agent(df, memory_size=100, config=self.config, vectorstore=self.vector_store)
             
             # Get the response
             # sdf = SmartDataframe(df, config=config)
@@ -97,7 +196,7 @@ class StatisticianAgent:
             5. Calculate the ROC AUC for each protein using using roc_auc_score from sklearn.metrics
             6. Output the number of samples in each group.
             7. Compute the log2-fold change: `log2(mean_group1 / mean_group2)` - **To avoid divide-by-zero**, if either group's mean is 0, set `log2_fold_change = 0`.
-            8. Return a summary DataFrame with the following columns: 'protein_group', 'mean_intensity_{group1}', 'mean_intensity_{group2}', 'log2_fold_change', 'number_of_samples_{group1}', 'number_of_samples_{group2}', 'p_val', 'auc'.
+            8. Return a summary DataFrame with the following columns: 'protein_group', 'mean_intensity_{group1}', 'mean_intensity_{group2}', 'log2_fold_change', 'number_of_samples_{group1}', 'number_of_samples_{group2}', 'p_val', 'q_val' (Benjamini-Hochberg adjusted p_val), 'auc'.
             9. Sort the results by 'auc' in descending order and 'p_val' in ascending order.
             10. Suppress an warning message.
             '''
@@ -108,6 +207,112 @@ class StatisticianAgent:
         except Exception as e:
             print(f"\nError details: {str(e)}")
             raise Exception(f"Error analyzing data: {str(e)}")
+
+    @staticmethod
+    def supports_differential_expression(question: str, df: pd.DataFrame) -> bool:
+        """
+        Whether the question asks for a comparison of cancer types that the built-in
+        differential expression analysis can answer on this dataframe: it names a t-test,
+        differential expression or fold change, or it compares protein levels. Other
+        questions are left to the pandasai agent.
+        """
+        if not DIFFERENTIAL_EXPRESSION_PATTERN.search(question) and not (
+            PROTEIN_LEVEL_PATTERN.search(question) and COMPARISON_PATTERN.search(question)
+        ):
+            return False
+        if not set(DIFFERENTIAL_EXPRESSION_COLUMNS).issubset(df.columns):
+            return False
+        return df["cancer_type"].nunique() >= 2
+
+    @staticmethod
+    def supports_permutation_test(question: str, df: pd.DataFrame) -> bool:
+        """Whether the question asks for a permutation test that the built-in engine can run on this dataframe."""
+        if not PERMUTATION_PATTERN.search(question):
+            return False
+        if not set(DIFFERENTIAL_EXPRESSION_COLUMNS + [SAMPLE_COLUMN]).issubset(df.columns):
+            return False
+        return df["cancer_type"].nunique() == 2
+
+    @staticmethod
+    def comparison_mode(question: str) -> str:
+        """
+        How to compare more than two cancer types: "all_pairs" when the question asks for
+        pairwise comparisons, otherwise "one_vs_rest", the default of :meth:`differential_expression`.
+        """
+        return "all_pairs" if ALL_PAIRS_PATTERN.search(question) else "one_vs_rest"
+
+    def differential_expression(self, df: pd.DataFrame, mode: str = "one_vs_rest") -> pd.DataFrame:
+        """
+        Compare every protein between the cancer types without generating code with the LLM.
+
+        Args:
+            df: Long-format dataframe with DIFFERENTIAL_EXPRESSION_COLUMNS
+            mode: How more than two cancer types are compared, "one_vs_rest" or "all_pairs"
+
+        Returns:
+            With two cancer types, the summary dataframe requested in the pandasai system
+            prompt, sorted by 'auc' in descending order and 'p_val' in ascending order.
+            Otherwise the table of :func:`nextgen.analysis.multi_group_differential_expression`,
+            sorted by comparison and 'p_val'
+        """
+        if df["cancer_type"].nunique() == 2:
+            logger.info("Running built-in differential expression analysis")
+            result = differential_expression(df, auc=True)
+            return result.sort_values(["auc", "p_val"], ascending=[False, True], ignore_index=True)
+        logger.info("Running built-in %s differential expression analysis", mode)
+        result = multi_group_differential_expression(df, mode=mode)
+        return result.sort_values(["group1", "group2", "p_val"], ignore_index=True)
+
+    def differential_expression_from_summary(self, db_path: str, groups: Optional[List[str]] = None,
+                                             mode: str = "one_vs_rest", scale: str = "linear") -> pd.DataFrame:
+        """
+        Compare every protein between cancer types from the protein_group_stats summary table
+        of the database, without reading any measurement rows.
+
+        Args:
+            db_path: SQLite database built by construct_database
+            groups: Cancer types to compare; two give the two-group table, more (or None,
+                all cancer types) give the ``mode`` comparisons
+            mode: "one_vs_rest" or "all_pairs"
+            scale: "linear" or "log2", see :func:`nextgen.analysis.summary_differential_expression`
+
+        Returns:
+            The table of :meth:`differential_expression` without the 'auc' column, sorted by
+            'p_val' (within each comparison for more than two groups)
+        """
+        logger.info("Running built-in differential expression analysis on protein_group_stats")
+        result = summary_differential_expression(read_protein_group_stats(db_path, groups), groups, mode, scale)
+        if "group1" in result.columns:
+            return result.sort_values(["group1", "group2", "p_val"], ignore_index=True)
+        return result.sort_values("p_val", ignore_index=True)
+
+    def permutation_test(self, df: pd.DataFrame, n_permutations: int = 10000, seed: Optional[int] = 0) -> pd.DataFrame:
+        """
+        Permutation t-test of every protein between the two cancer types, for cohorts too
+        small to trust the parametric t-test.
+
+        Returns:
+            The table of :func:`nextgen.analysis.permutation_test`, sorted by 'perm_p_val'
+        """
+        logger.info("Running built-in permutation test with %d permutations", n_permutations)
+        result = permutation_test(df, sample_col=SAMPLE_COLUMN, n_permutations=n_permutations, seed=seed)
+        return result.sort_values(["perm_p_val", "protein_group"], ignore_index=True)
+
+    def differential_expression_from_accumulator(self, accumulator: DifferentialExpressionAccumulator,
+                                                 mode: str = "one_vs_rest") -> pd.DataFrame:
+        """
+        Compare every protein between the cancer types from the state accumulated over a
+        streamed result, without holding the measurements in memory.
+
+        Returns:
+            The table of :meth:`differential_expression`
+        """
+        logger.info("Running built-in differential expression analysis on the accumulated result")
+        if len(accumulator.group_labels) == 2:
+            result = accumulator.finalize()
+            return result.sort_values(["auc", "p_val"], ascending=[False, True], ignore_index=True)
+        result = accumulator.compare(mode)
+        return result.sort_values(["group1", "group2", "p_val"], ignore_index=True)
     
 
 def get_statistician_agent(model: str = "openai", vector_store_path: str = "database/statistician_chroma"):
@@ -0,0 +1,23 @@
+from .differential_expression import differential_expression, multi_group_differential_expression
+from .multiple_testing import add_q_values, adjust_p_values
+from .auc import grouped_auc
+from .accumulators import DifferentialExpressionAccumulator, GroupedMoments, GroupedRankSketch
+from .parallel import ProteinShardExecutor, mann_whitney_exact
+from .permutation import permutation_test
+from .summary import read_protein_group_stats, summary_differential_expression
+
+__all__ = [
+    "differential_expression",
+    "multi_group_differential_expression",
+    "adjust_p_values",
+    "add_q_values",
+    "grouped_auc",
+    "GroupedMoments",
+    "GroupedRankSketch",
+    "DifferentialExpressionAccumulator",
+    "ProteinShardExecutor",
+    "mann_whitney_exact",
+    "permutation_test",
+    "read_protein_group_stats",
+    "summary_differential_expression",
+]
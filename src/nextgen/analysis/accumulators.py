@@ -0,0 +1,446 @@
+"""
+Mergeable per-(protein, group) summary states of long-format expression data.
+
+Each state is updated one chunk at a time, can be merged with states built from other
+chunks (in other processes, or saved to disk with :meth:`save` and read back with
+:meth:`load`), and is finalized into the same tables as the in-memory functions of
+:mod:`nextgen.analysis`. This lets the statistics run on streamed results and on cohorts
+that do not fit in memory.
+
+    GroupedMoments                       count, mean and M2 for the t-test and fold change
+    GroupedRankSketch                    log-intensity histograms for the AUC and Mann-Whitney U test
+    DifferentialExpressionAccumulator    both, finalized into the differential expression table
+"""
+
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .auc import auc_from_rank_sums, mann_whitney_from_rank_sums
+from .differential_expression import chan_merge, grouped_moments, moments_table, multi_group_table
+from .grouping import _codes
+
+# Width of the rank sketch bins in log2 intensity units: values less than ~0.07% apart
+# may share a bin and are then counted as ties
+DEFAULT_BIN_WIDTH = 0.001
+# Range of log2 intensities with their own bins; values outside go to the edge bins
+DEFAULT_LOG2_RANGE = (-20.0, 60.0)
+
+
+def _extend_labels(values: pd.Series, labels: pd.Index) -> Tuple[np.ndarray, pd.Index]:
+    """
+    Encode values against a growing label index, appending labels not seen before.
+
+    Returns:
+        Tuple of (codes of ``values``, extended labels)
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        uniques = pd.Index(values.cat.remove_unused_categories().cat.categories.to_numpy(dtype=object))
+    else:
+        uniques = pd.Index(values.unique(), dtype=object)
+    new = uniques[~uniques.isin(labels)]
+    if len(new):
+        labels = labels.append(new)
+    return _codes(values, labels), labels
+
+
+def _pad(array: np.ndarray, shape: Tuple[int, int]) -> np.ndarray:
+    """Zero-pad a 2D array to ``shape``."""
+    if array.shape == shape:
+        return array
+    padded = np.zeros(shape)
+    padded[:array.shape[0], :array.shape[1]] = array
+    return padded
+
+
+class _GroupedState:
+    """Protein and group labels shared by the summary states, and their chunk/merge plumbing."""
+
+    def __init__(self, protein_col: str = "protein_group", group_col: str = "cancer_type",
+                 value_col: str = "intensity"):
+        self.protein_col = protein_col
+        self.group_col = group_col
+        self.value_col = value_col
+        self.protein_labels = pd.Index([], dtype=object)
+        self.group_labels = pd.Index([], dtype=object)
+
+    def update(self, df: pd.DataFrame):
+        """Add the measurements of a chunk. Rows with missing values are skipped."""
+        data = df[[self.protein_col, self.group_col, self.value_col]].dropna()
+        if data.empty:
+            return self
+        protein_codes, self.protein_labels = _extend_labels(data[self.protein_col], self.protein_labels)
+        group_codes, self.group_labels = _extend_labels(data[self.group_col], self.group_labels)
+        self._add(protein_codes, group_codes, data[self.value_col].to_numpy(dtype=np.float64))
+        return self
+
+    def merge(self, other: "_GroupedState"):
+        """Add the measurements accumulated by another state of the same kind."""
+        self.protein_labels = self.protein_labels.append(other.protein_labels[~other.protein_labels.isin(self.protein_labels)])
+        self.group_labels = self.group_labels.append(other.group_labels[~other.group_labels.isin(self.group_labels)])
+        self._merge_aligned(other, self.protein_labels.get_indexer(other.protein_labels),
+                            self.group_labels.get_indexer(other.group_labels))
+        return self
+
+    def _group_columns(self, groups: Optional[Sequence[str]]) -> Tuple[pd.Index, np.ndarray]:
+        """The two groups to compare and their positions in ``group_labels``."""
+        group_labels = pd.Index(groups if groups is not None else sorted(self.group_labels))
+        if len(group_labels) != 2:
+            raise ValueError(f"Exactly two groups are required, got {list(group_labels)}")
+        columns = self.group_labels.get_indexer(group_labels)
+        if (columns < 0).any():
+            raise ValueError(f"Groups {list(group_labels[columns < 0])} have no measurements")
+        return group_labels, columns
+
+    def state_dict(self) -> Dict[str, np.ndarray]:
+        """The state as NumPy arrays, for :meth:`save`."""
+        return {
+            "protein_labels": self.protein_labels.to_numpy(dtype=str),
+            "group_labels": self.group_labels.to_numpy(dtype=str),
+            "columns": np.array([self.protein_col, self.group_col, self.value_col]),
+        }
+
+    def load_state_dict(self, state: Dict[str, np.ndarray]) -> None:
+        self.protein_labels = pd.Index(state["protein_labels"].astype(object))
+        self.group_labels = pd.Index(state["group_labels"].astype(object))
+        self.protein_col, self.group_col, self.value_col = (str(col) for col in state["columns"])
+
+    def save(self, path: str) -> None:
+        """Write the state to a compressed ``.npz`` file."""
+        np.savez_compressed(path, **self.state_dict())
+
+    @classmethod
+    def load(cls, path: str):
+        """Read a state written by :meth:`save`."""
+        state = cls()
+        with np.load(path, allow_pickle=False) as data:
+            state.load_state_dict(dict(data))
+        return state
+
+
+class GroupedMoments(_GroupedState):
+    """
+    Mergeable per-(protein, group) count, mean and M2 of long-format expression data.
+
+    Example:
+        >>> moments = GroupedMoments()
+        >>> for chunk in chunks:
+        ...     moments.update(chunk)
+        >>> result = moments.finalize()
+    """
+
+    def __init__(self, protein_col: str = "protein_group", group_col: str = "cancer_type",
+                 value_col: str = "intensity"):
+        super().__init__(protein_col, group_col, value_col)
+        self.count = np.zeros((0, 0))
+        self.mean = np.zeros((0, 0))
+        self.m2 = np.zeros((0, 0))
+
+    @property
+    def n_rows(self) -> int:
+        """Number of measurements accumulated so far."""
+        return int(self.count.sum())
+
+    def _combine(self, count: np.ndarray, mean: np.ndarray, m2: np.ndarray) -> None:
+        shape = (len(self.protein_labels), len(self.group_labels))
+        self.count, self.mean, self.m2 = chan_merge(
+            _pad(self.count, shape), _pad(self.mean, shape), _pad(self.m2, shape),
+            _pad(count, shape), _pad(mean, shape), _pad(m2, shape),
+        )
+
+    def _add(self, protein_codes: np.ndarray, group_codes: np.ndarray, values: np.ndarray) -> None:
+        count, mean, m2 = grouped_moments(
+            protein_codes, group_codes, values, len(self.protein_labels), len(self.group_labels)
+        )
+        self._combine(count, np.nan_to_num(mean), m2)
+
+    def _merge_aligned(self, other: "GroupedMoments", rows: np.ndarray, columns: np.ndarray) -> None:
+        shape = (len(self.protein_labels), len(self.group_labels))
+        aligned = []
+        for array in (other.count, other.mean, other.m2):
+            scattered = np.zeros(shape)
+            scattered[np.ix_(rows, columns)] = array
+            aligned.append(scattered)
+        self._combine(*aligned)
+
+    def state_dict(self) -> Dict[str, np.ndarray]:
+        return {**super().state_dict(), "count": self.count, "mean": self.mean, "m2": self.m2}
+
+    def load_state_dict(self, state: Dict[str, np.ndarray]) -> None:
+        super().load_state_dict(state)
+        self.count, self.mean, self.m2 = state["count"], state["mean"], state["m2"]
+
+    def finalize(self, groups: Optional[Sequence[str]] = None, equal_var: bool = True,
+                 min_samples: int = 2, p_adjust: Optional[str] = "fdr_bh") -> pd.DataFrame:
+        """
+        Per-protein two-sample t-test between two groups.
+
+        Args:
+            groups: The two groups to compare, in order. Defaults to the two groups
+                accumulated, sorted alphabetically
+            equal_var: Student's t-test if True, Welch's t-test otherwise
+            min_samples: Proteins with fewer measurements than this in either group are skipped
+            p_adjust: Multiple-testing correction of the 'q_val' column; None leaves it out
+
+        Returns:
+            The table of :func:`nextgen.analysis.differential_expression` without the
+            'auc' column, sorted by protein
+
+        Raises:
+            ValueError: If there are not exactly two groups
+        """
+        group_labels, columns = self._group_columns(groups)
+        order = np.argsort(self.protein_labels.to_numpy())
+        result, _ = moments_table(
+            self.protein_labels[order], group_labels,
+            self.count[order][:, columns], self.mean[order][:, columns], self.m2[order][:, columns],
+            equal_var, min_samples, p_adjust,
+        )
+        return result
+
+    def compare(self, mode: str = "one_vs_rest", equal_var: bool = True, min_samples: int = 2,
+                p_adjust: Optional[str] = "fdr_bh") -> pd.DataFrame:
+        """
+        Per-protein t-tests of every group against the rest, or of every pair of groups.
+
+        Returns:
+            The table of :func:`nextgen.analysis.multi_group_differential_expression`, with
+            groups and proteins sorted alphabetically
+
+        Raises:
+            ValueError: If fewer than two groups were accumulated or the mode is unknown
+        """
+        if len(self.group_labels) < 2:
+            raise ValueError(f"At least two groups are required, got {list(self.group_labels)}")
+        rows = np.argsort(self.protein_labels.to_numpy())
+        columns = np.argsort(self.group_labels.to_numpy())
+        return multi_group_table(
+            self.protein_labels[rows], self.group_labels[columns],
+            self.count[np.ix_(rows, columns)], self.mean[np.ix_(rows, columns)], self.m2[np.ix_(rows, columns)],
+            mode, equal_var, min_samples, p_adjust,
+        )
+
+
+class GroupedRankSketch(_GroupedState):
+    """
+    Mergeable per-(protein, group) histograms of log2 intensity for rank statistics.
+
+    Every measurement is counted in a bin of ``bin_width`` log2 units. Only occupied
+    (protein, group, bin) cells are stored, so the sketch is never larger than the data
+    and stops growing once the occupied bins saturate. The AUC computed from it equals
+    the exact AUC whenever no two different intensities of a protein share a bin, and
+    otherwise counts them as ties.
+    """
+
+    def __init__(self, protein_col: str = "protein_group", group_col: str = "cancer_type",
+                 value_col: str = "intensity", bin_width: float = DEFAULT_BIN_WIDTH,
+                 log2_range: Tuple[float, float] = DEFAULT_LOG2_RANGE):
+        super().__init__(protein_col, group_col, value_col)
+        self.bin_width = bin_width
+        self.log2_range = tuple(log2_range)
+        self.n_bins = int(np.ceil((self.log2_range[1] - self.log2_range[0]) / bin_width)) + 1
+        # Occupied cells: protein code, group code, bin and count, sorted and unique once compacted
+        self.proteins = np.zeros(0, dtype=np.int64)
+        self.groups = np.zeros(0, dtype=np.int64)
+        self.bins = np.zeros(0, dtype=np.int64)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self._pending = []
+        self._pending_size = 0
+
+    def bin_index(self, values: np.ndarray) -> np.ndarray:
+        """Bin of every value; non-positive values go to the lowest bin."""
+        with np.errstate(divide="ignore", invalid="ignore"):
+            log_values = np.log2(values)
+        bins = np.floor((log_values - self.log2_range[0]) / self.bin_width)
+        return np.clip(np.nan_to_num(bins, nan=0, neginf=0), 0, self.n_bins - 1).astype(np.int64)
+
+    def _append(self, proteins, groups, bins, counts) -> None:
+        self._pending.append((proteins, groups, bins, counts))
+        self._pending_size += len(counts)
+        # Amortized compaction: only once the pending cells outgrow the compacted ones
+        if self._pending_size >= max(len(self.counts), 1 << 20):
+            self.compact()
+
+    def compact(self) -> None:
+        """Sum the counts of duplicate cells and sort the cells by (protein, group, bin)."""
+        if not self._pending:
+            return
+        parts = [(self.proteins, self.groups, self.bins, self.counts)] + self._pending
+        self._pending = []
+        self._pending_size = 0
+        proteins, groups, bins, counts = (np.concatenate(arrays) for arrays in zip(*parts))
+        n_groups = max(len(self.group_labels), 1)
+        keys = (proteins * n_groups + groups) * self.n_bins + bins
+        keys, inverse = np.unique(keys, return_inverse=True)
+        self.counts = np.bincount(inverse, weights=counts, minlength=len(keys)).astype(np.int64)
+        self.bins = keys % self.n_bins
+        cell = keys // self.n_bins
+        self.groups = cell % n_groups
+        self.proteins = cell // n_groups
+
+    def _add(self, protein_codes: np.ndarray, group_codes: np.ndarray, values: np.ndarray) -> None:
+        self._append(protein_codes.astype(np.int64), group_codes.astype(np.int64),
+                     self.bin_index(values), np.ones(len(values), dtype=np.int64))
+
+    def _merge_aligned(self, other: "GroupedRankSketch", rows: np.ndarray, columns: np.ndarray) -> None:
+        if (other.bin_width, other.log2_range) != (self.bin_width, self.log2_range):
+            raise ValueError("Rank sketches with different bins cannot be merged")
+        other.compact()
+        self._append(rows[other.proteins], columns[other.groups], other.bins, other.counts)
+
+    def state_dict(self) -> Dict[str, np.ndarray]:
+        self.compact()
+        return {
+            **super().state_dict(),
+            "bin_width": np.array(self.bin_width),
+            "log2_range": np.array(self.log2_range),
+            "proteins": self.proteins,
+            "groups": self.groups,
+            "bins": self.bins,
+            "counts": self.counts,
+        }
+
+    def load_state_dict(self, state: Dict[str, np.ndarray]) -> None:
+        super().load_state_dict(state)
+        self.bin_width = float(state["bin_width"])
+        self.log2_range = tuple(float(value) for value in state["log2_range"])
+        self.n_bins = int(np.ceil((self.log2_range[1] - self.log2_range[0]) / self.bin_width)) + 1
+        self.proteins, self.groups, self.bins, self.counts = (
+            state["proteins"], state["groups"], state["bins"], state["counts"]
+        )
+        self._pending = []
+        self._pending_size = 0
+
+    def rank_sums(self, columns: np.ndarray):
+        """
+        Rank statistics of every protein between two groups.
+
+        Args:
+            columns: Positions of the two groups in ``group_labels``
+
+        Returns:
+            Tuple of (rank sum of the first group, n1, n2, tie term sum(t^3 - t)), arrays
+            of length ``len(protein_labels)``
+        """
+        self.compact()
+        n_proteins = len(self.protein_labels)
+        selected = np.isin(self.groups, columns)
+        proteins = self.proteins[selected]
+        first = self.groups[selected] == columns[0]
+        counts = self.counts[selected].astype(np.float64)
+
+        # Counts of both groups per (protein, bin), in (protein, bin) order
+        keys, inverse = np.unique(proteins * self.n_bins + self.bins[selected], return_inverse=True)
+        c1 = np.bincount(inverse, weights=np.where(first, counts, 0), minlength=len(keys))
+        c2 = np.bincount(inverse, weights=np.where(first, 0, counts), minlength=len(keys))
+        cell_protein = keys // self.n_bins
+
+        # Second-group measurements in lower bins of the same protein
+        cum2 = np.cumsum(c2)
+        protein_start = np.searchsorted(cell_protein, cell_protein, side="left")
+        before_protein = np.where(protein_start > 0, cum2[protein_start - 1], 0)
+        below2 = cum2 - c2 - before_protein
+
+        n1 = np.bincount(cell_protein, weights=c1, minlength=n_proteins)
+        n2 = np.bincount(cell_protein, weights=c2, minlength=n_proteins)
+        u1 = np.bincount(cell_protein, weights=c1 * (below2 + 0.5 * c2), minlength=n_proteins)
+        ties = c1 + c2
+        tie_term = np.bincount(cell_protein, weights=ties ** 3 - ties, minlength=n_proteins)
+        return u1 + n1 * (n1 + 1) / 2, n1, n2, tie_term
+
+    def finalize(self, groups: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """
+        ROC AUC and Mann-Whitney U test of every protein between two groups.
+
+        Returns:
+            The table of :func:`nextgen.analysis.grouped_auc`, sorted by protein
+
+        Raises:
+            ValueError: If there are not exactly two groups
+        """
+        _, columns = self._group_columns(groups)
+        rank_sum, n1, n2, tie_term = self.rank_sums(columns)
+        keep = (n1 > 0) & (n2 > 0)
+        keep_idx = np.flatnonzero(keep)
+        order = keep_idx[np.argsort(self.protein_labels.to_numpy()[keep_idx])]
+        u1, p_val = mann_whitney_from_rank_sums(rank_sum[order], n1[order], n2[order], tie_term[order])
+        return pd.DataFrame({
+            "protein_group": self.protein_labels[order],
+            "auc": auc_from_rank_sums(rank_sum[order], n1[order], n2[order]),
+            "mann_whitney_u": u1,
+            "mann_whitney_p_val": p_val,
+        })
+
+
+class DifferentialExpressionAccumulator(_GroupedState):
+    """
+    Moments and rank sketch of the same measurements, finalized into the table of
+    :func:`nextgen.analysis.differential_expression` including the 'auc' column.
+    """
+
+    def __init__(self, protein_col: str = "protein_group", group_col: str = "cancer_type",
+                 value_col: str = "intensity", bin_width: float = DEFAULT_BIN_WIDTH,
+                 log2_range: Tuple[float, float] = DEFAULT_LOG2_RANGE):
+        super().__init__(protein_col, group_col, value_col)
+        self.moments = GroupedMoments(protein_col, group_col, value_col)
+        self.ranks = GroupedRankSketch(protein_col, group_col, value_col, bin_width, log2_range)
+
+    @property
+    def n_rows(self) -> int:
+        return self.moments.n_rows
+
+    def _share_labels(self) -> None:
+        for state in (self.moments, self.ranks):
+            state.protein_labels = self.protein_labels
+            state.group_labels = self.group_labels
+
+    def _add(self, protein_codes: np.ndarray, group_codes: np.ndarray, values: np.ndarray) -> None:
+        self._share_labels()
+        self.moments._add(protein_codes, group_codes, values)
+        self.ranks._add(protein_codes, group_codes, values)
+
+    def _merge_aligned(self, other: "DifferentialExpressionAccumulator", rows: np.ndarray, columns: np.ndarray) -> None:
+        self._share_labels()
+        self.moments._merge_aligned(other.moments, rows, columns)
+        self.ranks._merge_aligned(other.ranks, rows, columns)
+
+    def state_dict(self) -> Dict[str, np.ndarray]:
+        state = super().state_dict()
+        for prefix, sub_state in (("moments", self.moments), ("ranks", self.ranks)):
+            state.update({f"{prefix}.{key}": value for key, value in sub_state.state_dict().items()})
+        return state
+
+    def load_state_dict(self, state: Dict[str, np.ndarray]) -> None:
+        super().load_state_dict(state)
+        for prefix, sub_state in (("moments", self.moments), ("ranks", self.ranks)):
+            sub_state.load_state_dict({
+                key[len(prefix) + 1:]: value for key, value in state.items() if key.startswith(f"{prefix}.")
+            })
+        self._share_labels()
+
+    def finalize(self, groups: Optional[Sequence[str]] = None, equal_var: bool = True,
+                 min_samples: int = 2, p_adjust: Optional[str] = "fdr_bh") -> pd.DataFrame:
+        """
+        Per-protein t-test, fold change and AUC between two groups.
+
+        Returns:
+            The table of :func:`nextgen.analysis.differential_expression` with ``auc=True``,
+            sorted by protein
+
+        Raises:
+            ValueError: If there are not exactly two groups
+        """
+        self._share_labels()
+        result = self.moments.finalize(groups, equal_var, min_samples, p_adjust)
+        _, columns = self._group_columns(groups)
+        rank_sum, n1, n2, _ = self.ranks.rank_sums(columns)
+        auc = pd.Series(auc_from_rank_sums(rank_sum, n1, n2), index=self.protein_labels)
+        result["auc"] = auc.reindex(result["protein_group"]).to_numpy()
+        return result
+
+    def compare(self, mode: str = "one_vs_rest", equal_var: bool = True, min_samples: int = 2,
+                p_adjust: Optional[str] = "fdr_bh") -> pd.DataFrame:
+        """Multi-group t-tests, see :meth:`GroupedMoments.compare`."""
+        self._share_labels()
+        return self.moments.compare(mode, equal_var, min_samples, p_adjust)
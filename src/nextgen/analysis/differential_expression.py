@@ -0,0 +1,355 @@
+from itertools import combinations
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy.stats import t as t_dist
+
+from .auc import auc_from_rank_sums, grouped_ranks
+from .grouping import encode_long_format
+from .multiple_testing import add_q_values
+
+# Ways to compare more than two groups
+COMPARISON_MODES = ("one_vs_rest", "all_pairs")
+# group2 of the one-vs-rest comparisons
+REST_LABEL = "rest"
+
+
+def grouped_moments(protein_codes: np.ndarray, group_codes: np.ndarray, values: np.ndarray,
+                    n_proteins: int, n_groups: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Compute count, mean and sum of squared deviations (M2) for every (protein, group) cell.
+
+    Two grouped reductions are used: sums give the means, then squared deviations from those
+    means give M2. This is as fast as accumulating raw sums of squares but does not lose
+    precision on large intensities.
+
+    Returns:
+        Three arrays of shape (n_proteins, n_groups): count, mean and M2
+    """
+    cell = protein_codes * n_groups + group_codes
+    size = n_proteins * n_groups
+    count = np.bincount(cell, minlength=size).astype(np.float64)
+    total = np.bincount(cell, weights=values, minlength=size)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / count
+    deviation = values - mean[cell]
+    m2 = np.bincount(cell, weights=deviation * deviation, minlength=size)
+    shape = (n_proteins, n_groups)
+    return count.reshape(shape), mean.reshape(shape), m2.reshape(shape)
+
+
+def chan_merge(count_a, mean_a, m2_a, count_b, mean_b, m2_b):
+    """
+    Combine two sets of count, mean and M2 with Chan et al.'s parallel update.
+
+    Means of empty cells must be 0, not NaN.
+
+    Returns:
+        Tuple of (count, mean, M2) of the union
+    """
+    count = count_a + count_b
+    with np.errstate(invalid="ignore", divide="ignore"):
+        weight = np.where(count > 0, count_b / count, 0.0)
+    delta = mean_b - mean_a
+    mean = mean_a + delta * weight
+    m2 = m2_a + m2_b + delta * delta * count_a * weight
+    return count, mean, m2
+
+
+def leave_one_out_moments(count: np.ndarray, mean: np.ndarray,
+                          m2: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Count, mean and M2 of all groups but one, for every group.
+
+    Each column is merged from prefix and suffix merges of the other groups, so the rest
+    of every group costs O(n_groups) merges in total and nothing is subtracted.
+
+    Args:
+        count, mean, m2: Arrays of shape (n_proteins, n_groups), see :func:`grouped_moments`
+
+    Returns:
+        Three arrays of the same shape; column g describes every group except g
+    """
+    mean = np.nan_to_num(mean)
+    n_proteins, n_groups = count.shape
+    empty = (np.zeros(n_proteins),) * 3
+    prefix, suffix = [empty], [empty]
+    for g in range(n_groups):
+        prefix.append(chan_merge(*prefix[-1], count[:, g], mean[:, g], m2[:, g]))
+        back = n_groups - 1 - g
+        suffix.append(chan_merge(*suffix[-1], count[:, back], mean[:, back], m2[:, back]))
+    suffix.reverse()
+    rest = [chan_merge(*prefix[g], *suffix[g + 1]) for g in range(n_groups)]
+    return tuple(np.stack(arrays, axis=1) for arrays in zip(*rest))
+
+
+def t_test_from_moments(n1, mean1, var1, n2, mean2, var2, equal_var: bool = True):
+    """
+    Vectorized two-sample t-test from per-group counts, means and sample variances.
+
+    Args:
+        n1, mean1, var1: Count, mean and unbiased variance of the first group
+        n2, mean2, var2: Count, mean and unbiased variance of the second group
+        equal_var: Student's t-test if True, Welch's t-test otherwise
+
+    Returns:
+        Tuple of (t statistic, two-sided p-value) arrays
+    """
+    with np.errstate(invalid="ignore", divide="ignore"):
+        if equal_var:
+            dof = n1 + n2 - 2
+            pooled = ((n1 - 1) * var1 + (n2 - 1) * var2) / dof
+            se = np.sqrt(pooled * (1 / n1 + 1 / n2))
+        else:
+            a = var1 / n1
+            b = var2 / n2
+            se = np.sqrt(a + b)
+            dof = (a + b) ** 2 / (a ** 2 / (n1 - 1) + b ** 2 / (n2 - 1))
+        t_stat = (mean1 - mean2) / se
+        p_val = 2 * t_dist.sf(np.abs(t_stat), dof)
+    return t_stat, p_val
+
+
+def log2_fold_change(mean1, mean2):
+    """log2(mean1 / mean2), set to 0 when either mean is 0."""
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ratio = np.log2(mean1 / mean2)
+    return np.where((mean1 == 0) | (mean2 == 0), 0.0, ratio)
+
+
+def compare_moments(n1, mean1, m2_1, n2, mean2, m2_2, equal_var: bool = True,
+                    min_samples: int = 2) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """
+    t-test and fold change of every protein between two groups from their moments.
+
+    Args:
+        n1, mean1, m2_1: Count, mean and M2 of every protein in the first group
+        n2, mean2, m2_2: The same for the second group
+        equal_var: Student's t-test if True, Welch's t-test otherwise
+        min_samples: Proteins with fewer measurements than this in either group are skipped
+
+    Returns:
+        Tuple of (boolean mask of the proteins kept, dict of 'mean1', 'mean2',
+        'log2_fold_change', 'n1', 'n2', 't_stat' and 'p_val' arrays of the kept proteins)
+    """
+    keep = (n1 >= min_samples) & (n2 >= min_samples)
+    n1, n2 = n1[keep], n2[keep]
+    mean1, mean2 = mean1[keep], mean2[keep]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        var1, var2 = m2_1[keep] / (n1 - 1), m2_2[keep] / (n2 - 1)
+    t_stat, p_val = t_test_from_moments(n1, mean1, var1, n2, mean2, var2, equal_var)
+    return keep, {
+        "mean1": mean1,
+        "mean2": mean2,
+        "log2_fold_change": log2_fold_change(mean1, mean2),
+        "n1": n1.astype(np.int64),
+        "n2": n2.astype(np.int64),
+        "t_stat": t_stat,
+        "p_val": p_val,
+    }
+
+
+def moments_table(protein_labels, group_labels, count: np.ndarray, mean: np.ndarray, m2: np.ndarray,
+                  equal_var: bool = True, min_samples: int = 2,
+                  p_adjust: Optional[str] = "fdr_bh") -> Tuple[pd.DataFrame, np.ndarray]:
+    """
+    Build the differential expression table from per-(protein, group) moments.
+
+    Args:
+        protein_labels: Protein of every row of the moment arrays
+        group_labels: The two groups, matching the two columns of the moment arrays
+        count, mean, m2: Arrays of shape (n_proteins, 2), see :func:`grouped_moments`
+        equal_var: Student's t-test if True, Welch's t-test otherwise
+        min_samples: Proteins with fewer measurements than this in either group are skipped
+        p_adjust: Multiple-testing correction of the 'q_val' column, see
+            :func:`nextgen.analysis.multiple_testing.adjust_p_values`; None leaves it out
+
+    Returns:
+        Tuple of (result table, boolean mask of the proteins kept)
+    """
+    keep, stats = compare_moments(count[:, 0], mean[:, 0], m2[:, 0], count[:, 1], mean[:, 1], m2[:, 1],
+                                  equal_var, min_samples)
+    group1, group2 = group_labels
+    result = pd.DataFrame({
+        "protein_group": protein_labels[keep],
+        f"mean_intensity_{group1}": stats["mean1"],
+        f"mean_intensity_{group2}": stats["mean2"],
+        "log2_fold_change": stats["log2_fold_change"],
+        f"number_of_samples_{group1}": stats["n1"],
+        f"number_of_samples_{group2}": stats["n2"],
+        "t_stat": stats["t_stat"],
+        "p_val": stats["p_val"],
+    })
+    if p_adjust is not None:
+        add_q_values(result, p_adjust)
+    return result, keep
+
+
+def multi_group_table(protein_labels, group_labels, count: np.ndarray, mean: np.ndarray, m2: np.ndarray,
+                      mode: str = "one_vs_rest", equal_var: bool = True, min_samples: int = 2,
+                      p_adjust: Optional[str] = "fdr_bh") -> pd.DataFrame:
+    """
+    Compare every group with the rest, or every pair of groups, from per-(protein, group) moments.
+
+    Args:
+        protein_labels: Protein of every row of the moment arrays
+        group_labels: Group of every column of the moment arrays
+        count, mean, m2: Arrays of shape (n_proteins, n_groups), see :func:`grouped_moments`
+        mode: "one_vs_rest" compares every group with all other groups pooled, "all_pairs"
+            compares every pair of groups
+        equal_var: Student's t-test if True, Welch's t-test otherwise
+        min_samples: Proteins with fewer measurements than this in either group are skipped
+        p_adjust: Multiple-testing correction of the 'q_val' column, applied within each
+            comparison; None leaves it out
+
+    Returns:
+        DataFrame with columns 'group1', 'group2', 'protein_group', 'mean_intensity_group1',
+        'mean_intensity_group2', 'log2_fold_change', 'number_of_samples_group1',
+        'number_of_samples_group2', 't_stat', 'p_val' and optionally 'q_val', one row per
+        comparison and tested protein. group2 is ``REST_LABEL`` for one-vs-rest comparisons
+
+    Raises:
+        ValueError: If the mode is unknown
+    """
+    if mode == "one_vs_rest":
+        rest_count, rest_mean, rest_m2 = leave_one_out_moments(count, mean, m2)
+        pairs = [(g, None) for g in range(len(group_labels))]
+    elif mode == "all_pairs":
+        pairs = list(combinations(range(len(group_labels)), 2))
+    else:
+        raise ValueError(f"Invalid comparison mode: {mode}, expected one of {COMPARISON_MODES}")
+
+    protein_labels = np.asarray(protein_labels, dtype=object)
+    labels = pd.Index(list(group_labels) + ([REST_LABEL] if mode == "one_vs_rest" else []))
+    frames = []
+    for a, b in pairs:
+        if b is None:
+            second = rest_count[:, a], rest_mean[:, a], rest_m2[:, a]
+        else:
+            second = count[:, b], mean[:, b], m2[:, b]
+        keep, stats = compare_moments(count[:, a], mean[:, a], m2[:, a], *second, equal_var, min_samples)
+        n_kept = int(keep.sum())
+        frames.append(pd.DataFrame({
+            "group1": np.full(n_kept, a),
+            "group2": np.full(n_kept, len(group_labels) if b is None else b),
+            "protein_group": protein_labels[keep],
+            "mean_intensity_group1": stats["mean1"],
+            "mean_intensity_group2": stats["mean2"],
+            "log2_fold_change": stats["log2_fold_change"],
+            "number_of_samples_group1": stats["n1"],
+            "number_of_samples_group2": stats["n2"],
+            "t_stat": stats["t_stat"],
+            "p_val": stats["p_val"],
+        }))
+
+    result = pd.concat(frames, ignore_index=True)
+    for col in ("group1", "group2"):
+        result[col] = pd.Categorical.from_codes(result[col].to_numpy(), categories=labels)
+    if p_adjust is not None:
+        add_q_values(result, p_adjust, by=["group1", "group2"])
+    return result
+
+
+def differential_expression(
+    df: pd.DataFrame,
+    protein_col: str = "protein_group",
+    group_col: str = "cancer_type",
+    value_col: str = "intensity",
+    groups: Optional[Sequence[str]] = None,
+    equal_var: bool = True,
+    min_samples: int = 2,
+    auc: bool = False,
+    p_adjust: Optional[str] = "fdr_bh",
+) -> pd.DataFrame:
+    """
+    Per-protein two-sample t-test on long-format protein expression data.
+
+    Every protein is tested in a single pass of grouped NumPy reductions instead of calling
+    ``scipy.stats.ttest_ind`` once per protein.
+
+    Args:
+        df: Long-format DataFrame with one row per protein measurement in a sample
+        protein_col: Column identifying the protein
+        group_col: Column identifying the group (e.g. cancer type)
+        value_col: Column holding the intensity
+        groups: The two groups to compare, in order. Defaults to the two groups present in
+            the data, sorted alphabetically
+        equal_var: Student's t-test if True, Welch's t-test otherwise
+        min_samples: Proteins with fewer measurements than this in either group are skipped
+        auc: Also compute the ROC AUC of each protein for separating group1 from group2
+        p_adjust: Multiple-testing correction of the 'q_val' column, "fdr_bh"
+            (Benjamini-Hochberg) or "bonferroni"; None leaves it out
+
+    Returns:
+        DataFrame with columns 'protein_group', 'mean_intensity_{group1}',
+        'mean_intensity_{group2}', 'log2_fold_change', 'number_of_samples_{group1}',
+        'number_of_samples_{group2}', 't_stat', 'p_val' and optionally 'q_val' and 'auc',
+        one row per tested protein
+
+    Raises:
+        ValueError: If the data does not contain exactly two groups
+    """
+    if groups is not None and len(groups) != 2:
+        raise ValueError(f"Exactly two groups are required, got {len(groups)}")
+    protein_codes, protein_labels, group_codes, group_labels, values = encode_long_format(
+        df, protein_col, group_col, value_col, groups
+    )
+    if len(group_labels) != 2:
+        raise ValueError(f"Exactly two groups are required, got {list(group_labels)}")
+
+    count, mean, m2 = grouped_moments(protein_codes, group_codes, values, len(protein_labels), 2)
+    result, keep = moments_table(protein_labels, group_labels, count, mean, m2, equal_var, min_samples, p_adjust)
+    if auc:
+        ranks, _ = grouped_ranks(protein_codes, values, len(protein_labels))
+        in_first = group_codes == 0
+        rank_sum = np.bincount(protein_codes[in_first], weights=ranks[in_first],
+                               minlength=len(protein_labels))
+        result["auc"] = auc_from_rank_sums(rank_sum, count[:, 0], count[:, 1])[keep]
+    return result
+
+
+def multi_group_differential_expression(
+    df: pd.DataFrame,
+    protein_col: str = "protein_group",
+    group_col: str = "cancer_type",
+    value_col: str = "intensity",
+    mode: str = "one_vs_rest",
+    groups: Optional[Sequence[str]] = None,
+    equal_var: bool = True,
+    min_samples: int = 2,
+    p_adjust: Optional[str] = "fdr_bh",
+) -> pd.DataFrame:
+    """
+    Per-protein t-tests of every group against the rest, or of every pair of groups.
+
+    The per-(protein, group) moments are computed in one pass over the data and every
+    comparison is derived from them, so the data is neither re-queried nor re-scanned per
+    comparison.
+
+    Args:
+        df: Long-format DataFrame with one row per protein measurement in a sample
+        protein_col: Column identifying the protein
+        group_col: Column identifying the group (e.g. cancer type)
+        value_col: Column holding the intensity
+        mode: "one_vs_rest" or "all_pairs"
+        groups: Groups to include, in order. Defaults to all groups, sorted alphabetically;
+            with "one_vs_rest" the rest is made of these groups only
+        equal_var: Student's t-test if True, Welch's t-test otherwise
+        min_samples: Proteins with fewer measurements than this in either group are skipped
+        p_adjust: Multiple-testing correction of the 'q_val' column, applied within each
+            comparison; None leaves it out
+
+    Returns:
+        The table of :func:`multi_group_table`
+
+    Raises:
+        ValueError: If the data has fewer than two groups or the mode is unknown
+    """
+    protein_codes, protein_labels, group_codes, group_labels, values = encode_long_format(
+        df, protein_col, group_col, value_col, groups
+    )
+    if len(group_labels) < 2:
+        raise ValueError(f"At least two groups are required, got {list(group_labels)}")
+    count, mean, m2 = grouped_moments(protein_codes, group_codes, values, len(protein_labels), len(group_labels))
+    return multi_group_table(protein_labels, group_labels, count, mean, m2, mode, equal_var, min_samples, p_adjust)
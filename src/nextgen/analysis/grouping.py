@@ -0,0 +1,38 @@
+from typing import Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+
+def _codes(values: pd.Series, labels: pd.Index) -> np.ndarray:
+    """Position of every value in ``labels``, -1 if it is not there."""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # Look up each category once and take by the integer codes, no per-row strings
+        return labels.get_indexer(values.cat.categories)[values.cat.codes.to_numpy()]
+    return labels.get_indexer(values)
+
+
+def encode_long_format(df: pd.DataFrame, protein_col: str, group_col: str, value_col: str,
+                       groups: Optional[Sequence[str]] = None):
+    """
+    Encode the long-format data as integer protein/group codes and a float value array.
+
+    Rows with a missing protein, group or intensity are dropped. When ``groups`` is given,
+    only rows belonging to those groups are kept and the group codes follow its order;
+    otherwise groups are sorted alphabetically. Categorical and Arrow-backed columns are
+    encoded from their codes without converting them to Python objects.
+
+    Returns:
+        Tuple of (protein_codes, protein_labels, group_codes, group_labels, values)
+    """
+    data = df[[protein_col, group_col, value_col]].dropna()
+    if groups is not None:
+        data = data[data[group_col].isin(groups)]
+        group_labels = pd.Index(groups)
+    else:
+        group_labels = pd.Index(sorted(data[group_col].unique()))
+
+    protein_codes, protein_labels = pd.factorize(data[protein_col], sort=True)
+    group_codes = _codes(data[group_col], group_labels)
+    values = data[value_col].to_numpy(dtype=np.float64)
+    return protein_codes, protein_labels, group_codes, group_labels, values
@@ -0,0 +1,80 @@
+from typing import Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+# Methods accepted by adjust_p_values
+P_ADJUST_METHODS = ("fdr_bh", "bonferroni")
+
+
+def benjamini_hochberg(p_vals) -> np.ndarray:
+    """
+    Benjamini-Hochberg adjusted p-values (q-values) controlling the false discovery rate.
+
+    Missing p-values are left missing and do not count as tests. Equals
+    ``statsmodels.stats.multitest.multipletests(p, method="fdr_bh")[1]``.
+    """
+    p_vals = np.asarray(p_vals, dtype=np.float64)
+    q_vals = np.full(p_vals.shape, np.nan)
+    tested = np.flatnonzero(~np.isnan(p_vals))
+    n = len(tested)
+    if n == 0:
+        return q_vals
+    order = tested[np.argsort(p_vals[tested], kind="stable")]
+    scaled = p_vals[order] * n / np.arange(1, n + 1)
+    # Step-up: each q-value is the smallest scaled p-value at or above its rank
+    q_vals[order] = np.minimum(np.minimum.accumulate(scaled[::-1])[::-1], 1.0)
+    return q_vals
+
+
+def bonferroni(p_vals) -> np.ndarray:
+    """Bonferroni adjusted p-values controlling the family-wise error rate; missing stay missing."""
+    p_vals = np.asarray(p_vals, dtype=np.float64)
+    return np.minimum(p_vals * np.count_nonzero(~np.isnan(p_vals)), 1.0)
+
+
+def adjust_p_values(p_vals, method: str = "fdr_bh") -> np.ndarray:
+    """
+    Adjust p-values for multiple testing.
+
+    Args:
+        p_vals: Raw p-values of one family of tests
+        method: "fdr_bh" (Benjamini-Hochberg) or "bonferroni"
+
+    Raises:
+        ValueError: If the method is unknown
+    """
+    if method == "fdr_bh":
+        return benjamini_hochberg(p_vals)
+    if method == "bonferroni":
+        return bonferroni(p_vals)
+    raise ValueError(f"Invalid p-value adjustment method: {method}, expected one of {P_ADJUST_METHODS}")
+
+
+def add_q_values(result: pd.DataFrame, method: str = "fdr_bh", p_col: str = "p_val",
+                 q_col: str = "q_val", by: Optional[Union[str, Sequence[str]]] = None) -> pd.DataFrame:
+    """
+    Insert adjusted p-values after the p-value column of a results table.
+
+    Args:
+        result: Results table with one row per test
+        method: See :func:`adjust_p_values`
+        p_col: Column holding the raw p-values
+        q_col: Column to write the adjusted p-values to
+        by: Columns identifying separate families of tests, e.g. the comparison of a
+            multi-group table; every family is adjusted on its own. Defaults to one family
+
+    Returns:
+        ``result``, modified in place
+    """
+    if by is None:
+        q_vals = adjust_p_values(result[p_col].to_numpy(), method)
+    else:
+        q_vals = np.empty(len(result))
+        for rows in result.groupby(by, sort=False, observed=True).indices.values():
+            q_vals[rows] = adjust_p_values(result[p_col].to_numpy()[rows], method)
+    if q_col in result.columns:
+        result[q_col] = q_vals
+    else:
+        result.insert(result.columns.get_loc(p_col) + 1, q_col, q_vals)
+    return result
@@ -0,0 +1,299 @@
+"""
+Run per-protein statistics on several cores by sharding the proteins across a process pool.
+
+The long-format data is encoded once, sorted by protein and copied into a single shared
+memory block. Workers attach to the block and read their proteins' intensities through
+NumPy views, so no DataFrame is pickled; only the shard boundaries and protein labels are
+sent to each worker. Shard results are concatenated in protein order.
+
+Worker processes are started with the forkserver method (spawn where it is not
+available): forking the multithreaded chat server can deadlock a worker on a lock another
+thread held. Starting them is slow, so :func:`shared_executor` keeps one pool per worker
+count for the life of the process.
+
+Environment variables:
+    NEXTGEN_ANALYSIS_WORKERS  Worker processes (default: the number of CPUs)
+"""
+
+import atexit
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy.stats import mannwhitneyu
+
+from .grouping import encode_long_format
+
+# Shards per worker; more shards than workers evens out proteins of different sizes
+SHARDS_PER_WORKER = 4
+
+# Start method of the worker processes
+START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+
+def default_workers() -> int:
+    """The NEXTGEN_ANALYSIS_WORKERS environment variable, or the number of CPUs."""
+    return int(os.environ.get("NEXTGEN_ANALYSIS_WORKERS", 0)) or os.cpu_count() or 1
+
+
+@dataclass
+class ProteinShard:
+    """
+    The measurements of a contiguous range of proteins, sorted by protein.
+
+    The arrays are views of shared memory that are only valid during the call of the shard
+    function; results must not keep references to them.
+
+    Attributes:
+        protein_labels: Protein of every entry of the shard
+        group_labels: All groups, indexed by ``group_codes``
+        offsets: Rows of protein i are ``offsets[i]:offsets[i + 1]``
+        group_codes: Group code of every row
+        values: Intensity of every row
+    """
+
+    protein_labels: np.ndarray
+    group_labels: pd.Index
+    offsets: np.ndarray
+    group_codes: np.ndarray
+    values: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.protein_labels)
+
+    def __iter__(self) -> Iterator[Tuple[str, np.ndarray, np.ndarray]]:
+        """Yield (protein, group codes, values) for every protein of the shard."""
+        for i, protein in enumerate(self.protein_labels):
+            rows = slice(self.offsets[i], self.offsets[i + 1])
+            yield protein, self.group_codes[rows], self.values[rows]
+
+
+ShardFunction = Callable[..., pd.DataFrame]
+
+
+def _run_shard(block_name: str, n_rows: int, rows: Tuple[int, int], offsets: np.ndarray,
+               protein_labels: np.ndarray, group_labels: pd.Index, func: ShardFunction,
+               kwargs: dict) -> pd.DataFrame:
+    """Worker entry point: attach to the shared block and run ``func`` on one shard."""
+    block = shared_memory.SharedMemory(name=block_name)
+    try:
+        values = np.ndarray((n_rows,), dtype=np.float64, buffer=block.buf)
+        group_codes = np.ndarray((n_rows,), dtype=np.int32, buffer=block.buf, offset=n_rows * 8)
+        start, end = rows
+        shard = ProteinShard(protein_labels, group_labels, offsets - start,
+                             group_codes[start:end], values[start:end])
+        result = func(shard, **kwargs)
+        del shard, values, group_codes
+        return result
+    finally:
+        block.close()
+
+
+class ProteinShardExecutor:
+    """
+    Process pool that runs a shard function over all proteins of a long-format DataFrame.
+
+    The pool is started on first use and reused by later calls until :meth:`shutdown`;
+    :meth:`map` may be called from several threads at once.
+
+    Example:
+        >>> with ProteinShardExecutor(max_workers=8) as executor:
+        ...     result = executor.map(mann_whitney_exact_shard, df)
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, shards_per_worker: int = SHARDS_PER_WORKER):
+        """
+        Args:
+            max_workers: Worker processes, see :func:`default_workers`. With 1 worker the
+                shards run in the calling process
+            shards_per_worker: Shards created per worker for load balancing
+        """
+        self.max_workers = max_workers or default_workers()
+        self.shards_per_worker = shards_per_worker
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                 mp_context=multiprocessing.get_context(START_METHOD))
+            return self._pool
+
+    def _shard_bounds(self, offsets: np.ndarray, min_shards: int = 1) -> List[Tuple[int, int]]:
+        """Split the proteins into ranges of about the same number of rows."""
+        n_proteins = len(offsets) - 1
+        n_shards = min(n_proteins, max(min_shards, self.max_workers * self.shards_per_worker))
+        targets = np.linspace(0, offsets[-1], n_shards + 1)[1:-1]
+        cuts = np.unique(np.concatenate([[0], np.searchsorted(offsets, targets), [n_proteins]]))
+        return list(zip(cuts[:-1], cuts[1:]))
+
+    def map(
+        self,
+        func: ShardFunction,
+        df: pd.DataFrame,
+        protein_col: str = "protein_group",
+        group_col: str = "cancer_type",
+        value_col: str = "intensity",
+        groups: Optional[Sequence[str]] = None,
+        min_shards: int = 1,
+        **kwargs,
+    ) -> pd.DataFrame:
+        """
+        Run ``func(shard, **kwargs)`` on every protein shard and concatenate the results.
+
+        Args:
+            func: Module-level function taking a :class:`ProteinShard` and returning a
+                DataFrame with one row per protein it tested
+            df: Long-format DataFrame with one row per protein measurement in a sample
+            protein_col, group_col, value_col: Columns of the protein, group and intensity
+            groups: Groups to keep, in code order. Defaults to all groups, sorted alphabetically
+            min_shards: Split the proteins into at least this many shards, e.g. to bound
+                the memory a shard function needs per shard
+            **kwargs: Passed to ``func``
+
+        Returns:
+            The shard results, in protein order
+        """
+        protein_codes, protein_labels, group_codes, group_labels, values = encode_long_format(
+            df, protein_col, group_col, value_col, groups
+        )
+        order = np.argsort(protein_codes, kind="stable")
+        offsets = np.zeros(len(protein_labels) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(protein_codes, minlength=len(protein_labels)), out=offsets[1:])
+        protein_labels = np.asarray(protein_labels, dtype=object)
+        bounds = self._shard_bounds(offsets, min_shards)
+        if not bounds:
+            return func(ProteinShard(protein_labels, group_labels, offsets, group_codes, values), **kwargs)
+
+        if self.max_workers == 1:
+            values, group_codes = values[order], group_codes[order].astype(np.int32)
+            results = [
+                func(ProteinShard(protein_labels[a:b], group_labels, offsets[a:b + 1] - offsets[a],
+                                  group_codes[offsets[a]:offsets[b]], values[offsets[a]:offsets[b]]), **kwargs)
+                for a, b in bounds
+            ]
+            return pd.concat(results, ignore_index=True)
+
+        n_rows = len(values)
+        block = shared_memory.SharedMemory(create=True, size=max(n_rows * 12, 1))
+        try:
+            np.ndarray((n_rows,), dtype=np.float64, buffer=block.buf)[:] = values[order]
+            np.ndarray((n_rows,), dtype=np.int32, buffer=block.buf, offset=n_rows * 8)[:] = group_codes[order]
+            pool = self._get_pool()
+            futures = [
+                pool.submit(_run_shard, block.name, n_rows, (offsets[a], offsets[b]),
+                                  offsets[a:b + 1], protein_labels[a:b], group_labels, func, kwargs)
+                for a, b in bounds
+            ]
+            results = [future.result() for future in futures]
+        finally:
+            block.close()
+            block.unlink()
+        return pd.concat(results, ignore_index=True)
+
+
+_shared_executors: Dict[int, ProteinShardExecutor] = {}
+_shared_lock = threading.Lock()
+
+
+def shared_executor(max_workers: Optional[int] = None) -> ProteinShardExecutor:
+    """
+    Process-wide executor with ``max_workers`` workers (see :func:`default_workers`).
+
+    Its pool is started on first use and shut down when the interpreter exits, so repeated
+    calls do not pay for starting worker processes again.
+    """
+    max_workers = max_workers or default_workers()
+    with _shared_lock:
+        if max_workers not in _shared_executors:
+            _shared_executors[max_workers] = ProteinShardExecutor(max_workers)
+        return _shared_executors[max_workers]
+
+
+@atexit.register
+def _shutdown_shared_executors() -> None:
+    with _shared_lock:
+        for executor in _shared_executors.values():
+            executor.shutdown()
+        _shared_executors.clear()
+
+
+def mann_whitney_exact_shard(shard: ProteinShard, alternative: str = "two-sided",
+                             min_samples: int = 1) -> pd.DataFrame:
+    """
+    Mann-Whitney U test of the first group against the second for every protein of a shard,
+    with the exact null distribution where there are no ties (``method="auto"`` otherwise).
+    """
+    proteins, u_stats, p_vals, n1s, n2s = [], [], [], [], []
+    for protein, group_codes, values in shard:
+        first, second = values[group_codes == 0], values[group_codes == 1]
+        if len(first) < min_samples or len(second) < min_samples:
+            continue
+        method = "exact" if len(np.unique(values)) == len(values) else "auto"
+        u_stat, p_val = mannwhitneyu(first, second, alternative=alternative, method=method)
+        proteins.append(protein)
+        u_stats.append(u_stat)
+        p_vals.append(p_val)
+        n1s.append(len(first))
+        n2s.append(len(second))
+    return pd.DataFrame({
+        "protein_group": pd.Series(proteins, dtype=object),
+        "n1": np.array(n1s, dtype=np.int64),
+        "n2": np.array(n2s, dtype=np.int64),
+        "mann_whitney_u": np.array(u_stats, dtype=np.float64),
+        "mann_whitney_p_val": np.array(p_vals, dtype=np.float64),
+    })
+
+
+def mann_whitney_exact(
+    df: pd.DataFrame,
+    protein_col: str = "protein_group",
+    group_col: str = "cancer_type",
+    value_col: str = "intensity",
+    groups: Optional[Sequence[str]] = None,
+    alternative: str = "two-sided",
+    max_workers: Optional[int] = None,
+) -> pd.DataFrame:
+    """
+    Exact Mann-Whitney U test of every protein between two groups, on ``max_workers`` cores.
+
+    Args:
+        df: Long-format DataFrame with one row per protein measurement in a sample
+        protein_col, group_col, value_col: Columns of the protein, group and intensity
+        groups: The two groups to compare, in order. Defaults to the two groups present in
+            the data, sorted alphabetically
+        alternative: "two-sided", "less" or "greater"
+        max_workers: Worker processes of the :func:`shared_executor` the test runs on
+
+    Returns:
+        DataFrame with columns 'protein_group', 'n1', 'n2', 'mann_whitney_u' and
+        'mann_whitney_p_val', one row per protein measured in both groups, in protein order
+
+    Raises:
+        ValueError: If the data does not contain exactly two groups
+    """
+    if groups is None:
+        groups = sorted(df[group_col].dropna().unique())
+    if len(groups) != 2:
+        raise ValueError(f"Exactly two groups are required, got {list(groups)}")
+    return shared_executor(max_workers).map(mann_whitney_exact_shard, df, protein_col, group_col, value_col,
+                                            groups, alternative=alternative)
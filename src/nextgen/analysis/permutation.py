@@ -0,0 +1,231 @@
+from typing import Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from .grouping import _codes
+from .multiple_testing import add_q_values
+from .parallel import ProteinShard, shared_executor
+
+# Statistics the permutation test can use
+PERMUTATION_STATISTICS = ("t", "mean_difference")
+# Upper bound on the memory of the arrays a shard works on
+MAX_BATCH_BYTES = 256 * 1024 * 1024
+# (protein x sample) arrays alive at once: the three data matrices and their active rows
+_DENSE_ARRAYS = 6
+# (protein x permutation) arrays alive at once while a batch is evaluated
+_BATCH_ARRAYS = 8
+# Size of the first batch; later batches double, so proteins that stop early stop soon
+MIN_BATCH = 100
+
+
+def _statistic(n1, s1, q1, n_total, s_total, q_total, statistic: str, equal_var: bool) -> np.ndarray:
+    """
+    Test statistic of the first group against the second from per-group counts, sums and
+    sums of squares. Arrays broadcast, so this evaluates one label vector or a batch.
+    """
+    n2, s2, q2 = n_total - n1, s_total - s1, q_total - q1
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean1, mean2 = s1 / n1, s2 / n2
+        if statistic == "mean_difference":
+            return mean1 - mean2
+        var1 = (q1 - s1 * mean1) / (n1 - 1)
+        var2 = (q2 - s2 * mean2) / (n2 - 1)
+        if equal_var:
+            pooled = ((n1 - 1) * var1 + (n2 - 1) * var2) / (n1 + n2 - 2)
+            se = np.sqrt(pooled * (1 / n1 + 1 / n2))
+        else:
+            se = np.sqrt(var1 / n1 + var2 / n2)
+        return (mean1 - mean2) / se
+
+
+def permutation_shard(
+    shard: ProteinShard,
+    sample_group: np.ndarray,
+    statistic: str = "t",
+    equal_var: bool = True,
+    n_permutations: int = 10000,
+    seed: Optional[int] = None,
+    stop_exceedances: Optional[int] = 20,
+    min_samples: int = 2,
+    max_batch_bytes: int = MAX_BATCH_BYTES,
+) -> pd.DataFrame:
+    """
+    Permutation test of the proteins of a shard whose group codes are sample codes.
+
+    Args:
+        shard: Proteins with the sample of every measurement as its group code
+        sample_group: Group (0 or 1) of every sample code
+        Other arguments: See :func:`permutation_test`
+
+    Returns:
+        DataFrame with columns 'protein_group', 'n1', 'n2', 'statistic', 'n_permutations',
+        'exceedances' and 'perm_p_val', one row per tested protein of the shard
+    """
+    n_proteins, n_samples = len(shard), len(sample_group)
+    protein_codes = np.repeat(np.arange(n_proteins), np.diff(shard.offsets))
+    sample_codes = shard.group_codes
+
+    # (protein x sample) intensities, centred per protein so the sums of squares do not
+    # lose precision; missing measurements are 0 and masked out of the counts
+    values = shard.values - (np.bincount(protein_codes, weights=shard.values, minlength=n_proteins)
+                             / np.maximum(np.bincount(protein_codes, minlength=n_proteins), 1))[protein_codes]
+    shape = (n_proteins, n_samples)
+    observed = np.zeros(shape)
+    observed[protein_codes, sample_codes] = 1.0
+    x = np.zeros(shape)
+    x[protein_codes, sample_codes] = values
+    x2 = x * x
+
+    labels = (sample_group == 0).astype(np.float64)
+    n1, s1, q1 = observed @ labels, x @ labels, x2 @ labels
+    n_total, s_total, q_total = observed.sum(axis=1), x.sum(axis=1), x2.sum(axis=1)
+    keep = (n1 >= min_samples) & (n_total - n1 >= min_samples)
+    observed, x, x2 = observed[keep], x[keep], x2[keep]
+    n1, s1, q1 = n1[keep], s1[keep], q1[keep]
+    n_total, s_total, q_total = n_total[keep], s_total[keep], q_total[keep]
+    t_obs = _statistic(n1, s1, q1, n_total, s_total, q_total, statistic, equal_var)
+    # Permuted statistics within rounding of the observed one count as ties
+    threshold = np.abs(t_obs) * (1 - 1e-12)
+
+    rng = np.random.default_rng(seed)
+    n_kept = len(t_obs)
+    done = np.zeros(n_kept, dtype=np.int64)
+    exceedances = np.zeros(n_kept, dtype=np.int64)
+    active = np.arange(n_kept)
+    while len(active):
+        remaining = n_permutations - done[active[0]]
+        if remaining <= 0:
+            break
+        # The stop check runs after every scheduled batch; a batch too large for the memory
+        # budget is run in parts, which draw the same permutations
+        batch = int(min(max(MIN_BATCH, done[active[0]]), remaining))
+        data = observed[active], x[active], x2[active]
+        free = max_batch_bytes - 8 * _DENSE_ARRAYS * n_kept * n_samples
+        part = int(max(1, free // (8 * (n_samples + _BATCH_ARRAYS * len(active)))))
+        for start in range(0, batch, part):
+            size = min(part, batch - start)
+            # One row per permutation of the sample labels, transposed to (sample x permutation)
+            permuted = rng.permuted(np.broadcast_to(labels, (size, len(labels))), axis=1).T
+            t_perm = _statistic(
+                data[0] @ permuted, data[1] @ permuted, data[2] @ permuted,
+                n_total[active, None], s_total[active, None], q_total[active, None], statistic, equal_var,
+            )
+            exceedances[active] += (np.abs(t_perm) >= threshold[active, None]).sum(axis=1)
+        done[active] += batch
+        if stop_exceedances is not None:
+            active = active[exceedances[active] < stop_exceedances]
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        # Sequential estimate for stopped proteins, (1 + exceedances) / (1 + permutations) otherwise
+        stopped = exceedances >= (stop_exceedances or np.iinfo(np.int64).max)
+        p_val = np.where(stopped, exceedances / done, (1 + exceedances) / (1 + done))
+    p_val[np.isnan(t_obs)] = np.nan
+
+    return pd.DataFrame({
+        "protein_group": pd.Series(np.asarray(shard.protein_labels, dtype=object)[keep], dtype=object),
+        "n1": n1.astype(np.int64),
+        "n2": (n_total - n1).astype(np.int64),
+        "statistic": t_obs,
+        "n_permutations": done,
+        "exceedances": exceedances,
+        "perm_p_val": p_val,
+    })
+
+
+def permutation_test(
+    df: pd.DataFrame,
+    protein_col: str = "protein_group",
+    group_col: str = "cancer_type",
+    value_col: str = "intensity",
+    sample_col: str = "run",
+    groups: Optional[Sequence[str]] = None,
+    statistic: str = "t",
+    equal_var: bool = True,
+    n_permutations: int = 10000,
+    seed: Optional[int] = None,
+    stop_exceedances: Optional[int] = 20,
+    min_samples: int = 2,
+    p_adjust: Optional[str] = "fdr_bh",
+    max_batch_bytes: int = MAX_BATCH_BYTES,
+    max_workers: Optional[int] = None,
+) -> pd.DataFrame:
+    """
+    Two-sided permutation test of every protein between two groups.
+
+    The group labels of the samples are permuted, not the measurements, so the proteins of
+    a sample move together. The data is laid out as a (protein x sample) matrix and every
+    batch of permutations is a (sample x permutation) label matrix: three matrix products
+    give the group counts, sums and sums of squares of every protein under every
+    permutation of the batch. ``max_batch_bytes`` bounds the memory of a shard: the
+    proteins are split into enough shards for their (protein x sample) matrices to take at
+    most half of it, and batches are run in parts whose label matrix and
+    (protein x permutation) arrays fit in the rest. The parts draw the same permutations as
+    the whole batch, so the p-values do not depend on the budget. The shards run in the
+    worker processes of :func:`nextgen.analysis.parallel.shared_executor`; every shard
+    draws the same permutations from ``seed``.
+
+    With ``stop_exceedances`` set, a protein stops once that many permuted statistics were
+    at least as extreme as the observed one (Besag and Clifford's sequential p-value,
+    exceedances / permutations run). Such proteins are clearly not significant, so almost
+    all of the work goes to the proteins whose p-value is small.
+
+    Args:
+        df: Long-format DataFrame with one row per protein measurement in a sample
+        protein_col: Column identifying the protein
+        group_col: Column identifying the group (e.g. cancer type)
+        value_col: Column holding the intensity
+        sample_col: Column identifying the sample; its rows share one group label
+        groups: The two groups to compare, in order. Defaults to the two groups present in
+            the data, sorted alphabetically
+        statistic: "t" (t statistic) or "mean_difference"
+        equal_var: Student's t statistic if True, Welch's otherwise
+        n_permutations: Permutations per protein, unless it stops early
+        seed: Seed of the random generator; the same seed gives the same p-values
+        stop_exceedances: Exceedances after which a protein stops; None runs every
+            permutation for every protein
+        min_samples: Proteins with fewer measurements than this in either group are skipped
+        p_adjust: Multiple-testing correction of the 'q_val' column; None leaves it out
+        max_batch_bytes: Memory budget of the arrays of one shard
+        max_workers: Worker processes, see :func:`nextgen.analysis.parallel.default_workers`
+
+    Returns:
+        DataFrame with columns 'protein_group', 'number_of_samples_{group1}',
+        'number_of_samples_{group2}', the observed 'statistic', 'n_permutations' run,
+        'exceedances', 'perm_p_val' and optionally 'q_val', one row per tested protein
+
+    Raises:
+        ValueError: If the data does not contain exactly two groups, a sample belongs to
+            more than one group or the statistic is unknown
+    """
+    if statistic not in PERMUTATION_STATISTICS:
+        raise ValueError(f"Invalid statistic: {statistic}, expected one of {PERMUTATION_STATISTICS}")
+    data = df[[protein_col, group_col, value_col, sample_col]].dropna()
+    group_labels = pd.Index(groups if groups is not None else sorted(data[group_col].unique()))
+    if len(group_labels) != 2:
+        raise ValueError(f"Exactly two groups are required, got {list(group_labels)}")
+    data = data[data[group_col].isin(group_labels)]
+
+    sample_codes, sample_labels = pd.factorize(data[sample_col])
+    group_codes = _codes(data[group_col], group_labels)
+    sample_group = np.full(len(sample_labels), -1)
+    sample_group[sample_codes] = group_codes
+    if (sample_group[sample_codes] != group_codes).any():
+        raise ValueError(f"Every {sample_col} must belong to a single {group_col}")
+
+    # Enough shards for the dense matrices of a shard to take at most half of the budget
+    dense_bytes = 8 * _DENSE_ARRAYS * data[protein_col].nunique() * len(sample_labels)
+    min_shards = int(np.ceil(dense_bytes / max(max_batch_bytes // 2, 1)))
+    # The shards see the samples as groups, coded in sample_labels order
+    result = shared_executor(max_workers).map(
+        permutation_shard, data, protein_col, sample_col, value_col, groups=sample_labels,
+        min_shards=min_shards,
+        sample_group=sample_group, statistic=statistic, equal_var=equal_var,
+        n_permutations=n_permutations, seed=seed, stop_exceedances=stop_exceedances,
+        min_samples=min_samples, max_batch_bytes=max_batch_bytes,
+    )
+    group1, group2 = group_labels
+    result = result.rename(columns={"n1": f"number_of_samples_{group1}", "n2": f"number_of_samples_{group2}"})
+    if p_adjust is not None:
+        add_q_values(result, p_adjust, p_col="perm_p_val")
+    return result
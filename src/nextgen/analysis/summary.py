@@ -0,0 +1,128 @@
+"""
+Differential expression from the protein_group_stats summary table of the database.
+
+The table holds count, sum and sum of squares of the intensity (and of its log2) per
+(protein_group, cancer_type), so the t-tests and fold changes of any pair of cancer types,
+or of every cancer type against the rest, are computed from a few thousand summary rows
+instead of the raw measurements.
+"""
+
+import sqlite3
+from contextlib import closing
+from typing import Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from .accumulators import GroupedMoments
+
+# Count, sum and sum of squares columns of protein_group_stats for each scale
+SCALE_COLUMNS = {
+    "linear": ("n", "sum_intensity", "sum_sq_intensity"),
+    "log2": ("n_log", "sum_log2_intensity", "sum_sq_log2_intensity"),
+}
+
+
+def read_protein_group_stats(db_path: str, cancer_types: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    """
+    Read the protein_group_stats table of a SQLite database built by construct_database.
+
+    Args:
+        db_path: Path to the SQLite database
+        cancer_types: Only read these cancer types. Defaults to all
+
+    Returns:
+        The table, one row per (protein_group, cancer_type)
+    """
+    sql = "SELECT * FROM protein_group_stats"
+    params = ()
+    if cancer_types is not None:
+        sql += f" WHERE cancer_type IN ({', '.join('?' for _ in cancer_types)})"
+        params = tuple(cancer_types)
+    # A sqlite3 connection used as a context manager only ends the transaction
+    with closing(sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)) as conn:
+        return pd.read_sql_query(sql, conn, params=params)
+
+
+def summary_moments(summary: pd.DataFrame, scale: str = "linear", protein_col: str = "protein_group",
+                    group_col: str = "cancer_type") -> GroupedMoments:
+    """
+    Per-(protein, group) count, mean and M2 from summary sums.
+
+    Args:
+        summary: Rows of protein_group_stats
+        scale: "linear" for the intensity, "log2" for log2 of the positive intensities
+        protein_col, group_col: Columns of the protein and the group
+
+    Raises:
+        ValueError: If the scale is unknown
+    """
+    if scale not in SCALE_COLUMNS:
+        raise ValueError(f"Invalid scale: {scale}, expected one of {tuple(SCALE_COLUMNS)}")
+    count_col, sum_col, sum_sq_col = SCALE_COLUMNS[scale]
+    protein_codes, protein_labels = pd.factorize(summary[protein_col], sort=True)
+    group_codes, group_labels = pd.factorize(summary[group_col], sort=True)
+
+    shape = (len(protein_labels), len(group_labels))
+    count, total, total_sq = np.zeros(shape), np.zeros(shape), np.zeros(shape)
+    count[protein_codes, group_codes] = summary[count_col].to_numpy(dtype=np.float64)
+    total[protein_codes, group_codes] = summary[sum_col].to_numpy(dtype=np.float64)
+    total_sq[protein_codes, group_codes] = summary[sum_sq_col].to_numpy(dtype=np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where(count > 0, total / count, 0.0)
+    # Sums of squares lose precision to rounding; M2 cannot be negative
+    m2 = np.maximum(total_sq - total * mean, 0.0)
+
+    moments = GroupedMoments(protein_col, group_col)
+    moments.protein_labels = pd.Index(protein_labels, dtype=object)
+    moments.group_labels = pd.Index(group_labels, dtype=object)
+    moments.count, moments.mean, moments.m2 = count, mean, m2
+    return moments
+
+
+def summary_differential_expression(
+    summary: pd.DataFrame,
+    groups: Optional[Sequence[str]] = None,
+    mode: str = "one_vs_rest",
+    scale: str = "linear",
+    equal_var: bool = True,
+    min_samples: int = 2,
+    p_adjust: Optional[str] = "fdr_bh",
+) -> pd.DataFrame:
+    """
+    Per-protein t-tests and fold changes between cancer types from the summary table.
+
+    Args:
+        summary: Rows of protein_group_stats, see :func:`read_protein_group_stats`
+        groups: Cancer types to compare. Two groups give the two-group table, more (or
+            None, all cancer types) give the multi-group table of ``mode``
+        mode: "one_vs_rest" or "all_pairs", for more than two groups
+        scale: "linear" tests the intensity; "log2" tests log2 intensities and reports
+            the difference of their means as 'log2_fold_change'
+        equal_var: Student's t-test if True, Welch's t-test otherwise
+        min_samples: Proteins with fewer measurements than this in either group are skipped
+        p_adjust: Multiple-testing correction of the 'q_val' column; None leaves it out
+
+    Returns:
+        With two groups, the table of :func:`nextgen.analysis.differential_expression`
+        (without 'auc'); otherwise the table of
+        :func:`nextgen.analysis.multi_group_differential_expression`. In log2 scale the
+        mean columns hold mean log2 intensities
+
+    Raises:
+        ValueError: If fewer than two groups are available or an argument is invalid
+    """
+    if groups is not None:
+        summary = summary[summary["cancer_type"].isin(groups)]
+    moments = summary_moments(summary, scale)
+    if len(moments.group_labels) == 2 or (groups is not None and len(groups) == 2):
+        result = moments.finalize(groups, equal_var, min_samples, p_adjust)
+        mean_cols = [col for col in result.columns if col.startswith("mean_intensity_")]
+    else:
+        result = moments.compare(mode, equal_var, min_samples, p_adjust)
+        mean_cols = ["mean_intensity_group1", "mean_intensity_group2"]
+
+    if scale == "log2":
+        result["log2_fold_change"] = result[mean_cols[0]] - result[mean_cols[1]]
+        result = result.rename(columns={col: col.replace("mean_intensity_", "mean_log2_intensity_") for col in mean_cols})
+    return result
@@ -2,9 +2,8 @@ import pandas as pd
 from scipy.stats import ttest_ind
 import numpy as np
 
-def perform_t_test(df):
+def perform_t_test(df, chart_path='/Users/cgu3/Documents/nextgen/exports/charts/temp_chart.png'):
     import pandas as pd
-    import matplotlib.pyplot as plt
     from scipy.stats import ttest_ind
 
     # Pre-group all relevant data
@@ -27,11 +26,15 @@ def perform_t_test(df):
         results.append({'protein_group': protein, 't_stat': t_stat, 'p_val': p_val})
 
     result_df = pd.DataFrame(results)
+    if chart_path is None:
+        return {'type': 'dataframe', 'value': result_df}
+
+    import matplotlib.pyplot as plt
     plt.hist(result_df['p_val'], bins=50)
     plt.xlabel('p-value')
     plt.ylabel('Frequency')
     plt.title('Histogram of p-values')
-    plt.savefig('/Users/cgu3/Documents/nextgen/exports/charts/temp_chart.png')
+    plt.savefig(chart_path)
 
     return {'type': 'dataframe', 'value': result_df}
 
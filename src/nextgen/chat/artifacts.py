@@ -0,0 +1,283 @@
+"""
+Store of the downloadable files of the chat interface.
+
+Every artifact is addressed by the SHA-256 of its content, so asking the same question
+twice (or two sessions running the same example) stores one file. Sessions hold
+references to the artifacts they were offered; the store keeps its total size under a
+quota by evicting the least recently used artifacts, unreferenced ones first, and drops
+artifacts not used for longer than a TTL.
+
+The store can be tuned with environment variables:
+    NEXTGEN_ARTIFACT_DIR        Directory of the store (default: nextgen-artifacts in the system temp dir)
+    NEXTGEN_ARTIFACT_QUOTA_MB   Total size of the stored files in MiB (default 2048)
+    NEXTGEN_ARTIFACT_TTL        Seconds an artifact is kept after its last use (default 86400)
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+import pandas as pd
+
+from nextgen.chat.downloads import write_parquet
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_DIR = os.environ.get("NEXTGEN_ARTIFACT_DIR") or os.path.join(tempfile.gettempdir(), "nextgen-artifacts")
+ARTIFACT_QUOTA_BYTES = int(float(os.environ.get("NEXTGEN_ARTIFACT_QUOTA_MB", 2048)) * 1024 * 1024)
+ARTIFACT_TTL = float(os.environ.get("NEXTGEN_ARTIFACT_TTL", 86400))
+
+# Bytes read at a time when hashing a file
+_HASH_BLOCK = 1024 * 1024
+
+
+def file_digest(path: str) -> str:
+    """SHA-256 of the content of a file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def frame_digest(df: pd.DataFrame, kind: str = "csv") -> str:
+    """
+    Digest of a DataFrame's columns, dtypes and values, computed without serializing it.
+
+    Args:
+        df: The DataFrame
+        kind: Format the DataFrame is written in; the same frame in another format is a
+            different artifact
+    """
+    digest = hashlib.sha256(kind.encode("utf-8"))
+    digest.update(repr([(str(col), str(dtype)) for col, dtype in df.dtypes.items()]).encode("utf-8"))
+    digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return "frame-" + digest.hexdigest()
+
+
+@dataclass
+class Artifact:
+    """A stored file and the sessions referencing it."""
+
+    key: str
+    path: Path
+    size: int
+    last_used: float = field(default_factory=time.time)
+    refs: Counter = field(default_factory=Counter)
+
+
+class ArtifactStore:
+    """
+    Content-addressed files with a size quota, LRU/TTL eviction and per-session references.
+
+    Each artifact lives in ``<root>/<key>/<name>``, so downloads keep the file name of the
+    first request. Artifacts referenced by a live session are only evicted when the
+    unreferenced ones do not free enough space or when they outlive the TTL.
+
+    Args:
+        root: Directory of the store; files left there by an earlier process are adopted
+        quota_bytes: Total size the store is kept under
+        ttl: Seconds an artifact is kept after its last use
+    """
+
+    def __init__(self, root: str = ARTIFACT_DIR, quota_bytes: int = ARTIFACT_QUOTA_BYTES,
+                 ttl: float = ARTIFACT_TTL):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.quota_bytes = quota_bytes
+        self.ttl = ttl
+        self._artifacts: Dict[str, Artifact] = {}
+        self._lock = threading.Lock()
+        self._adopt()
+        self.evict()
+
+    @property
+    def total_bytes(self) -> int:
+        with self._lock:
+            return sum(artifact.size for artifact in self._artifacts.values())
+
+    def _adopt(self) -> None:
+        # Temporary files of interrupted writes are files in the root; artifacts are directories
+        for entry in self.root.iterdir():
+            files = [path for path in entry.iterdir() if path.is_file()] if entry.is_dir() else []
+            if len(files) != 1 or files[0].name.endswith(".tmp"):
+                shutil.rmtree(entry, ignore_errors=True) if entry.is_dir() else entry.unlink(missing_ok=True)
+                continue
+            stat = files[0].stat()
+            self._artifacts[entry.name] = Artifact(entry.name, files[0], stat.st_size, last_used=stat.st_mtime)
+
+    def _lookup(self, key: str, session_id: Optional[str]) -> Optional[str]:
+        with self._lock:
+            artifact = self._artifacts.get(key)
+            if artifact is None or not artifact.path.exists():
+                self._artifacts.pop(key, None)
+                return None
+            artifact.last_used = time.time()
+            if session_id is not None:
+                artifact.refs[session_id] += 1
+            return str(artifact.path)
+
+    def _register(self, key: str, source: Path, name: str, session_id: Optional[str]) -> str:
+        """Move ``source`` into the store under ``key``, unless another writer got there first."""
+        with self._lock:
+            artifact = self._artifacts.get(key)
+            if artifact is None:
+                # The directory is created and filled under the lock, so a concurrent
+                # eviction cannot remove it in between; a rename when both are on one
+                # filesystem
+                directory = self.root / key
+                directory.mkdir(exist_ok=True)
+                target = directory / name
+                shutil.move(source, target)
+                artifact = self._artifacts[key] = Artifact(key, target, target.stat().st_size)
+            else:
+                source.unlink(missing_ok=True)
+            artifact.last_used = time.time()
+            if session_id is not None:
+                artifact.refs[session_id] += 1
+            path = str(artifact.path)
+        self.evict(keep=key)
+        return path
+
+    def _write(self, key: str, name: str, write: Callable[[str], None], session_id: Optional[str]) -> str:
+        """Write a new artifact with ``write(path)`` and register it."""
+        # Written next to the artifact directories rather than in one, which only exists
+        # once the artifact is registered
+        temp_path = self.root / f".{key}.{threading.get_ident()}.tmp"
+        try:
+            write(str(temp_path))
+        except BaseException:
+            temp_path.unlink(missing_ok=True)
+            raise
+        return self._register(key, temp_path, name, session_id)
+
+    def put_dataframe(self, df: pd.DataFrame, name: str, session_id: Optional[str] = None) -> Optional[str]:
+        """
+        Store a DataFrame as Parquet and return the path of the file.
+
+        The frame is hashed first, so a frame already in the store is not written again.
+
+        Args:
+            df: The DataFrame; None or empty stores nothing
+            name: File name of the download
+            session_id: Session to reference the artifact from
+
+        Returns:
+            Path of the stored file, or None for an empty DataFrame
+        """
+        if df is None or df.empty:
+            return None
+        key = frame_digest(df, kind="parquet")
+        path = self._lookup(key, session_id)
+        if path is not None:
+            return path
+        return self._write(key, name, lambda target: write_parquet(df, target), session_id)
+
+    def put_derived(self, source: str, kind: str, name: str, write: Callable[[str, str], None],
+                    session_id: Optional[str] = None) -> str:
+        """
+        Store a file derived from a stored artifact, such as another format of it.
+
+        The derived artifact is keyed by the source artifact and ``kind``, so it is written
+        once however many sessions ask for it.
+
+        Args:
+            source: Path of a stored artifact
+            kind: What the derived file is, e.g. its format
+            name: File name of the download
+            write: Called as ``write(source, target)`` to write the derived file
+            session_id: Session to reference the artifact from
+        """
+        key = f"{Path(source).parent.name}.{kind}"
+        path = self._lookup(key, session_id)
+        if path is not None:
+            return path
+        return self._write(key, name, lambda target: write(source, target), session_id)
+
+    def put_file(self, source: str, name: Optional[str] = None, session_id: Optional[str] = None) -> str:
+        """
+        Move a finished file into the store and return its stored path.
+
+        If a file with the same content is already stored, ``source`` is deleted and the
+        stored file is returned.
+
+        Args:
+            source: File to move in
+            name: File name of the download; defaults to the name of ``source``
+            session_id: Session to reference the artifact from
+        """
+        source = Path(source)
+        key = file_digest(str(source))
+        path = self._lookup(key, session_id)
+        if path is not None:
+            source.unlink(missing_ok=True)
+            return path
+        return self._register(key, source, name or source.name, session_id)
+
+    def release(self, path: str, session_id: str) -> None:
+        """
+        Drop one reference of the session to the artifact at ``path``, e.g. when a new
+        result replaces it, and all of the session's references to the files derived from
+        it, which :meth:`put_derived` writes again if they are asked for.
+        """
+        key = Path(path).parent.name
+        with self._lock:
+            artifact = self._artifacts.get(key)
+            if artifact is not None and artifact.refs[session_id] > 0:
+                artifact.refs[session_id] -= 1
+                if not artifact.refs[session_id]:
+                    del artifact.refs[session_id]
+            for derived_key, derived in self._artifacts.items():
+                if derived_key.startswith(f"{key}."):
+                    derived.refs.pop(session_id, None)
+
+    def release_session(self, session_id: str) -> None:
+        """Drop every reference of a session, e.g. when it disconnects."""
+        with self._lock:
+            for artifact in self._artifacts.values():
+                artifact.refs.pop(session_id, None)
+        self.evict()
+
+    def evict(self, keep: Optional[str] = None) -> int:
+        """
+        Remove expired artifacts, then least recently used ones until the store fits the quota.
+
+        Args:
+            keep: Key of an artifact that is never evicted, such as the one just stored
+
+        Returns:
+            Number of artifacts removed
+        """
+        now = time.time()
+        with self._lock:
+            expired = [a for a in self._artifacts.values() if now - a.last_used > self.ttl]
+            total = sum(a.size for a in self._artifacts.values()) - sum(a.size for a in expired)
+            # Unreferenced artifacts go first, each group least recently used first
+            candidates = sorted(
+                (a for a in self._artifacts.values() if now - a.last_used <= self.ttl and a.key != keep),
+                key=lambda a: (bool(a.refs), a.last_used),
+            )
+            evicted = expired
+            for artifact in candidates:
+                if total <= self.quota_bytes:
+                    break
+                evicted.append(artifact)
+                total -= artifact.size
+            # Removed under the lock, so a writer registering the same key again cannot
+            # have its new file deleted
+            for artifact in evicted:
+                del self._artifacts[artifact.key]
+                shutil.rmtree(artifact.path.parent, ignore_errors=True)
+        for artifact in evicted:
+            logger.info("Evicted artifact %s (%d bytes)", artifact.path.name, artifact.size)
+        if total > self.quota_bytes:
+            logger.warning("Artifact store holds %d bytes, over its quota of %d", total, self.quota_bytes)
+        return len(evicted)
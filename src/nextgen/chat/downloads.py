@@ -0,0 +1,132 @@
+"""
+Download formats of the chat interface.
+
+Results are stored once, as Parquet, while the question is processed: the raw data is
+written chunk by chunk as it streams in (:class:`ParquetFrameWriter`), the statistics as a
+whole. Every other format is written from that file only when the user asks for it
+(:func:`write_download`), one record batch at a time, so a large result is never
+serialized to text on the request path nor held in memory as a whole.
+"""
+
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+from nextgen.vanna.engines import STREAM_CHUNK_SIZE, stream_schema
+
+if TYPE_CHECKING:
+    from nextgen.chat.artifacts import ArtifactStore
+
+# Format key -> (label, file suffix)
+DOWNLOAD_FORMATS = {
+    "csv": ("CSV", ".csv"),
+    "csv.gz": ("CSV (gzip)", ".csv.gz"),
+    "csv.zst": ("CSV (zstd)", ".csv.zst"),
+    "parquet": ("Parquet", ".parquet"),
+    "feather": ("Feather", ".feather"),
+}
+DEFAULT_DOWNLOAD_FORMAT = "csv.gz"
+
+# Compression of the output stream of each CSV format
+_CSV_COMPRESSION = {"csv": None, "csv.gz": "gzip", "csv.zst": "zstd"}
+
+
+class ParquetFrameWriter:
+    """
+    Write DataFrame chunks to one Parquet file.
+
+    Dictionary (categorical) columns are written with int32 indices, so chunks whose
+    categories differ still share the schema of the first chunk.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.rows = 0
+        self._writer: Optional[pq.ParquetWriter] = None
+
+    def write(self, chunk: pd.DataFrame) -> None:
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self.path, stream_schema(table), compression="zstd")
+        self._writer.write_table(table.cast(self._writer.schema))
+        self.rows += len(chunk)
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self) -> "ParquetFrameWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def write_parquet(df: pd.DataFrame, path: str) -> None:
+    """Write a whole DataFrame the way :class:`ParquetFrameWriter` writes chunks."""
+    with ParquetFrameWriter(path) as writer:
+        writer.write(df)
+
+
+def download_name(name: str, fmt: str) -> str:
+    """File name of a download: ``name`` with the suffix of ``fmt`` instead of its own."""
+    return Path(name).with_suffix("").name + DOWNLOAD_FORMATS[fmt][1]
+
+
+def write_download(source: str, fmt: str, target: str, batch_size: int = STREAM_CHUNK_SIZE) -> None:
+    """
+    Write the Parquet file ``source`` to ``target`` in a download format, batch by batch.
+
+    Args:
+        source: Parquet file written by :class:`ParquetFrameWriter` or :func:`write_parquet`
+        fmt: "csv", "csv.gz", "csv.zst" or "feather"; Parquet downloads use ``source`` itself
+        target: Path of the file to write
+        batch_size: Rows read and written at a time
+
+    Raises:
+        ValueError: If the format is unknown or Parquet
+    """
+    if fmt not in DOWNLOAD_FORMATS or fmt == "parquet":
+        raise ValueError(f"Invalid download format: {fmt}, expected one of {tuple(k for k in DOWNLOAD_FORMATS if k != 'parquet')}")
+    parquet_file = pq.ParquetFile(source)
+    schema = parquet_file.schema_arrow.remove_metadata()
+    batches = parquet_file.iter_batches(batch_size=batch_size)
+
+    if fmt == "feather":
+        # Feather V2 is the Arrow IPC file format; LZ4 is its default compression. An IPC
+        # file allows one dictionary per field, but every streamed row group has its own,
+        # so categorical columns are written decoded
+        schema = pa.schema([
+            pa.field(field.name, field.type.value_type) if pa.types.is_dictionary(field.type) else field
+            for field in schema
+        ])
+        options = pa.ipc.IpcWriteOptions(compression="lz4")
+        with pa.OSFile(target, "wb") as sink, pa.ipc.new_file(sink, schema, options=options) as writer:
+            for batch in batches:
+                writer.write_table(pa.Table.from_batches([batch]).cast(schema))
+        return
+
+    with pa.output_stream(target, compression=_CSV_COMPRESSION[fmt]) as sink:
+        with pa_csv.CSVWriter(sink, schema, write_options=pa_csv.WriteOptions(quoting_style="needed")) as writer:
+            for batch in batches:
+                writer.write_batch(batch)
+
+
+def prepare_download(store: "ArtifactStore", source: str, fmt: str, session_id: Optional[str] = None) -> str:
+    """
+    Return a file of the stored Parquet artifact ``source`` in the format ``fmt``.
+
+    The file is written on the first request and kept in the store like any other
+    artifact, so later requests for the same result and format reuse it.
+    """
+    if fmt == "parquet":
+        return source
+    return store.put_derived(
+        source, fmt, download_name(Path(source).name, fmt),
+        lambda src, target: write_download(src, fmt, target), session_id,
+    )
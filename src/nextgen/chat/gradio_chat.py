@@ -1,22 +1,43 @@
+import asyncio
 import os
+from contextlib import aclosing
+from typing import Optional
 import gradio as gr
-from nextgen.agents import get_data_scientist_agent, get_analysis_agent, get_statistician_agent, get_cross_reference_agent
+import pyarrow.parquet as pq
+from nextgen.agents.statistician_agent import DIFFERENTIAL_EXPRESSION_COLUMNS
+from nextgen.analysis import DifferentialExpressionAccumulator
+from nextgen.vanna.engines import arrow_to_frame, concat_chunks
+from nextgen.chat.artifacts import ArtifactStore
+from nextgen.openai.registry import aclose_async_clients
+from nextgen.chat.downloads import DEFAULT_DOWNLOAD_FORMAT, DOWNLOAD_FORMATS, ParquetFrameWriter, prepare_download
+from nextgen.chat.sessions import (
+    CONCURRENCY_LIMIT,
+    QUEUE_SIZE,
+    ChatAgents,
+    SessionBusyError,
+    SessionFilter,
+    SessionManager,
+    current_session,
+)
 import logging
 import sys
 from datetime import datetime
 import tempfile
 
-# Configure logging
+# Configure logging; every record carries the session it was logged for
+_log_handlers = [logging.StreamHandler(sys.stdout), logging.FileHandler('chat_logs.txt')]
+for _handler in _log_handlers:
+    _handler.addFilter(SessionFilter())
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout),
-        logging.FileHandler('chat_logs.txt')
-    ]
+    format='%(asctime)s - %(levelname)s - [%(session)s] %(message)s',
+    handlers=_log_handlers
 )
 logger = logging.getLogger(__name__)
 
+# Rows read from the database per query; larger results are cut off
+MAX_RESULT_ROWS = int(os.environ.get("NEXTGEN_MAX_RESULT_ROWS", 5_000_000))
+
 # Custom CSS for enhanced styling
 custom_css = """
 /* Main container styling */
@@ -267,26 +288,85 @@ custom_css = """
 """
 
 class ChatInterface:
-    def __init__(self, model: str = 'md_anderson'):
-        logger.info("Initializing ChatInterface...")
-        self.data_scientist_agent = get_data_scientist_agent(model=model, chroma_path='database/data_scientist_chroma')
-        self.analysis_agent = get_analysis_agent(model=model)
-        self.statistician_agent = get_statistician_agent(model=model)
-        self.cross_reference_agent = get_cross_reference_agent(model=model)
-        
-        # Create temp directory for downloads
-        self.temp_dir = tempfile.mkdtemp()
-        logger.info("ChatInterface initialized successfully")
-        
-    def save_dataframe_to_temp(self, df, filename):
-        """Save dataframe to temporary file and return the path"""
-        if df is not None and not df.empty:
-            filepath = os.path.join(self.temp_dir, filename)
-            df.to_csv(filepath, index=False)
-            return filepath
-        return None
+    """
+    The question-answering pipeline of one session.
+
+    Args:
+        model: LLM backend of the agents, when ``agents`` is not given
+        max_rows: Rows read from the database per question
+        agents: Agents shared with other sessions; created for this interface if None
+        temp_dir: Directory of the files being written; a new temp directory if None
+        artifacts: Store of the finished downloadable files; one under ``temp_dir`` if None
+        session_id: Session the stored files are referenced from
+    """
+
+    def __init__(self, model: str = 'md_anderson', max_rows: int = MAX_RESULT_ROWS,
+                 agents: Optional[ChatAgents] = None, temp_dir: Optional[str] = None,
+                 artifacts: Optional[ArtifactStore] = None, session_id: Optional[str] = None):
+        self.max_rows = max_rows
+        if agents is None:
+            logger.info("Initializing agents...")
+            agents = ChatAgents(model, statistician_pool_size=1)
+        self.agents = agents
+        self.data_scientist_agent = agents.data_scientist
+        self.analysis_agent = agents.analysis
+        self.cross_reference_agent = agents.cross_reference
+
+        # Files are written in the temp directory and moved to the artifact store when complete
+        self.temp_dir = temp_dir if temp_dir is not None else tempfile.mkdtemp()
+        self.artifacts = artifacts if artifacts is not None else ArtifactStore(os.path.join(self.temp_dir, "artifacts"))
+        self.session_id = session_id
         
     def process_query(self, message, history=None):
+        """Synchronous :meth:`process_query_async`, driven on a private event loop."""
+        loop = asyncio.new_event_loop()
+        updates = self.process_query_async(message, history)
+        try:
+            while True:
+                try:
+                    yield loop.run_until_complete(updates.__anext__())
+                except StopAsyncIteration:
+                    return
+        finally:
+            try:
+                loop.run_until_complete(updates.aclose())
+                loop.run_until_complete(aclose_async_clients())
+            finally:
+                loop.close()
+
+    def _statistics(self, message, accumulator, chunks, raw_file):
+        """Per-protein statistics of the streamed result; blocking, run in an executor."""
+        with self.agents.statisticians.lease() as statistician_agent:
+            if accumulator is not None and len(accumulator.group_labels) >= 2:
+                return statistician_agent.differential_expression_from_accumulator(
+                    accumulator, statistician_agent.comparison_mode(message)
+                )
+            if accumulator is not None:
+                # Only one cancer type; the chunks were not kept, so read back the raw
+                # data file written from them rather than running the question again
+                df = arrow_to_frame(pq.read_table(raw_file))
+            else:
+                df = concat_chunks(chunks)
+                chunks.clear()
+            return statistician_agent.analyze(
+                'Perform a two-sample t-test for each unique protein comparing expression levels between the cancer types',
+                df
+            )
+
+    async def process_query_async(self, message, history=None):
+        """
+        Run the pipeline for one question, yielding (history, raw data file, statistics
+        file) after every step.
+
+        The files are stored as Parquet; other download formats are only written when
+        requested (see :func:`nextgen.chat.downloads.prepare_download`). The LLM calls are
+        awaited on the async clients and the SQL query, the file writes and the statistics
+        run in executors, so one event loop serves many sessions at once.
+
+        Each step appends its messages to ``history`` or updates its own status message in
+        place, and the data previews are rendered once, so a consumer that sends only the
+        changes between updates sends each preview once.
+        """
         if history is None:
             history = []
         
@@ -301,26 +381,60 @@ class ChatInterface:
             history.append({"role": "assistant", "content": assistant_msg})
             yield history, None, None
 
-            df, sql = self.data_scientist_agent.analyze(message)
-            assistant_msg = f"✅ **SQL Query Generated Successfully**\n\n"
-            assistant_msg += f"```sql\n{sql}\n```\n\n"
-            assistant_msg += f"<div class='status-indicator status-complete'></div> Query executed successfully"
-            history.append({"role": "assistant", "content": assistant_msg})
-            yield history, None, None
-
-            # Save raw data to file
+            # Stream the result: the preview is shown from the first chunk, the raw data file
+            # and the per-protein statistics are accumulated as the remaining chunks arrive.
+            # Chunks are only kept when the statistics need the whole frame
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            raw_df_file = self.save_dataframe_to_temp(df, f"raw_data_{timestamp}.csv")
+            raw_path = os.path.join(self.temp_dir, f"raw_data_{timestamp}.parquet")
+            chunks = []
+            rows = 0
+            truncated = False
+            accumulator = None
+            preview = None
+            with ParquetFrameWriter(raw_path) as raw_writer:
+                async with aclosing(self.data_scientist_agent.aanalyze_stream(message, max_rows=self.max_rows)) as stream:
+                    async for chunk, sql, truncated in stream:
+                        if chunk is None:
+                            raise ValueError(f"The generated SQL query is not valid:\n```sql\n{sql}\n```")
+                        if preview is None:
+                            assistant_msg = f"✅ **SQL Query Generated Successfully**\n\n"
+                            assistant_msg += f"```sql\n{sql}\n```\n\n"
+                            assistant_msg += f"<div class='status-indicator status-complete'></div> Query executed successfully"
+                            history[-1]["content"] = assistant_msg
+                            if set(DIFFERENTIAL_EXPRESSION_COLUMNS).issubset(chunk.columns):
+                                accumulator = DifferentialExpressionAccumulator()
+                            # The preview gets a message of its own, rendered once; later
+                            # chunks only update the row count of the progress message
+                            preview = (
+                                f"• **Columns:** {len(chunk.columns)}\n"
+                                f"• **Data Types:** {', '.join(chunk.dtypes.astype(str).unique())}\n\n"
+                                f"**📋 Data Preview (First 10 rows):**\n\n"
+                                f"{chunk.head(10).to_markdown(index=False)}"
+                            )
+                            progress = len(history)
+                            history.append({"role": "assistant", "content": ""})
+                            history.append({"role": "assistant", "content": preview})
+
+                        await asyncio.to_thread(raw_writer.write, chunk)
+                        if accumulator is not None:
+                            await asyncio.to_thread(accumulator.update, chunk)
+                        else:
+                            chunks.append(chunk)
+                        rows += len(chunk)
+
+                        history[progress]["content"] = f"📊 **Retrieving Data...**\n\n• **Rows so far:** {rows:,}"
+                        yield history, None, None
+
+            if rows == 0:
+                raise ValueError("The query returned no rows")
+            raw_df_file = await asyncio.to_thread(self.artifacts.put_file, raw_path, None, self.session_id)
 
             # 2. Show data preview with download option
             assistant_msg = f"📊 **Data Retrieved Successfully**\n\n"
-            assistant_msg += f"• **Rows:** {len(df):,}\n"
-            assistant_msg += f"• **Columns:** {len(df.columns)}\n"
-            assistant_msg += f"• **Data Types:** {', '.join(df.dtypes.astype(str).unique())}\n\n"
-            assistant_msg += f"**📋 Data Preview (First 10 rows):**\n\n"
-            assistant_msg += f"{df.head(10).to_markdown(index=False)}\n\n"
+            assistant_msg += f"• **Rows:** {rows:,}"
+            assistant_msg += f" (stopped at the limit of {self.max_rows:,})\n\n" if truncated else "\n\n"
             assistant_msg += "🎉 **Raw data file is ready for download!**"
-            history.append({"role": "assistant", "content": assistant_msg})
+            history[progress]["content"] = assistant_msg
             yield history, raw_df_file, None
 
             # 3. Statistics
@@ -329,23 +443,26 @@ class ChatInterface:
             history.append({"role": "assistant", "content": assistant_msg})
             yield history, raw_df_file, None
 
-            stat_result = self.statistician_agent.analyze(
-                'Perform a two-sample t-test for each unique protein comparing expression levels between the cancer types',
-                df
-            )
+            stat_result = await asyncio.to_thread(self._statistics, message, accumulator, chunks, raw_df_file)
 
             # Save statistical results to file
-            stat_result_file = self.save_dataframe_to_temp(stat_result, f"statistical_results_{timestamp}.csv")
+            stat_result_file = await asyncio.to_thread(
+                self.artifacts.put_dataframe, stat_result, f"statistical_results_{timestamp}.parquet", self.session_id
+            )
 
             # 4. Show statistical results with download option
             assistant_msg = f"🧮 **Statistical Analysis Complete**\n\n"
             assistant_msg += f"• **Statistical Tests:** {len(stat_result)} proteins analyzed\n"
-            assistant_msg += f"• **Significant Results:** {len(stat_result[stat_result.get('p_value', 1) < 0.05]) if 'p_value' in stat_result.columns else 'N/A'}\n"
+            # Prefer the multiple-testing adjusted p-values; thousands of raw p-values
+            # below 0.05 are mostly false positives
+            p_col = next((col for col in ("q_val", "p_val", "p_value") if col in stat_result.columns), None)
+            significant = f"{int((stat_result[p_col] < 0.05).sum()):,} ({p_col} < 0.05)" if p_col else "N/A"
+            assistant_msg += f"• **Significant Results:** {significant}\n"
             assistant_msg += f"• **Columns:** {len(stat_result.columns)}\n\n"
             assistant_msg += f"**📊 Statistical Results Preview:**\n\n"
             assistant_msg += f"{stat_result.head(10).to_markdown(index=False)}\n\n"
             assistant_msg += "📈 **Statistical results file is ready for download!**"
-            history.append({"role": "assistant", "content": assistant_msg})
+            history[-1]["content"] = assistant_msg
             yield history, raw_df_file, stat_result_file
 
             # 5. Analysis
@@ -354,10 +471,10 @@ class ChatInterface:
             history.append({"role": "assistant", "content": assistant_msg})
             yield history, raw_df_file, stat_result_file
 
-            analysis_result = self.analysis_agent.analyze(message, sql, stat_result)
+            analysis_result = await self.analysis_agent.aanalyze(message, sql, stat_result)
             assistant_msg = "✅ **Analysis Complete**\n"
             assistant_msg += "<div class='status-indicator status-complete'></div> Statistical interpretation finished"
-            history.append({"role": "assistant", "content": assistant_msg})
+            history[-1]["content"] = assistant_msg
             yield history, raw_df_file, stat_result_file
 
             # 6. Cross-reference
@@ -366,27 +483,28 @@ class ChatInterface:
             history.append({"role": "assistant", "content": assistant_msg})
             yield history, raw_df_file, stat_result_file
 
-            final_result = self.cross_reference_agent.analyze(
+            final_result = await self.cross_reference_agent.aanalyze(
                 question=analysis_result,
                 proteins=analysis_result
             )
             assistant_msg = "🎯 **Cross-reference Complete**\n"
             assistant_msg += "<div class='status-indicator status-complete'></div> External database enrichment finished"
-            history.append({"role": "assistant", "content": assistant_msg})
+            history[-1]["content"] = assistant_msg
             yield history, raw_df_file, stat_result_file
 
             # Final result
             final_msg = f"## 🎊 **Analysis Complete!**\n\n"
             final_msg += f"### 📋 **Summary**\n{final_result}\n\n"
             final_msg += "### 📁 **Files Available**\n"
-            final_msg += "• Raw data CSV file with all retrieved records\n"
+            final_msg += "• Raw data with all retrieved records\n"
             final_msg += "• Statistical analysis results with p-values and effect sizes\n\n"
-            final_msg += "*All files are available for download in the sidebar.* 📥"
+            final_msg += "*Pick a format and download the files in the sidebar.* 📥"
             
             history.append({"role": "assistant", "content": final_msg})
             yield history, raw_df_file, stat_result_file
 
         except Exception as e:
+            logger.exception("Error processing the question")
             error_msg = f"❌ **Error Occurred**\n\n"
             error_msg += f"**Error Details:** {str(e)}\n\n"
             error_msg += "Please try rephrasing your question or contact support if the issue persists."
@@ -395,13 +513,18 @@ class ChatInterface:
 
 def main():
     logger.info("Starting Gradio chat interface...")
-    chat_interface = ChatInterface()
+    # Agents are shared by all sessions; each session gets its own download directory
+    agents = ChatAgents(statistician_pool_size=CONCURRENCY_LIMIT)
+    artifacts = ArtifactStore()
+    sessions = SessionManager(artifacts=artifacts)
     
     # Create enhanced interface with Blocks
     with gr.Blocks(
         title="NextAGent AI", 
         theme=gr.themes.Soft(),
-        css=custom_css
+        css=custom_css,
+        # Gradio keeps its own copies of the returned files; expire them with the sessions
+        delete_cache=(int(sessions.ttl), int(sessions.ttl))
     ) as demo:
         
         # Enhanced Header
@@ -423,6 +546,7 @@ def main():
                     with gr.Column():
                         gr.HTML('<div class="chatbot-container">')
                         chatbot = gr.Chatbot(
+                            type="messages",
                             height=650,
                             show_label=False,
                             avatar_images=(
@@ -505,21 +629,29 @@ def main():
                 </div>
                 """)
                 
-                raw_data_download = gr.DownloadButton(
-                    label="📊 Raw Data (CSV)",
-                    value=None,
+                # Files are written in the chosen format only when a button is clicked
+                download_format = gr.Radio(
+                    choices=[(label, fmt) for fmt, (label, _) in DOWNLOAD_FORMATS.items()],
+                    value=DEFAULT_DOWNLOAD_FORMAT,
+                    label="File Format"
+                )
+                result_files = gr.State({})
+
+                raw_data_download = gr.Button(
+                    "📊 Raw Data",
                     visible=False,
                     elem_classes=["download-btn"],
                     variant="primary"
                 )
                 
-                stat_results_download = gr.DownloadButton(
-                    label="📈 Statistical Results (CSV)", 
-                    value=None,
+                stat_results_download = gr.Button(
+                    "📈 Statistical Results", 
                     visible=False,
                     elem_classes=["download-btn"],
                     variant="primary"
                 )
+
+                download_file = gr.File(label="Download", visible=False, interactive=False)
                 
                 gr.HTML("""
                 <div style="margin-top: 1rem; padding: 1rem; background: #f7fafc; border-radius: 8px; border: 1px solid #e2e8f0;">
@@ -543,49 +675,72 @@ def main():
                 </div>
                 """)
 
-        def user_message(message, history):
-            return "", history + [[message, None]]
+        def user_message(message, history, request: gr.Request):
+            # Runs outside the queue, so the question counts against the session as soon
+            # as it is submitted; bot_response starts and releases it, and a question the
+            # queue drops stops counting after the session manager's queue timeout
+            try:
+                sessions.acquire(request.session_hash)
+            except SessionBusyError as e:
+                raise gr.Error(str(e))
+            return "", history + [{"role": "user", "content": message}]
+
+        async def bot_response(history, files, request: gr.Request):
+            message = history[-1]["content"]
+            session_id = request.session_hash
+            current_session.set(session_id)
+            sessions.start(session_id)
+            try:
+                # The files of the new question replace those offered for the previous one
+                for path in files.values():
+                    if path is not None:
+                        artifacts.release(path, session_id)
+                session = sessions.get(session_id)
+                chat_interface = ChatInterface(
+                    agents=agents, temp_dir=session.temp_dir, artifacts=artifacts, session_id=session_id
+                )
 
-        def bot_response(history):
-            message = history[-1][0]
-            
-            # Process the query and get streaming response
-            for response_history, raw_file, stat_file in chat_interface.process_query(message, []):
-                # Convert internal format to chatbot format
-                chatbot_history = []
-                
-                if len(response_history) > 0:
-                    # First message is the user message
-                    user_msg = response_history[0]["content"]
-                    
-                    # Collect all assistant messages and combine them
-                    assistant_messages = []
-                    for i in range(1, len(response_history)):
-                        if response_history[i]["role"] == "assistant":
-                            assistant_messages.append(response_history[i]["content"])
-                    
-                    # Combine all assistant messages with section breaks
-                    combined_bot_msg = "\n\n---\n\n".join(assistant_messages) if assistant_messages else ""
-                    
-                    if combined_bot_msg:
-                        chatbot_history.append([user_msg, combined_bot_msg])
-                
-                # Update download buttons visibility and files
-                raw_visible = raw_file is not None
-                stat_visible = stat_file is not None
-                
-                yield (chatbot_history, 
-                       gr.update(value=raw_file, visible=raw_visible),
-                       gr.update(value=stat_file, visible=stat_visible))
+                # The pipeline appends to the earlier turns and updates its messages in
+                # place; Gradio sends only the difference from the previous update
+                async for response_history, raw_file, stat_file in chat_interface.process_query_async(message, history[:-1]):
+                    yield (response_history,
+                           {"raw": raw_file, "stat": stat_file},
+                           gr.update(visible=raw_file is not None),
+                           gr.update(visible=stat_file is not None))
+            finally:
+                sessions.release(session_id)
 
         # Event handlers - both submit and send button do the same thing
-        submit_event = msg.submit(user_message, [msg, chatbot], [msg, chatbot]).then(
-            bot_response, [chatbot], [chatbot, raw_data_download, stat_results_download]
+        submit_event = msg.submit(user_message, [msg, chatbot], [msg, chatbot], queue=False).success(
+            bot_response, [chatbot, result_files], [chatbot, result_files, raw_data_download, stat_results_download],
+            concurrency_limit=CONCURRENCY_LIMIT, concurrency_id="pipeline"
         )
         
-        send_btn.click(user_message, [msg, chatbot], [msg, chatbot]).then(
-            bot_response, [chatbot], [chatbot, raw_data_download, stat_results_download]
+        send_btn.click(user_message, [msg, chatbot], [msg, chatbot], queue=False).success(
+            bot_response, [chatbot, result_files], [chatbot, result_files, raw_data_download, stat_results_download],
+            concurrency_limit=CONCURRENCY_LIMIT, concurrency_id="pipeline"
         )
+
+        # Write the requested file on click; Gradio streams it to the browser from disk
+        def download(source, fmt, session_id):
+            if source is None or not os.path.exists(source):
+                raise gr.Error("The file is no longer available; please ask the question again")
+            return gr.update(value=prepare_download(artifacts, source, fmt, session_id), visible=True)
+
+        def download_raw_data(files, fmt, request: gr.Request):
+            return download(files.get("raw"), fmt, request.session_hash)
+
+        def download_stat_results(files, fmt, request: gr.Request):
+            return download(files.get("stat"), fmt, request.session_hash)
+
+        raw_data_download.click(download_raw_data, [result_files, download_format], download_file)
+        stat_results_download.click(download_stat_results, [result_files, download_format], download_file)
+
+        # Remove the session's files when its browser tab disconnects
+        def close_session(request: gr.Request):
+            sessions.close(request.session_hash)
+
+        demo.unload(close_session)
         
         # Enhanced example button handlers
         def set_example(example_text):
@@ -618,14 +773,18 @@ def main():
         )
     
     logger.info("Launching enhanced Gradio interface...")
-    demo.queue(max_size=10)  # Enable queuing for streaming updates
-    demo.launch(
-        share=True, 
-        server_name="0.0.0.0",
-        show_api=False,
-        show_error=True,
-        favicon_path="src/nextgen/img/user.png" if os.path.exists("src/nextgen/img/user.png") else None
-    )
+    # Questions per session are bounded by the SessionManager, the whole queue by QUEUE_SIZE
+    demo.queue(max_size=QUEUE_SIZE, default_concurrency_limit=CONCURRENCY_LIMIT)
+    try:
+        demo.launch(
+            share=True, 
+            server_name="0.0.0.0",
+            show_api=False,
+            show_error=True,
+            favicon_path="src/nextgen/img/user.png" if os.path.exists("src/nextgen/img/user.png") else None
+        )
+    finally:
+        sessions.close_all()
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,244 @@
+"""
+Per-session state and shared agents for serving the chat interface to several users.
+
+Every browser session gets its own :class:`ChatSession` with a private download directory,
+removed when the session disconnects or has been idle too long, and a bounded number of
+questions in flight, so a few users cannot fill the (bounded) global queue by themselves.
+A question that Gradio drops before it starts, e.g. because the queue is full, stops
+counting against its session after a timeout. The agents are created once per process: those that are
+safe to call from several threads are shared, the statistician (whose pandasai LLM keeps
+per-call state) is leased from an :class:`AgentPool`.
+
+Serving can be tuned with environment variables:
+    NEXTGEN_CHAT_CONCURRENCY   Questions processed at once across all sessions (default 8)
+    NEXTGEN_CHAT_MAX_PENDING   Questions one session may have queued or running (default 2)
+    NEXTGEN_CHAT_QUEUE_SIZE    Questions waiting in the queue across all sessions (default 64)
+    NEXTGEN_CHAT_QUEUE_TIMEOUT Seconds a queued question that never started counts against its session (default 900)
+    NEXTGEN_CHAT_SESSION_TTL   Seconds after which an idle session's files are removed (default 3600)
+    NEXTGEN_CHAT_SESSION_DIR   Parent directory of the session directories (default: the system temp dir)
+"""
+
+import contextvars
+import logging
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, Generic, Iterator, Optional, TypeVar
+
+from nextgen.agents import get_analysis_agent, get_cross_reference_agent, get_data_scientist_agent, get_statistician_agent
+from nextgen.chat.artifacts import ArtifactStore
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+CONCURRENCY_LIMIT = int(os.environ.get("NEXTGEN_CHAT_CONCURRENCY", 8))
+MAX_PENDING_PER_SESSION = int(os.environ.get("NEXTGEN_CHAT_MAX_PENDING", 2))
+QUEUE_SIZE = int(os.environ.get("NEXTGEN_CHAT_QUEUE_SIZE", 64))
+QUEUE_TIMEOUT = float(os.environ.get("NEXTGEN_CHAT_QUEUE_TIMEOUT", 900))
+SESSION_TTL = float(os.environ.get("NEXTGEN_CHAT_SESSION_TTL", 3600))
+SESSION_DIR = os.environ.get("NEXTGEN_CHAT_SESSION_DIR") or None
+
+# Session of the question being processed; copied into the worker threads of the pipeline
+current_session: contextvars.ContextVar[str] = contextvars.ContextVar("nextgen_chat_session", default="-")
+
+
+class SessionFilter(logging.Filter):
+    """Add the current session id to log records as ``%(session)s``."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.session = current_session.get()
+        return True
+
+
+class SessionBusyError(RuntimeError):
+    """Raised when a session already has the maximum number of questions in flight."""
+
+
+class AgentPool(Generic[T]):
+    """
+    Instances of an agent that is not thread-safe, created on demand up to ``max_size``.
+
+    Each :meth:`lease` has an instance to itself; when all are leased the caller blocks
+    until one is returned. Call from worker threads, not from the event loop.
+    """
+
+    def __init__(self, factory: Callable[[], T], max_size: int):
+        if max_size < 1:
+            raise ValueError(f"max_size must be at least 1, got {max_size}")
+        self.factory = factory
+        self.max_size = max_size
+        self._idle: "queue.LifoQueue[T]" = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def lease(self) -> Iterator[T]:
+        try:
+            agent = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._created < self.max_size
+                if create:
+                    self._created += 1
+            if create:
+                try:
+                    agent = self.factory()
+                except BaseException:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                agent = self._idle.get()
+        try:
+            yield agent
+        finally:
+            self._idle.put(agent)
+
+
+class ChatAgents:
+    """The agents of the chat pipeline, created once and shared by every session."""
+
+    def __init__(self, model: str = 'md_anderson', statistician_pool_size: int = CONCURRENCY_LIMIT):
+        # Stateless between calls: SQL generation and every query open their own
+        # connections, and the LLM agents only hold the process-wide clients
+        self.data_scientist = get_data_scientist_agent(model=model, chroma_path='database/data_scientist_chroma')
+        self.analysis = get_analysis_agent(model=model)
+        self.cross_reference = get_cross_reference_agent(model=model)
+        self.statisticians = AgentPool(lambda: get_statistician_agent(model=model), statistician_pool_size)
+
+
+@dataclass
+class ChatSession:
+    """State of one browser session."""
+
+    session_id: str
+    temp_dir: str
+    # Submission times of the questions waiting in the queue
+    queued: Deque[float] = field(default_factory=deque)
+    running: int = 0
+    last_active: float = field(default_factory=time.monotonic)
+
+    @property
+    def pending(self) -> int:
+        """Questions queued or running."""
+        return len(self.queued) + self.running
+
+
+class SessionManager:
+    """
+    Creates, admits questions for and cleans up the sessions of the chat server.
+
+    Args:
+        root: Parent directory of the session directories
+        max_pending: Questions one session may have queued or running
+        ttl: Seconds after which an idle session is closed
+        artifacts: Artifact store whose references a session drops when it is closed
+        queue_timeout: Seconds after which a queued question that never started no longer
+            counts against its session
+    """
+
+    def __init__(self, root: Optional[str] = SESSION_DIR, max_pending: int = MAX_PENDING_PER_SESSION,
+                 ttl: float = SESSION_TTL, artifacts: Optional[ArtifactStore] = None,
+                 queue_timeout: float = QUEUE_TIMEOUT):
+        self.root = root
+        self.artifacts = artifacts
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self.queue_timeout = queue_timeout
+        self._sessions: Dict[str, ChatSession] = {}
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> ChatSession:
+        """Return the session, creating it and its download directory on first use."""
+        self.close_idle()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                temp_dir = tempfile.mkdtemp(prefix=f"nextgen-{session_id[:12]}-", dir=self.root)
+                session = self._sessions[session_id] = ChatSession(session_id, temp_dir)
+                logger.info("Opened session %s in %s", session_id, temp_dir)
+            session.last_active = time.monotonic()
+            return session
+
+    def _expire_queued(self, session: ChatSession) -> None:
+        """Stop counting questions queued too long ago, which Gradio dropped. Caller holds the lock."""
+        cutoff = time.monotonic() - self.queue_timeout
+        while session.queued and session.queued[0] < cutoff:
+            session.queued.popleft()
+
+    def acquire(self, session_id: str) -> ChatSession:
+        """
+        Count a question against the session from the time it is submitted. The question
+        calls :meth:`start` when it leaves the queue and :meth:`release` once it is done;
+        if it never starts, it stops counting after ``queue_timeout``.
+
+        Raises:
+            SessionBusyError: If the session already has ``max_pending`` questions in flight
+        """
+        session = self.get(session_id)
+        with self._lock:
+            self._expire_queued(session)
+            if session.pending >= self.max_pending:
+                raise SessionBusyError(
+                    f"{session.pending} of your questions are still being processed; "
+                    "please wait for them to finish"
+                )
+            session.queued.append(time.monotonic())
+        return session
+
+    def start(self, session_id: str) -> None:
+        """Move a question of the session from the queue to running; call before processing it."""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                if session.queued:
+                    session.queued.popleft()
+                session.running += 1
+                session.last_active = time.monotonic()
+
+    def release(self, session_id: str) -> None:
+        """End a question started with :meth:`start`; call in a ``finally``."""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.running = max(session.running - 1, 0)
+                session.last_active = time.monotonic()
+
+    def close(self, session_id: str) -> None:
+        """Forget the session and remove its files."""
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self._cleanup(session)
+            logger.info("Closed session %s", session_id)
+
+    def _cleanup(self, session: ChatSession) -> None:
+        shutil.rmtree(session.temp_dir, ignore_errors=True)
+        if self.artifacts is not None:
+            self.artifacts.release_session(session.session_id)
+
+    def close_idle(self) -> None:
+        """Close the sessions without questions in flight that were idle for longer than the TTL."""
+        cutoff = time.monotonic() - self.ttl
+        with self._lock:
+            for session in self._sessions.values():
+                self._expire_queued(session)
+            idle = [s for s in self._sessions.values() if s.pending == 0 and s.last_active < cutoff]
+            for session in idle:
+                del self._sessions[session.session_id]
+        for session in idle:
+            self._cleanup(session)
+            logger.info("Closed idle session %s", session.session_id)
+
+    def close_all(self) -> None:
+        with self._lock:
+            session_ids = list(self._sessions)
+        for session_id in session_ids:
+            self.close(session_id)
@@ -1,13 +1,12 @@
 
-import os
 from langchain_openai import ChatOpenAI
+from nextgen.openai.registry import backend_settings, get_http_client
 
 # Instantiate the client. Make sure the client points to the self-hosted LLM.
 def md_anderson_llm():
     return ChatOpenAI(
-            api_key="unused",
-            base_url="https://apimd.mdanderson.edu/dig/llm/llama31-70b/v1/",
-            default_headers={"Ocp-Apim-Subscription-Key": os.environ["APIM_SUBSCRIPTION_KEY"]},
+            http_client=get_http_client(),
+            **backend_settings("md_anderson"),
     )
 
 
@@ -0,0 +1,210 @@
+"""
+Persistent cache of LLM responses for deterministic (temperature 0) chat completions.
+
+Responses are stored in a SQLite file keyed on the backend and base URL of the client,
+the model, the messages (with leading and trailing whitespace stripped) and the sampling
+parameters, with a time-to-live and LRU eviction once the cache holds more than
+``max_entries`` responses.
+
+The process-wide cache returned by :func:`get_response_cache` is configured with:
+    NEXTGEN_LLM_CACHE              Set to 0 to disable caching (default 1)
+    NEXTGEN_LLM_CACHE_PATH         SQLite file (default database/llm_cache.db)
+    NEXTGEN_LLM_CACHE_TTL          Seconds a response stays valid (default 604800, one week)
+    NEXTGEN_LLM_CACHE_MAX_ENTRIES  Maximum number of cached responses (default 10000)
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """SQLite-backed LLM response cache with TTL, LRU eviction and hit/miss counters."""
+
+    def __init__(self, path: str = "database/llm_cache.db", ttl: float = 7 * 24 * 3600,
+                 max_entries: int = 10000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS llm_response (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_llm_response_last_access ON llm_response (last_access)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model: str, messages: List[Dict[str, Any]], backend: Optional[str] = None,
+                 base_url: Optional[str] = None, **params) -> str:
+        """
+        Hash the backend, base URL, model, messages and sampling parameters into a cache key.
+
+        Only leading and trailing whitespace of the message contents is stripped; whitespace
+        inside a prompt (indentation of code, line breaks of a table) can change the answer.
+        """
+        normalized = [
+            {**message, "content": str(message.get("content", "")).strip()}
+            for message in messages
+        ]
+        payload = json.dumps(
+            {"backend": backend, "base_url": base_url, "model": model, "messages": normalized, "params": params},
+            sort_keys=True, default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached response for ``key``, or None if it is missing or expired."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM llm_response WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM llm_response WHERE key = ?", (key,))
+                self._conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE llm_response SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def set(self, key: str, response: str) -> None:
+        """Store a response, evicting the least recently used entries above ``max_entries``."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_response (key, response, created_at, last_access) "
+                "VALUES (?, ?, ?, ?)",
+                (key, response, now, now),
+            )
+            self._conn.execute(
+                """
+                DELETE FROM llm_response WHERE key IN (
+                    SELECT key FROM llm_response ORDER BY last_access DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_response")
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM llm_response").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+
+_cache: Optional[ResponseCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """Return the process-wide response cache, or None if caching is disabled."""
+    global _cache
+    if os.environ.get("NEXTGEN_LLM_CACHE", "1") == "0":
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache(
+                path=os.environ.get("NEXTGEN_LLM_CACHE_PATH", "database/llm_cache.db"),
+                ttl=float(os.environ.get("NEXTGEN_LLM_CACHE_TTL", 7 * 24 * 3600)),
+                max_entries=int(os.environ.get("NEXTGEN_LLM_CACHE_MAX_ENTRIES", 10000)),
+            )
+        return _cache
+
+
+def base_url(completions) -> Optional[str]:
+    """Base URL of the client a ``chat.completions`` resource belongs to, if it has one."""
+    url = getattr(getattr(completions, "_client", None), "base_url", None)
+    return None if url is None else str(url)
+
+
+def cached_chat_completion(completions, messages: List[Dict[str, Any]], model: str,
+                           backend: Optional[str] = None, **params) -> str:
+    """
+    Run ``completions.create`` and return the message content, serving temperature 0 calls
+    from the response cache.
+
+    Args:
+        completions: The ``chat.completions`` resource of an OpenAI-compatible client
+        messages: Chat messages
+        model: Model name
+        backend: LLM backend of the client, e.g. "md_anderson" or "openai"; part of the
+            cache key together with the client's base URL
+        **params: Other sampling parameters passed to ``create``
+
+    Returns:
+        The content of the first choice
+    """
+    cache = get_response_cache() if params.get("temperature") == 0 else None
+    if cache is None:
+        completion = completions.create(messages=messages, model=model, **params)
+        return completion.choices[0].message.content
+
+    key = ResponseCache.make_key(model, messages, backend, base_url(completions), **params)
+    response = cache.get(key)
+    if response is not None:
+        logger.info(f"LLM response cache hit ({cache.hits} hits, {cache.misses} misses)")
+        return response
+
+    completion = completions.create(messages=messages, model=model, **params)
+    response = completion.choices[0].message.content
+    if response is not None:
+        cache.set(key, response)
+    return response
+
+
+async def acached_chat_completion(completions, messages: List[Dict[str, Any]], model: str,
+                                  backend: Optional[str] = None, **params) -> str:
+    """
+    Async :func:`cached_chat_completion` for the ``chat.completions`` resource of an
+    AsyncOpenAI client. Cache lookups run in a worker thread so the event loop never
+    waits on SQLite.
+    """
+    cache = get_response_cache() if params.get("temperature") == 0 else None
+    if cache is None:
+        completion = await completions.create(messages=messages, model=model, **params)
+        return completion.choices[0].message.content
+
+    key = ResponseCache.make_key(model, messages, backend, base_url(completions), **params)
+    response = await asyncio.to_thread(cache.get, key)
+    if response is not None:
+        logger.info(f"LLM response cache hit ({cache.hits} hits, {cache.misses} misses)")
+        return response
+
+    completion = await completions.create(messages=messages, model=model, **params)
+    response = completion.choices[0].message.content
+    if response is not None:
+        await asyncio.to_thread(cache.set, key, response)
+    return response
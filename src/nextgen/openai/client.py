@@ -1,18 +1,17 @@
-from openai import OpenAI
-import os
 import logging
+from nextgen.openai.registry import get_openai_client
+from nextgen.openai.cache import cached_chat_completion
 
 class MDAndersonLLM():
     def __init__(self, **kwargs):
-        """Initialize the LLM client with APIM subscription key and optional parameters."""
-        self.client = OpenAI(
-            api_key="unused",
-            base_url="https://apimd.mdanderson.edu/dig/llm/llama31-70b/v1/",
-            default_headers={"Ocp-Apim-Subscription-Key": os.environ.get("APIM_SUBSCRIPTION_KEY", "")}
-        ).chat.completions
-
+        """Initialize the LLM client with optional parameters; the APIM subscription key is read on first use."""
         self._invocation_params = kwargs
 
+    @property
+    def client(self):
+        """Completions resource of the shared MD Anderson client, created when first needed."""
+        return get_openai_client("md_anderson").chat.completions
+
     def chat(self, message: str) -> str:
 
         params = {
@@ -22,8 +21,7 @@ class MDAndersonLLM():
         }
         messages = [{"role": "user", "content": message}]
         try:
-            response = self.client.create(messages=messages, **params)
-            return response.choices[0].message.content
+            return cached_chat_completion(self.client, messages=messages, backend="md_anderson", **params)
         except Exception as e:
             logging.error(f"Error during chat completion: {e}")
             return "An error occurred while processing your request."
@@ -0,0 +1,180 @@
+"""
+Process-wide registry of OpenAI-compatible clients.
+
+Every agent and LLM wrapper gets its client from here, so all requests to the same gateway
+share one tuned httpx connection pool (keep-alive, HTTP/2 when the ``h2`` package is
+installed) instead of opening a pool per agent. Async clients share one pool per event
+loop, since asyncio connections cannot move between loops; code that runs a short-lived
+loop must await :func:`aclose_async_clients` on it before closing it.
+
+Pool settings can be tuned with environment variables:
+    NEXTGEN_LLM_TIMEOUT                    Read/write timeout in seconds (default 600)
+    NEXTGEN_LLM_CONNECT_TIMEOUT            Connect timeout in seconds (default 10)
+    NEXTGEN_LLM_MAX_CONNECTIONS            Maximum concurrent connections (default 20)
+    NEXTGEN_LLM_MAX_KEEPALIVE_CONNECTIONS  Idle connections kept open (default 10)
+    NEXTGEN_LLM_KEEPALIVE_EXPIRY           Seconds an idle connection is kept (default 60)
+"""
+
+import asyncio
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+import httpx
+from openai import AsyncOpenAI, OpenAI
+
+MD_ANDERSON_BASE_URL = "https://apimd.mdanderson.edu/dig/llm/llama31-70b/v1/"
+OPENAI_BASE_URL = "https://api.openai.com/v1"
+
+# Supported backends
+LLM_BACKENDS = ("md_anderson", "openai")
+
+_lock = threading.Lock()
+_http_client: Optional[httpx.Client] = None
+_clients: Dict[Tuple[str, Optional[str]], OpenAI] = {}
+# Per event loop: the async httpx client and the AsyncOpenAI clients using it. The clients
+# reference their loop, so entries are only removed by aclose_async_clients
+_async_clients: Dict[asyncio.AbstractEventLoop, dict] = {}
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def http_timeout() -> httpx.Timeout:
+    return httpx.Timeout(
+        float(os.environ.get("NEXTGEN_LLM_TIMEOUT", 600)),
+        connect=float(os.environ.get("NEXTGEN_LLM_CONNECT_TIMEOUT", 10)),
+    )
+
+
+def http_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=int(os.environ.get("NEXTGEN_LLM_MAX_CONNECTIONS", 20)),
+        max_keepalive_connections=int(os.environ.get("NEXTGEN_LLM_MAX_KEEPALIVE_CONNECTIONS", 10)),
+        keepalive_expiry=float(os.environ.get("NEXTGEN_LLM_KEEPALIVE_EXPIRY", 60)),
+    )
+
+
+def get_http_client() -> httpx.Client:
+    """Return the httpx client whose connection pool is shared by every LLM client."""
+    global _http_client
+    with _lock:
+        if _http_client is None:
+            _http_client = httpx.Client(
+                http2=_http2_available(),
+                timeout=http_timeout(),
+                limits=http_limits(),
+            )
+        return _http_client
+
+
+def backend_settings(backend: str, api_key: Optional[str] = None) -> dict:
+    """
+    Connection settings for an LLM backend.
+
+    Args:
+        backend: "md_anderson" or "openai"
+        api_key: Overrides the key read from the environment (APIM_SUBSCRIPTION_KEY for
+            "md_anderson", OPENAI_API_KEY for "openai")
+
+    Returns:
+        Keyword arguments for an OpenAI-compatible client: api_key, base_url, default_headers
+
+    Raises:
+        ValueError: If the backend is unknown
+        RuntimeError: If the backend's API key is not configured
+    """
+    if backend == "md_anderson":
+        subscription_key = api_key or os.environ.get("APIM_SUBSCRIPTION_KEY")
+        if not subscription_key:
+            raise RuntimeError("Missing required environment variable: APIM_SUBSCRIPTION_KEY")
+        return {
+            "api_key": "unused",
+            "base_url": MD_ANDERSON_BASE_URL,
+            "default_headers": {"Ocp-Apim-Subscription-Key": subscription_key},
+        }
+    if backend == "openai":
+        openai_key = api_key or os.environ.get("OPENAI_API_KEY")
+        if not openai_key:
+            raise RuntimeError("Missing required environment variable: OPENAI_API_KEY")
+        return {
+            "api_key": openai_key,
+            "base_url": OPENAI_BASE_URL,
+            "default_headers": None,
+        }
+    raise ValueError(f"Invalid model: {backend}")
+
+
+def get_openai_client(backend: str, api_key: Optional[str] = None) -> OpenAI:
+    """
+    Return the process-wide OpenAI client for ``backend``.
+
+    Clients are created once per (backend, api_key) and all use the shared connection pool
+    from :func:`get_http_client`.
+    """
+    key = (backend, api_key)
+    with _lock:
+        client = _clients.get(key)
+    if client is not None:
+        return client
+
+    settings = backend_settings(backend, api_key)
+    http_client = get_http_client()
+    with _lock:
+        if key not in _clients:
+            _clients[key] = OpenAI(http_client=http_client, **settings)
+        return _clients[key]
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """Return the async httpx client whose connection pool is shared on the running event loop."""
+    return _async_loop_clients()["http"]
+
+
+def _async_loop_clients() -> dict:
+    loop = asyncio.get_running_loop()
+    with _lock:
+        clients = _async_clients.get(loop)
+        if clients is None:
+            clients = {
+                "http": httpx.AsyncClient(http2=_http2_available(), timeout=http_timeout(), limits=http_limits()),
+            }
+            _async_clients[loop] = clients
+        return clients
+
+
+def get_async_openai_client(backend: str, api_key: Optional[str] = None) -> AsyncOpenAI:
+    """
+    Return the AsyncOpenAI client for ``backend`` on the running event loop.
+
+    Clients are created once per (event loop, backend, api_key) and all use the loop's
+    shared connection pool from :func:`get_async_http_client`. Must be called from a
+    coroutine.
+    """
+    clients = _async_loop_clients()
+    key = (backend, api_key)
+    if key not in clients:
+        settings = backend_settings(backend, api_key)
+        with _lock:
+            clients.setdefault(key, AsyncOpenAI(http_client=clients["http"], **settings))
+    return clients[key]
+
+
+async def aclose_async_clients() -> None:
+    """
+    Close the connection pool of the running event loop and forget its async clients.
+
+    The next :func:`get_async_openai_client` call on the loop creates new ones. Must be
+    called from a coroutine.
+    """
+    loop = asyncio.get_running_loop()
+    with _lock:
+        clients = _async_clients.pop(loop, None)
+    if clients is not None:
+        # The AsyncOpenAI clients only wrap the shared pool
+        await clients["http"].aclose()
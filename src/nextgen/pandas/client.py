@@ -1,10 +1,10 @@
 from __future__ import annotations
 from typing import TYPE_CHECKING
-import os
-from openai import OpenAI
 from pandasai.helpers.memory import Memory
 from pandasai.prompts.base import BasePrompt
 from pandasai.llm.base import LLM
+from nextgen.openai.registry import get_openai_client
+from nextgen.openai.cache import cached_chat_completion
 
 if TYPE_CHECKING:
     from pandasai.pipelines.pipeline_context import PipelineContext
@@ -13,11 +13,7 @@ class MDAndersonLLM(LLM):
     def __init__(self, model: str = "unused", **kwargs):
         """Initialize the LLM client with APIM subscription key."""
         self.model = model
-        self.client = OpenAI(
-            api_key="unused",
-            base_url="https://apimd.mdanderson.edu/dig/llm/llama31-70b/v1/",
-            default_headers={"Ocp-Apim-Subscription-Key": os.environ["APIM_SUBSCRIPTION_KEY"]}
-        ).chat.completions
+        self.client = get_openai_client("md_anderson").chat.completions
         self._invocation_params = kwargs
 
     def chat_completion(self, value: str, memory: Memory) -> str:
@@ -36,9 +32,7 @@ class MDAndersonLLM(LLM):
             "temperature": 0,
             **self._invocation_params
         }
-        response = self.client.create(**params)
-        
-        return response.choices[0].message.content
+        return cached_chat_completion(self.client, backend="md_anderson", **params)
 
     def call(self, instruction: BasePrompt, context: PipelineContext = None) -> str:
         """Call the LLM with the given instruction and context."""
@@ -1,8 +1,7 @@
-import os
-
-from openai import OpenAI
 from vanna.base import VannaBase
 from vanna.chromadb import ChromaDB_VectorStore
+from nextgen.openai.registry import get_openai_client
+from nextgen.openai.cache import cached_chat_completion
 
 class MDAndersonLLM_Chat(VannaBase):
 
@@ -15,12 +14,9 @@ class MDAndersonLLM_Chat(VannaBase):
         if "APIM_SUBSCRIPTION_KEY" not in config:
             raise ValueError("config must contain APIM_SUBSCRIPTION_KEY")
 
-        self.client = OpenAI(
-            api_key="unused",
-            base_url="https://apimd.mdanderson.edu/dig/llm/llama31-70b/v1/",
-            default_headers={"Ocp-Apim-Subscription-Key": config["APIM_SUBSCRIPTION_KEY"]},
-        )
+        self.client = get_openai_client("md_anderson", api_key=config["APIM_SUBSCRIPTION_KEY"])
         self.model = "unused"
+        self.temperature = config.get("temperature", 0.7)
 
     def set_temperature(self, temperature: float) -> None:
         """Set the temperature for text generation."""
@@ -45,11 +41,11 @@ class MDAndersonLLM_Chat(VannaBase):
         return sql
 
     def submit_prompt(self, prompt, **kwargs) -> str:
-        completion = self.client.chat.completions.create(
+        return cached_chat_completion(
+            self.client.chat.completions,
             messages=prompt,
             model=self.model,
-            temperature=0.7
+            backend="md_anderson",
+            temperature=self.temperature
         )
-
-        return completion.choices[0].message.content
     
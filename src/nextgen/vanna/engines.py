@@ -0,0 +1,233 @@
+"""
+SQL engines the Vanna instance of the DataScientistAgent can run generated SQL on.
+
+    sqlite   The SQLite database built by construct_database (default)
+    duckdb   DuckDB's multi-threaded, vectorized executor over the same data: a DuckDB copy
+             written by construct_database/export_duckdb.py when sql_path ends in .duckdb,
+             otherwise the SQLite file attached read-only through DuckDB's sqlite extension
+    parquet  The Parquet dataset written by construct_database/export_parquet.py, queried
+             with DuckDB. The measurement view has the columns of the SQLite view plus the
+             partition_cancer_type key of its dataset, so filters on it skip whole
+             partitions; the Vanna instance is told about the column.
+
+Every engine returns compact DataFrames: the protein_group, cancer_type and run key columns
+are categoricals, other text columns are Arrow-backed strings instead of Python objects.
+DuckDB engines fetch results as Arrow tables and convert them without going through Python
+objects. DuckDB is an optional dependency, imported only when a DuckDB-based engine is used.
+"""
+
+import os
+import sqlite3
+import threading
+from contextlib import closing
+from pathlib import Path
+from typing import Iterator, Optional, Sequence
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+SQL_ENGINES = ("sqlite", "duckdb", "parquet")
+
+# Low-cardinality key columns returned as categoricals
+CATEGORICAL_COLUMNS = ("protein_group", "cancer_type", "run")
+
+# Hive partition key of the Parquet measurement dataset (see construct_database/export_parquet.py)
+MEASUREMENT_PARTITION_COLUMN = "partition_cancer_type"
+
+# Documentation added to the SQL prompt of the parquet engine
+PARQUET_DOCUMENTATION = (
+    f"measurement.{MEASUREMENT_PARTITION_COLUMN} is the cancer type of the run the measurement "
+    "comes from (the same value as sample.cancer_type). The measurement data is partitioned by it: "
+    f"when a question restricts cancer types, also filter measurement.{MEASUREMENT_PARTITION_COLUMN} "
+    "so only those partitions are read."
+)
+
+# Rows per chunk when a result is streamed
+STREAM_CHUNK_SIZE = 100_000
+
+
+def resolve_sql_engine(engine: Optional[str] = None) -> str:
+    """The given engine, or the NEXTGEN_SQL_ENGINE environment variable (default sqlite)."""
+    return engine or os.environ.get("NEXTGEN_SQL_ENGINE", "sqlite")
+
+
+def _arrow_types(arrow_type: pa.DataType):
+    """Map Arrow strings to pandas' Arrow-backed string dtype; other types use the defaults."""
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        return pd.StringDtype("pyarrow")
+    return None
+
+
+def arrow_to_frame(table: pa.Table, categorical_columns: Sequence[str] = CATEGORICAL_COLUMNS) -> pd.DataFrame:
+    """
+    Convert an Arrow table to a compact DataFrame.
+
+    Key columns are dictionary-encoded and become categoricals, other strings stay in Arrow
+    memory and numeric columns without nulls are converted without copying.
+    """
+    for name in categorical_columns:
+        index = table.schema.get_field_index(name)
+        if index >= 0 and not pa.types.is_dictionary(table.schema.field(index).type):
+            table = table.set_column(index, name, pc.dictionary_encode(table.column(index)))
+    return table.to_pandas(types_mapper=_arrow_types)
+
+
+def compact_frame(df: pd.DataFrame, categorical_columns: Sequence[str] = CATEGORICAL_COLUMNS) -> pd.DataFrame:
+    """Convert the key columns of a DataFrame to categoricals and object text columns to Arrow strings."""
+    columns = {}
+    for name, dtype in df.dtypes.items():
+        if name in categorical_columns and not isinstance(dtype, pd.CategoricalDtype):
+            columns[name] = df[name].astype("category")
+        elif dtype == object and pd.api.types.infer_dtype(df[name], skipna=True) == "string":
+            columns[name] = df[name].astype(pd.StringDtype("pyarrow"))
+    return df.assign(**columns) if columns else df
+
+
+def stream_schema(table: pa.Table) -> pa.Schema:
+    """Schema with int32 dictionary indices, so chunks with more categories still fit."""
+    return pa.schema([
+        pa.field(field.name, pa.dictionary(pa.int32(), field.type.value_type))
+        if pa.types.is_dictionary(field.type) else field
+        for field in table.schema
+    ])
+
+
+def concat_chunks(chunks: Sequence[pd.DataFrame]) -> pd.DataFrame:
+    """Concatenate streamed chunks, keeping categorical columns whose categories differ per chunk."""
+    chunks = list(chunks)
+    if len(chunks) == 1:
+        return chunks[0]
+    columns = {}
+    for name, dtype in chunks[0].dtypes.items():
+        if isinstance(dtype, pd.CategoricalDtype):
+            columns[name] = pd.api.types.union_categoricals([chunk[name] for chunk in chunks])
+    df = pd.concat([chunk.drop(columns=list(columns)) for chunk in chunks], ignore_index=True)
+    for name, values in columns.items():
+        df[name] = values
+    return df[chunks[0].columns]
+
+
+class SQLiteRunner:
+    """
+    Run SQL on a SQLite database and return compact DataFrames.
+
+    Every call opens its own read-only connection, so the runner can be shared by agents
+    running in different threads.
+    """
+
+    def __init__(self, sql_path: str):
+        self.sql_path = sql_path
+
+    def __call__(self, sql: str) -> pd.DataFrame:
+        with closing(sqlite3.connect(f"file:{self.sql_path}?mode=ro", uri=True)) as conn:
+            return compact_frame(pd.read_sql_query(sql, conn, dtype_backend="pyarrow"))
+
+    def stream(self, sql: str, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+        """Yield the result in chunks of ``chunk_size`` rows; closing the generator stops the query."""
+        with closing(sqlite3.connect(f"file:{self.sql_path}?mode=ro", uri=True)) as conn:
+            for chunk in pd.read_sql_query(sql, conn, chunksize=chunk_size, dtype_backend="pyarrow"):
+                yield compact_frame(chunk)
+
+
+def _import_duckdb():
+    try:
+        import duckdb
+    except ImportError as e:
+        raise ImportError("The duckdb and parquet SQL engines require duckdb: pip install duckdb") from e
+    return duckdb
+
+
+def parquet_views(parquet_path: str) -> list:
+    """SQL creating the measurement, sample and proteins views over a Parquet dataset."""
+    root = Path(parquet_path)
+    if not (root / "measurement").is_dir():
+        raise FileNotFoundError(f"No measurement dataset in '{parquet_path}'; run construct_database/export_parquet.py")
+
+    statements = [
+        "CREATE VIEW measurement AS SELECT * FROM read_parquet("
+        f"'{(root / 'measurement').as_posix()}/*/*.parquet', hive_partitioning = true, "
+        f"hive_types = {{'{MEASUREMENT_PARTITION_COLUMN}': VARCHAR}})"
+    ]
+    for name in ("sample", "proteins"):
+        path = root / f"{name}.parquet"
+        if path.exists():
+            statements.append(f"CREATE VIEW {name} AS SELECT * FROM read_parquet('{path.as_posix()}')")
+    return statements
+
+
+def attach_sqlite_sql(sql_path: str) -> list:
+    """SQL attaching a SQLite database read-only and making it the default catalog."""
+    return [
+        "INSTALL sqlite",
+        "LOAD sqlite",
+        f"ATTACH '{Path(sql_path).as_posix()}' AS nextgen (TYPE sqlite, READ_ONLY)",
+        "USE nextgen",
+    ]
+
+
+class DuckDBRunner:
+    """
+    Run SQL on a DuckDB database and return pandas DataFrames.
+
+    Each call gets its own cursor, so the runner can be shared by agents running in
+    different threads.
+    """
+
+    def __init__(self, database: str = ":memory:", init_sql: list = (), read_only: bool = False):
+        duckdb = _import_duckdb()
+        self.conn = duckdb.connect(database, read_only=read_only)
+        for statement in init_sql:
+            self.conn.execute(statement)
+        self._lock = threading.Lock()
+
+    def __call__(self, sql: str) -> pd.DataFrame:
+        with self._lock:
+            cursor = self.conn.cursor()
+        try:
+            return arrow_to_frame(cursor.execute(sql).fetch_arrow_table())
+        finally:
+            cursor.close()
+
+    def stream(self, sql: str, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+        """Yield the result in chunks of ``chunk_size`` rows; closing the generator stops the query."""
+        with self._lock:
+            cursor = self.conn.cursor()
+        try:
+            for batch in cursor.execute(sql).fetch_record_batch(chunk_size):
+                yield arrow_to_frame(pa.Table.from_batches([batch]))
+        finally:
+            cursor.close()
+
+
+def connect_sql_engine(vn, engine: str = "sqlite", sql_path: str = "database/nextgen.db",
+                       parquet_path: str = "database/parquet") -> None:
+    """
+    Connect a Vanna instance to a SQL engine.
+
+    Args:
+        vn: Vanna instance
+        engine: One of SQL_ENGINES
+        sql_path: SQLite database, or a DuckDB copy (.duckdb) for the duckdb engine
+        parquet_path: Parquet dataset directory, used by the parquet engine
+
+    Raises:
+        ValueError: If the engine is unknown
+    """
+    if engine == "sqlite":
+        vn.connect_to_sqlite(sql_path)
+        vn.run_sql = SQLiteRunner(sql_path)
+        return
+    if engine == "duckdb" and Path(sql_path).suffix == ".duckdb":
+        runner = DuckDBRunner(sql_path, read_only=True)
+    elif engine == "duckdb":
+        runner = DuckDBRunner(init_sql=attach_sqlite_sql(sql_path))
+    elif engine == "parquet":
+        runner = DuckDBRunner(init_sql=parquet_views(parquet_path))
+        vn.static_documentation = PARQUET_DOCUMENTATION
+    else:
+        raise ValueError(f"Invalid SQL engine: {engine}. Expected one of {SQL_ENGINES}")
+
+    vn.dialect = "DuckDB SQL"
+    vn.run_sql = runner
+    vn.run_sql_is_set = True
@@ -0,0 +1,335 @@
+"""
+Two-level cache for the DataScientistAgent.
+
+Level 1 maps a normalized question to the SQL generated for it, level 2 maps SQL text to
+its result, stored as a Parquet file. Every entry is tied to a fingerprint of the data the
+SQL runs on: for a database file its path, its SQLite schema version (if any) and the size
+and modification time of the file and its WAL file, for a Parquet dataset directory the
+size and modification time of its files. When the fingerprint changes, the entries (and
+result files) of the previous fingerprint are deleted. Several caches for different data
+(e.g. the SQLite and Parquet engines) can share one directory.
+
+A Parquet dataset has a file per partition and batch, so its fingerprint is reused for
+NEXTGEN_QUERY_CACHE_DATASET_TTL seconds (default 5) instead of walking the dataset on every
+lookup; a dataset rewritten within that interval is noticed at the next walk.
+
+The cache is bounded, least recently used entries going first:
+    NEXTGEN_QUERY_CACHE_MAX_MB         Total size of the cached result files in MiB (default 1024)
+    NEXTGEN_QUERY_CACHE_MAX_QUESTIONS  Number of cached questions (default 10000)
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from pathlib import Path
+from typing import Iterator, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from nextgen.vanna.engines import STREAM_CHUNK_SIZE, arrow_to_frame, stream_schema
+
+logger = logging.getLogger(__name__)
+
+QUERY_CACHE_MAX_BYTES = int(float(os.environ.get("NEXTGEN_QUERY_CACHE_MAX_MB", 1024)) * 1024 * 1024)
+QUERY_CACHE_MAX_QUESTIONS = int(os.environ.get("NEXTGEN_QUERY_CACHE_MAX_QUESTIONS", 10000))
+QUERY_CACHE_DATASET_TTL = float(os.environ.get("NEXTGEN_QUERY_CACHE_DATASET_TTL", 5))
+
+# Layout of the index; an index written with another layout is dropped with its results
+_INDEX_VERSION = 2
+
+
+def normalize_question(question: str) -> str:
+    """Lowercase the question and collapse whitespace."""
+    return " ".join(question.lower().split())
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class QueryCache:
+    """
+    Question -> SQL -> result cache invalidated when the database changes.
+
+    Args:
+        db_path: Database file or Parquet dataset directory the SQL runs on
+        cache_dir: Directory of the index and the result files
+        max_bytes: Total size of the result files the cache is kept under
+        max_questions: Number of questions the cache keeps the SQL of
+        dataset_ttl: Seconds the fingerprint of a Parquet dataset directory is reused for
+    """
+
+    def __init__(self, db_path: str, cache_dir: str = "database/query_cache",
+                 max_bytes: int = QUERY_CACHE_MAX_BYTES, max_questions: int = QUERY_CACHE_MAX_QUESTIONS,
+                 dataset_ttl: float = QUERY_CACHE_DATASET_TTL):
+        self.db_path = db_path
+        self.cache_dir = Path(cache_dir)
+        self.results_dir = self.cache_dir / "results"
+        self.results_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.max_questions = max_questions
+        self.dataset_ttl = dataset_ttl
+        self._lock = threading.Lock()
+        self._dataset_fingerprint = None
+        self._dataset_fingerprint_time = 0.0
+
+        self._conn = sqlite3.connect(self.cache_dir / "index.db", check_same_thread=False)
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] != _INDEX_VERSION:
+            self._conn.executescript(
+                """
+                DROP TABLE IF EXISTS meta;
+                DROP TABLE IF EXISTS question_sql;
+                DROP TABLE IF EXISTS sql_result;
+                """
+            )
+            self._conn.execute(f"PRAGMA user_version = {_INDEX_VERSION}")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS question_sql (
+                question_key TEXT PRIMARY KEY,
+                fingerprint TEXT NOT NULL,
+                question TEXT NOT NULL,
+                sql TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS sql_result (
+                sql_key TEXT PRIMARY KEY,
+                fingerprint TEXT NOT NULL,
+                sql TEXT NOT NULL,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_question_sql_fingerprint ON question_sql (fingerprint);
+            CREATE INDEX IF NOT EXISTS idx_sql_result_fingerprint ON sql_result (fingerprint);
+            """
+        )
+        self._conn.commit()
+        self._remove_orphans()
+
+    def fingerprint(self) -> str:
+        """Fingerprint of the database schema and contents."""
+        if os.path.isdir(self.db_path):
+            now = time.monotonic()
+            if self._dataset_fingerprint is None or now - self._dataset_fingerprint_time >= self.dataset_ttl:
+                digest = hashlib.sha256()
+                for path in sorted(Path(self.db_path).rglob("*")):
+                    if path.is_file():
+                        stat = path.stat()
+                        digest.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8"))
+                self._dataset_fingerprint, self._dataset_fingerprint_time = digest.hexdigest(), now
+            return self._dataset_fingerprint
+
+        parts = [os.path.abspath(self.db_path)]
+        try:
+            with closing(sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)) as conn:
+                parts.append(str(conn.execute("PRAGMA schema_version").fetchone()[0]))
+        except sqlite3.DatabaseError:
+            # Not a SQLite file (e.g. a DuckDB copy); size and modification time still apply
+            pass
+        for path in (self.db_path, f"{self.db_path}-wal"):
+            if os.path.exists(path):
+                stat = os.stat(path)
+                parts.append(f"{stat.st_size}:{stat.st_mtime_ns}")
+        return ":".join(parts)
+
+    def _remove_orphans(self) -> None:
+        """Delete result files the index does not reference, e.g. left by an interrupted writer."""
+        with self._lock:
+            referenced = {path for (path,) in self._conn.execute("SELECT path FROM sql_result")}
+        for path in self.results_dir.iterdir():
+            if path.suffix == ".parquet" and str(path) not in referenced:
+                path.unlink(missing_ok=True)
+
+    def _delete_results(self, where: str, params: tuple = ()) -> None:
+        """Delete the matching result entries and their files. Caller holds the lock."""
+        rows = self._conn.execute(f"SELECT path FROM sql_result WHERE {where}", params).fetchall()
+        for (path,) in rows:
+            Path(path).unlink(missing_ok=True)
+        self._conn.execute(f"DELETE FROM sql_result WHERE {where}", params)
+
+    def _validate(self) -> str:
+        """
+        Delete the entries of an earlier state of the database. Caller holds the lock.
+
+        Returns:
+            The current fingerprint
+        """
+        current = self.fingerprint()
+        meta_key = f"fingerprint:{os.path.abspath(self.db_path)}"
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (meta_key,)).fetchone()
+        if row is not None and row[0] == current:
+            return current
+        if row is not None:
+            logger.info("Database changed, invalidating query cache")
+            self._conn.execute("DELETE FROM question_sql WHERE fingerprint = ?", (row[0],))
+            self._delete_results("fingerprint = ?", (row[0],))
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (meta_key, current))
+        self._conn.commit()
+        return current
+
+    @staticmethod
+    def _question_key(fingerprint: str, question: str) -> str:
+        return _digest(f"{fingerprint}\n{normalize_question(question)}")
+
+    @staticmethod
+    def _sql_key(fingerprint: str, sql: str) -> str:
+        return _digest(f"{fingerprint}\n{sql.strip()}")
+
+    def get_sql(self, question: str) -> Optional[str]:
+        with self._lock:
+            key = self._question_key(self._validate(), question)
+            row = self._conn.execute("SELECT sql FROM question_sql WHERE question_key = ?", (key,)).fetchone()
+            if row is not None:
+                self._conn.execute("UPDATE question_sql SET last_access = ? WHERE question_key = ?", (time.time(), key))
+                self._conn.commit()
+        return row[0] if row else None
+
+    def set_sql(self, question: str, sql: str) -> None:
+        now = time.time()
+        with self._lock:
+            fingerprint = self._validate()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO question_sql (question_key, fingerprint, question, sql, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (self._question_key(fingerprint, question), fingerprint, normalize_question(question), sql, now, now),
+            )
+            self._conn.execute(
+                """
+                DELETE FROM question_sql WHERE question_key IN (
+                    SELECT question_key FROM question_sql ORDER BY last_access DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_questions,),
+            )
+            self._conn.commit()
+
+    def _result_path(self, sql: str) -> Optional[str]:
+        """Path of the cached result of ``sql``, marked as just used, or None if it is not cached."""
+        with self._lock:
+            key = self._sql_key(self._validate(), sql)
+            row = self._conn.execute("SELECT path FROM sql_result WHERE sql_key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if not os.path.exists(row[0]):
+                self._conn.execute("DELETE FROM sql_result WHERE sql_key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE sql_result SET last_access = ? WHERE sql_key = ?", (time.time(), key))
+            self._conn.commit()
+            return row[0]
+
+    def get_result(self, sql: str) -> Optional[pd.DataFrame]:
+        path = self._result_path(sql)
+        return None if path is None else pd.read_parquet(path)
+
+    def iter_result(self, sql: str, chunk_size: int = STREAM_CHUNK_SIZE) -> Optional[Iterator[pd.DataFrame]]:
+        """Cached result streamed in chunks, or None if it is not cached."""
+        path = self._result_path(sql)
+        if path is None:
+            return None
+        parquet_file = pq.ParquetFile(path)
+        return (arrow_to_frame(pa.Table.from_batches([batch]))
+                for batch in parquet_file.iter_batches(batch_size=chunk_size))
+
+    def result_writer(self, sql: str) -> "ResultWriter":
+        """Writer caching a streamed result chunk by chunk; see ResultWriter."""
+        with self._lock:
+            fingerprint = self._validate()
+        return ResultWriter(self, sql, fingerprint)
+
+    def set_result(self, sql: str, df: pd.DataFrame) -> None:
+        with self._lock:
+            fingerprint = self._validate()
+        path = self.results_dir / f"{self._sql_key(fingerprint, sql)}.parquet"
+        # Written next to the result and renamed, so a concurrent reader never sees a partial file
+        temp_path = path.with_name(f"{path.stem}.{threading.get_ident()}.tmp")
+        try:
+            df.to_parquet(temp_path, index=False)
+        except Exception as e:
+            logger.warning(f"Could not cache query result as Parquet: {e}")
+            temp_path.unlink(missing_ok=True)
+            return
+        os.replace(temp_path, path)
+        self._register_result(sql, path, fingerprint)
+
+    def _register_result(self, sql: str, path: Path, fingerprint: str) -> None:
+        """
+        Add a written result file to the index, then evict the least recently used results
+        above ``max_bytes``. A result of a database state that has changed since the query
+        ran is deleted instead.
+        """
+        now = time.time()
+        with self._lock:
+            if self._validate() != fingerprint:
+                path.unlink(missing_ok=True)
+                return
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sql_result (sql_key, fingerprint, sql, path, size, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self._sql_key(fingerprint, sql), fingerprint, sql, str(path), path.stat().st_size, now, now),
+            )
+            self._delete_results(
+                """sql_key IN (
+                    SELECT sql_key FROM (
+                        SELECT sql_key, SUM(size) OVER (ORDER BY last_access DESC, sql_key) AS total FROM sql_result
+                    ) WHERE total > ?
+                )""",
+                (self.max_bytes,),
+            )
+            self._conn.commit()
+
+
+class ResultWriter:
+    """
+    Write a streamed query result to the result cache one chunk at a time.
+
+    The result is only registered by :meth:`commit`, so a stream that is stopped early
+    (e.g. by a row cap) does not leave a partial result in the cache; call :meth:`abort`
+    instead. Chunks that cannot be written disable the writer with a warning.
+    """
+
+    def __init__(self, cache: QueryCache, sql: str, fingerprint: str):
+        self.cache = cache
+        self.sql = sql
+        self.fingerprint = fingerprint
+        self.path = cache.results_dir / f"{QueryCache._sql_key(fingerprint, sql)}.parquet"
+        self.temp_path = self.path.with_name(f"{self.path.stem}.{threading.get_ident()}.tmp")
+        self._writer = None
+        self._failed = False
+
+    def write(self, chunk: pd.DataFrame) -> None:
+        if self._failed:
+            return
+        try:
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.temp_path, stream_schema(table))
+            self._writer.write_table(table.cast(self._writer.schema))
+        except Exception as e:
+            logger.warning(f"Could not cache query result as Parquet: {e}")
+            self.abort()
+            self._failed = True
+
+    def commit(self) -> None:
+        if self._failed or self._writer is None:
+            return
+        self._writer.close()
+        self._writer = None
+        os.replace(self.temp_path, self.path)
+        self.cache._register_result(self.sql, self.path, self.fingerprint)
+
+    def abort(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        self.temp_path.unlink(missing_ok=True)
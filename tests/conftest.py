@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from add_measurement_table import add_measurement_table
+from add_sample_table import add_sample_table
+
+CANCER_TYPES = ["breast", "gastric", "lung"]
+
+
+def _frame(n, offset=0):
+    """Result frame of proteins P{offset}..P{offset + n - 1} with their number as intensity."""
+    return pd.DataFrame({"protein_group": [f"P{i}" for i in range(offset, offset + n)],
+                         "intensity": [float(i) for i in range(offset, offset + n)]})
+
+
+def _measurements(runs, seed, n_proteins=6):
+    """Measurement export rows of every protein in every run; every third protein group has two members."""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for run in runs:
+        for i in range(n_proteins):
+            rows.append({
+                "Protein.Group": f"P{i};P{i}-2" if i % 3 == 0 else f"P{i}",
+                "Protein.Ids": f"P{i}",
+                "Genes": f"G{i}",
+                "Citrullination_R": "TRUE" if i % 2 else "FALSE",
+                "Run": run,
+                "intensity": rng.uniform(1e3, 1e6),
+            })
+    return pd.DataFrame(rows)
+
+
+def _samples(runs):
+    """Sample metadata rows; the cancer type cycles through CANCER_TYPES by run number."""
+    return pd.DataFrame({
+        "Run": runs,
+        "IPAS": [f"I{run[1:]}" for run in runs],
+        "is_case": True,
+        "Sex (1 male 0 female)": [int(run[1:]) % 2 for run in runs],
+        "Cancer_Type": [CANCER_TYPES[int(run[1:]) % len(CANCER_TYPES)] for run in runs],
+        "Group": "a",
+        "Age": [40 + int(run[1:]) for run in runs],
+    })
+
+
+@pytest.fixture
+def long_df():
+    """
+    Long-format intensities of 40 proteins in 150 runs of three cancer types, one row per
+    protein and run, with 60 missing. The log2 intensities are at least four rank sketch
+    bins apart (see nextgen.analysis.accumulators), so no two of them tie.
+    """
+    rng = np.random.default_rng(0)
+    runs = pd.DataFrame({"run": [f"R{i:03d}" for i in range(150)],
+                         "cancer_type": np.resize(CANCER_TYPES, 150)})
+    proteins = pd.DataFrame({"protein_group": [f"P{i:02d}" for i in range(40)]})
+    df = runs.merge(proteins, how="cross")[["protein_group", "cancer_type", "run"]]
+    df["intensity"] = 2.0 ** (5 + (rng.permutation(len(df)) + 0.5) * 0.004)
+    df.loc[rng.choice(len(df), 60, replace=False), "intensity"] = np.nan
+    return df
+
+
+@pytest.fixture
+def two_group_df(long_df):
+    """The breast and gastric rows of ``long_df``."""
+    return long_df[long_df["cancer_type"] != "lung"].reset_index(drop=True)
+
+
+@pytest.fixture
+def make_frame():
+    """Factory of small result frames: ``make_frame(n, offset=0)``."""
+    return _frame
+
+
+@pytest.fixture
+def make_measurements():
+    """Factory of measurement export frames: ``make_measurements(runs, seed, n_proteins=6)``."""
+    return _measurements
+
+
+@pytest.fixture
+def make_samples():
+    """Factory of sample metadata frames: ``make_samples(runs)``."""
+    return _samples
+
+
+@pytest.fixture
+def nextgen_db(tmp_path):
+    """SQLite database built by construct_database from 12 runs of 8 proteins in three cancer types."""
+    runs = [f"R{i}" for i in range(12)]
+    measurement_csv, sample_csv = tmp_path / "measurements.csv", tmp_path / "samples.csv"
+    _measurements(runs, seed=0, n_proteins=8).to_csv(measurement_csv, index=False)
+    _samples(runs).to_csv(sample_csv, index=False)
+    db_file = str(tmp_path / "nextgen.db")
+    assert add_measurement_table(db_file, str(measurement_csv))
+    assert add_sample_table(db_file, str(sample_csv))
+    return db_file
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from nextgen.analysis import (
+    DifferentialExpressionAccumulator,
+    GroupedMoments,
+    GroupedRankSketch,
+    differential_expression,
+    grouped_auc,
+    multi_group_differential_expression,
+)
+
+
+def _chunks(df, size=700):
+    return [df.iloc[start:start + size] for start in range(0, len(df), size)]
+
+
+def _merged(cls, df, parts=3):
+    """Accumulate every part of the chunks in its own state, then merge the states."""
+    chunks = _chunks(df)
+    states = [cls() for _ in range(parts)]
+    for i, chunk in enumerate(chunks):
+        states[i % parts].update(chunk)
+    merged = states[0]
+    for state in states[1:]:
+        merged.merge(state)
+    return merged
+
+
+def _single_pass(cls, df):
+    state = cls()
+    for chunk in _chunks(df):
+        state.update(chunk)
+    return state
+
+
+@pytest.mark.parametrize("cls", [GroupedMoments, DifferentialExpressionAccumulator])
+def test_merged_moments_equal_one_pass(long_df, two_group_df, cls):
+    pd.testing.assert_frame_equal(_merged(cls, two_group_df).finalize(),
+                                  _single_pass(cls, two_group_df).finalize())
+    for mode in ("one_vs_rest", "all_pairs"):
+        pd.testing.assert_frame_equal(_merged(cls, long_df).compare(mode), _single_pass(cls, long_df).compare(mode))
+
+
+def test_merged_rank_sketch_equals_one_pass(two_group_df):
+    pd.testing.assert_frame_equal(_merged(GroupedRankSketch, two_group_df).finalize(),
+                                  _single_pass(GroupedRankSketch, two_group_df).finalize())
+
+
+def test_accumulator_matches_in_memory_functions(long_df, two_group_df):
+    result = _merged(DifferentialExpressionAccumulator, two_group_df).finalize()
+    expected = differential_expression(two_group_df, auc=True).sort_values("protein_group", ignore_index=True)
+    pd.testing.assert_frame_equal(result[expected.columns], expected, check_dtype=False)
+
+    ranks = _merged(GroupedRankSketch, two_group_df).finalize()
+    expected_auc = grouped_auc(two_group_df).sort_values("protein_group", ignore_index=True)
+    np.testing.assert_allclose(ranks["auc"], expected_auc["auc"])
+
+    for mode in ("one_vs_rest", "all_pairs"):
+        pd.testing.assert_frame_equal(
+            _merged(GroupedMoments, long_df).compare(mode),
+            multi_group_differential_expression(long_df, mode=mode),
+            check_dtype=False,
+        )
+
+
+def test_saved_state_round_trips(two_group_df, tmp_path):
+    state = _merged(DifferentialExpressionAccumulator, two_group_df)
+    path = str(tmp_path / "state.npz")
+    state.save(path)
+
+    loaded = DifferentialExpressionAccumulator.load(path)
+
+    pd.testing.assert_frame_equal(loaded.finalize(), state.finalize())
@@ -0,0 +1,117 @@
+import threading
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from nextgen.chat.artifacts import ArtifactStore
+
+
+def _key(path):
+    return Path(path).parent.name
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ArtifactStore(str(tmp_path / "artifacts"), quota_bytes=10 * 1024 * 1024, ttl=3600)
+
+
+def test_same_content_is_stored_once(store, tmp_path, make_frame):
+    first = store.put_dataframe(make_frame(10), "a.parquet", "s1")
+    second = store.put_dataframe(make_frame(10), "b.parquet", "s2")
+    assert first == second
+    pd.testing.assert_frame_equal(pd.read_parquet(first), make_frame(10))
+
+    source = tmp_path / "raw.csv"
+    source.write_text("x\n1\n")
+    path = store.put_file(str(source), session_id="s1")
+    copy = tmp_path / "copy.csv"
+    copy.write_text("x\n1\n")
+    assert store.put_file(str(copy), "other.csv", "s2") == path
+    assert not source.exists() and not copy.exists()
+    assert len(list(store.root.iterdir())) == 2
+
+
+def test_derived_files_are_written_once(store, make_frame):
+    source = store.put_dataframe(make_frame(10), "a.parquet", "s1")
+    calls = []
+
+    def write(src, target):
+        calls.append(src)
+        make_frame(10).to_csv(target, index=False)
+
+    first = store.put_derived(source, "csv", "a.csv", write, "s1")
+    assert store.put_derived(source, "csv", "a.csv", write, "s2") == first
+    assert calls == [source]
+    assert pd.read_csv(first).equals(make_frame(10))
+
+
+def test_unreferenced_artifacts_are_evicted_first(store, make_frame):
+    referenced = store.put_dataframe(make_frame(1000), "a.parquet", "s1")
+    released = store.put_dataframe(make_frame(1000, 1000), "b.parquet", "s1")
+    store.release(released, "s1")
+    newest = store.put_dataframe(make_frame(1000, 2000), "c.parquet", "s1")
+
+    store.quota_bytes = store.total_bytes - 1
+    assert store.evict() == 1
+
+    assert store._lookup(_key(referenced), None) == referenced
+    assert store._lookup(_key(released), None) is None
+    assert store._lookup(_key(newest), None) == newest
+
+
+def test_release_session_drops_its_references(store, make_frame):
+    path = store.put_dataframe(make_frame(10), "a.parquet", "s1")
+    store.put_dataframe(make_frame(10), "a.parquet", "s2")
+    store.release_session("s1")
+    assert set(store._artifacts[_key(path)].refs) == {"s2"}
+
+
+def test_expired_artifacts_are_evicted(store, make_frame):
+    path = store.put_dataframe(make_frame(10), "a.parquet", "s1")
+    store.ttl = -1
+    store.evict()
+    assert store._lookup(_key(path), "s1") is None
+    assert not list(store.root.iterdir())
+
+
+def test_files_of_an_earlier_store_are_adopted(store, make_frame):
+    path = store.put_dataframe(make_frame(10), "a.parquet", "s1")
+    (store.root / ".leftover.tmp").write_bytes(b"partial")
+
+    reopened = ArtifactStore(str(store.root))
+
+    assert reopened.put_dataframe(make_frame(10), "a.parquet") == path
+    assert not (store.root / ".leftover.tmp").exists()
+
+
+def test_concurrent_writes_and_evictions_keep_registered_files(store, make_frame):
+    store.quota_bytes = 0
+    paths, errors = [], []
+
+    def put(offset):
+        try:
+            paths.append(store.put_dataframe(make_frame(100, offset % 5), "a.parquet", "s1"))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=put, args=(i,)) for i in range(40)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert len(paths) == 40
+    assert not list(store.root.glob(".*.tmp"))
+
+
+def test_release_drops_the_references_of_derived_files(store, make_frame):
+    source = store.put_dataframe(make_frame(10), "a.parquet", "s1")
+    derived = store.put_derived(source, "csv", "a.csv", lambda src, target: make_frame(10).to_csv(target), "s1")
+    store.put_derived(source, "csv", "a.csv", lambda src, target: None, "s1")
+
+    store.release(source, "s1")
+
+    assert not store._artifacts[_key(source)].refs
+    assert not store._artifacts[_key(derived)].refs
@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import mannwhitneyu
+from sklearn.metrics import roc_auc_score
+
+from nextgen.analysis import grouped_auc
+
+
+def _per_protein(df):
+    rows = []
+    for protein, group in df.dropna().groupby("protein_group"):
+        positive = (group["cancer_type"] == "breast").to_numpy()
+        values = group["intensity"].to_numpy()
+        u_stat, p_val = mannwhitneyu(values[positive], values[~positive], method="asymptotic")
+        rows.append({"protein_group": protein, "auc": roc_auc_score(positive, values),
+                     "mann_whitney_u": u_stat, "mann_whitney_p_val": p_val})
+    return pd.DataFrame(rows)
+
+
+@pytest.mark.parametrize("ties", [False, True])
+def test_matches_sklearn_and_scipy(two_group_df, ties):
+    if ties:
+        two_group_df["intensity"] = np.round(np.log2(two_group_df["intensity"]))
+
+    result = grouped_auc(two_group_df)
+
+    pd.testing.assert_frame_equal(result.sort_values("protein_group", ignore_index=True),
+                                  _per_protein(two_group_df), check_dtype=False)
+
+
+def test_proteins_missing_from_a_group_are_skipped(two_group_df):
+    df = two_group_df[~((two_group_df["protein_group"] == "P00") & (two_group_df["cancer_type"] == "gastric"))]
+    assert "P00" not in set(grouped_auc(df)["protein_group"])
+
+
+def test_first_group_is_the_positive_class(two_group_df):
+    forward = grouped_auc(two_group_df, groups=["breast", "gastric"])
+    backward = grouped_auc(two_group_df, groups=["gastric", "breast"])
+    np.testing.assert_allclose(forward["auc"], 1 - backward["auc"])
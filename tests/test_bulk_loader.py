@@ -0,0 +1,23 @@
+import sqlite3
+
+import pytest
+
+from bulk_loader import bulk_load_pragmas
+
+
+def test_failed_bulk_load_is_rolled_back(tmp_path):
+    conn = sqlite3.connect(tmp_path / "nextgen.db")
+    conn.execute("CREATE TABLE measurement (id INTEGER PRIMARY KEY, intensity REAL)")
+    conn.commit()
+
+    with pytest.raises(RuntimeError):
+        with bulk_load_pragmas(conn):
+            conn.execute("PRAGMA cache_size = 1")
+            conn.executemany("INSERT INTO measurement (intensity) VALUES (?)",
+                             ((float(i),) for i in range(50_000)))
+            raise RuntimeError("load failed")
+
+    assert conn.execute("SELECT COUNT(*) FROM measurement").fetchone()[0] == 0
+    assert conn.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+    conn.close()
@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import ttest_ind
+
+from nextgen.analysis import differential_expression, multi_group_differential_expression
+
+
+def _per_protein(df, equal_var):
+    rows = []
+    for protein, group in df.dropna().groupby("protein_group"):
+        first = group.loc[group["cancer_type"] == "breast", "intensity"]
+        second = group.loc[group["cancer_type"] == "gastric", "intensity"]
+        t_stat, p_val = ttest_ind(first, second, equal_var=equal_var)
+        rows.append({
+            "protein_group": protein,
+            "mean_intensity_breast": first.mean(),
+            "mean_intensity_gastric": second.mean(),
+            "log2_fold_change": np.log2(first.mean() / second.mean()),
+            "number_of_samples_breast": len(first),
+            "number_of_samples_gastric": len(second),
+            "t_stat": t_stat,
+            "p_val": p_val,
+        })
+    return pd.DataFrame(rows)
+
+
+@pytest.mark.parametrize("equal_var", [True, False])
+def test_matches_per_protein_t_tests(two_group_df, equal_var):
+    result = differential_expression(two_group_df, equal_var=equal_var, p_adjust=None)
+
+    expected = _per_protein(two_group_df, equal_var)
+    pd.testing.assert_frame_equal(result.sort_values("protein_group", ignore_index=True), expected,
+                                  check_dtype=False)
+
+
+def test_proteins_with_too_few_samples_are_skipped(two_group_df):
+    df = two_group_df[~((two_group_df["protein_group"] == "P00") & (two_group_df["cancer_type"] == "breast"))]
+    df = pd.concat([df, two_group_df[(two_group_df["protein_group"] == "P00")
+                                     & (two_group_df["cancer_type"] == "breast")].head(1)])
+
+    result = differential_expression(df)
+
+    assert "P00" not in set(result["protein_group"])
+    assert "P00" in set(differential_expression(df, min_samples=1)["protein_group"])
+
+
+def test_groups_select_and_order_the_comparison(long_df):
+    result = differential_expression(long_df, groups=["lung", "breast"])
+    assert "mean_intensity_lung" in result.columns
+    expected = differential_expression(long_df[long_df["cancer_type"] != "gastric"])
+    np.testing.assert_allclose(result["t_stat"], -expected["t_stat"])
+
+    with pytest.raises(ValueError):
+        differential_expression(long_df)
+    with pytest.raises(ValueError):
+        differential_expression(long_df, groups=["breast"])
+
+
+def test_one_vs_rest_compares_every_group_with_the_others(long_df):
+    result = multi_group_differential_expression(long_df, mode="one_vs_rest")
+
+    assert list(result["group1"].cat.categories) == ["breast", "gastric", "lung", "rest"]
+    assert result.groupby(["group1", "group2"], observed=True).size().to_dict() == {
+        ("breast", "rest"): 40, ("gastric", "rest"): 40, ("lung", "rest"): 40,
+    }
+    relabelled = long_df.assign(cancer_type=np.where(long_df["cancer_type"] == "gastric", "gastric", "rest"))
+    expected = differential_expression(relabelled, groups=["gastric", "rest"])
+    gastric = result[result["group1"] == "gastric"].reset_index(drop=True)
+    np.testing.assert_allclose(gastric["t_stat"], expected["t_stat"])
+    np.testing.assert_allclose(gastric["q_val"], expected["q_val"])
+
+
+def test_all_pairs_compares_every_pair_once(long_df):
+    result = multi_group_differential_expression(long_df, mode="all_pairs")
+
+    assert result.groupby(["group1", "group2"], observed=True).size().to_dict() == {
+        ("breast", "gastric"): 40, ("breast", "lung"): 40, ("gastric", "lung"): 40,
+    }
+    expected = differential_expression(long_df, groups=["breast", "lung"])
+    pair = result[(result["group1"] == "breast") & (result["group2"] == "lung")].reset_index(drop=True)
+    np.testing.assert_allclose(pair["t_stat"], expected["t_stat"])
+    np.testing.assert_allclose(pair["number_of_samples_group2"], expected["number_of_samples_lung"])
+
+    with pytest.raises(ValueError):
+        multi_group_differential_expression(long_df, mode="pairs")
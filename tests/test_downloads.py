@@ -0,0 +1,58 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+import pytest
+
+from nextgen.chat.downloads import DOWNLOAD_FORMATS, ParquetFrameWriter, write_download
+
+
+@pytest.fixture
+def streamed_result(tmp_path):
+    """A result written in chunks whose categorical columns have different categories."""
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        # Sorted protein groups, so every chunk holds different categories
+        "protein_group": [f"P{i // 150}" for i in range(1000)],
+        "run": rng.choice(["IPAS_0", "IPAS_1"], 1000),
+        "intensity": rng.random(1000),
+        "genes": pd.array(["G1,G2"] * 1000, dtype="string"),
+    })
+    path = tmp_path / "raw_data.parquet"
+    with ParquetFrameWriter(str(path)) as writer:
+        for start in range(0, len(df), 300):
+            chunk = df.iloc[start:start + 300]
+            writer.write(chunk.assign(protein_group=chunk["protein_group"].astype("category"),
+                                      run=chunk["run"].astype("category")))
+    assert pq.ParquetFile(path).num_row_groups > 1
+    return df, path
+
+
+def _read(path, fmt):
+    if fmt == "feather":
+        return feather.read_feather(path)
+    compression = {"csv": None, "csv.gz": "gzip", "csv.zst": "zstd"}[fmt]
+    with pa.input_stream(str(path), compression=compression) as stream:
+        return pd.read_csv(io.BytesIO(stream.read()))
+
+
+@pytest.mark.parametrize("fmt", [fmt for fmt in DOWNLOAD_FORMATS if fmt != "parquet"])
+def test_download_formats_round_trip(streamed_result, tmp_path, fmt):
+    df, source = streamed_result
+    target = tmp_path / f"out{DOWNLOAD_FORMATS[fmt][1]}"
+
+    write_download(str(source), fmt, str(target), batch_size=128)
+
+    result = _read(target, fmt)
+    for col in ("protein_group", "run", "genes"):
+        assert result[col].astype(str).tolist() == df[col].astype(str).tolist()
+    np.testing.assert_allclose(result["intensity"].to_numpy(), df["intensity"].to_numpy())
+
+
+def test_parquet_is_not_a_derived_format(streamed_result, tmp_path):
+    _, source = streamed_result
+    with pytest.raises(ValueError):
+        write_download(str(source), "parquet", str(tmp_path / "out.parquet"))
@@ -0,0 +1,45 @@
+import pandas as pd
+import pytest
+
+from export_duckdb import export_duckdb
+from nextgen.vanna.engines import DuckDBRunner, SQLiteRunner
+
+pytest.importorskip("duckdb")
+
+QUERIES = [
+    "SELECT protein_group, run, intensity FROM measurement",
+    """
+    SELECT m.protein_group, s.cancer_type, COUNT(*) AS n, AVG(m.intensity) AS mean_intensity
+    FROM measurement m JOIN sample s ON s.run = m.run
+    WHERE s.cancer_type IN ('breast', 'lung')
+    GROUP BY m.protein_group, s.cancer_type
+    """,
+    "SELECT cancer_type, COUNT(*) AS n_runs FROM sample GROUP BY cancer_type",
+]
+
+
+@pytest.fixture
+def duckdb_file(nextgen_db, tmp_path):
+    path = str(tmp_path / "nextgen.duckdb")
+    assert export_duckdb(nextgen_db, path)
+    return path
+
+
+def _sorted(df):
+    df = df.astype({col: str for col in df.columns if not pd.api.types.is_numeric_dtype(df[col])})
+    return df.sort_values(list(df.columns), ignore_index=True)
+
+
+@pytest.mark.parametrize("sql", QUERIES)
+def test_duckdb_copy_returns_the_sqlite_result(nextgen_db, duckdb_file, sql):
+    expected = SQLiteRunner(nextgen_db)(sql)
+    result = DuckDBRunner(duckdb_file, read_only=True)(sql)
+
+    assert len(expected)
+    pd.testing.assert_frame_equal(_sorted(result), _sorted(expected), check_dtype=False)
+
+
+def test_streamed_chunks_equal_the_full_result(nextgen_db, duckdb_file):
+    for runner in (SQLiteRunner(nextgen_db), DuckDBRunner(duckdb_file, read_only=True)):
+        streamed = pd.concat(runner.stream(QUERIES[0], chunk_size=7), ignore_index=True)
+        pd.testing.assert_frame_equal(_sorted(streamed), _sorted(runner(QUERIES[0])), check_dtype=False)
@@ -0,0 +1,41 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from export_parquet import export_parquet
+from nextgen.vanna.engines import MEASUREMENT_PARTITION_COLUMN, DuckDBRunner, parquet_views
+
+pytest.importorskip("duckdb")
+
+
+@pytest.fixture
+def parquet_dir(nextgen_db, tmp_path):
+    path = tmp_path / "parquet"
+    assert export_parquet(nextgen_db, str(path))
+    return path
+
+
+def test_every_partition_is_written_once(parquet_dir):
+    files = sorted(p.relative_to(parquet_dir / "measurement").as_posix()
+                   for p in (parquet_dir / "measurement").rglob("*.parquet"))
+    assert files == [f"{MEASUREMENT_PARTITION_COLUMN}={cancer_type}/part-0.parquet"
+                     for cancer_type in ("breast", "gastric", "lung")]
+
+
+def test_view_matches_sqlite_and_prunes_partitions(nextgen_db, parquet_dir):
+    with sqlite3.connect(nextgen_db) as conn:
+        expected = pd.read_sql(
+            "SELECT m.*, s.cancer_type FROM measurement m JOIN sample s ON s.run = m.run", conn
+        )
+    conn.close()
+    runner = DuckDBRunner(init_sql=parquet_views(str(parquet_dir)))
+
+    result = runner("SELECT * FROM measurement")
+    assert list(result.columns) == [*expected.columns[:-1], MEASUREMENT_PARTITION_COLUMN]
+    assert (result[MEASUREMENT_PARTITION_COLUMN].astype(str)
+            == result["run"].astype(str).map(expected.groupby("run")["cancer_type"].first())).all()
+    assert len(result) == len(expected)
+
+    plan = runner(f"EXPLAIN ANALYZE SELECT COUNT(*) FROM measurement WHERE {MEASUREMENT_PARTITION_COLUMN} = 'lung'")
+    assert "Scanning Files: 1/3" in plan.iloc[0, 1]
@@ -0,0 +1,71 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from add_measurement_table import add_measurement_table
+from add_sample_table import add_sample_table
+from ingest_runs import ingest_runs
+
+
+@pytest.fixture
+def batches(tmp_path, make_measurements, make_samples):
+    """Two batches of runs; the second adds runs and changes R2, the first's last run."""
+    first = make_measurements(["R0", "R1", "R2"], seed=0)
+    second = make_measurements(["R2", "R3", "R4"], seed=1)
+    paths = {}
+    for name, df in [("m1", first), ("m2", second),
+                     ("all", pd.concat([first[first["Run"] != "R2"], second]))]:
+        paths[name] = tmp_path / f"{name}.csv"
+        df.to_csv(paths[name], index=False)
+    for name, runs in [("s1", ["R0", "R1", "R2"]), ("s2", ["R2", "R3", "R4"]),
+                       ("s_all", ["R0", "R1", "R2", "R3", "R4"])]:
+        paths[name] = tmp_path / f"{name}.csv"
+        make_samples(runs).to_csv(paths[name], index=False)
+    return {name: str(path) for name, path in paths.items()}
+
+
+def _contents(db_file):
+    with sqlite3.connect(db_file) as conn:
+        measurement = pd.read_sql(
+            "SELECT protein_group, run, citrullination_r, intensity FROM measurement", conn
+        ).sort_values(["run", "protein_group"], ignore_index=True)
+        stats = pd.read_sql(
+            "SELECT * FROM protein_group_stats WHERE n > 0", conn
+        ).sort_values(["protein_group", "cancer_type"], ignore_index=True)
+        cancer_types = pd.read_sql("SELECT * FROM cancer_type_runs", conn).sort_values("cancer_type", ignore_index=True)
+    conn.close()
+    return measurement, stats, cancer_types
+
+
+def _build(db_file, measurement_csv, sample_csv):
+    assert add_measurement_table(db_file, measurement_csv)
+    assert add_sample_table(db_file, sample_csv)
+
+
+def test_incremental_ingest_equals_full_rebuild(batches, tmp_path):
+    incremental = str(tmp_path / "incremental.db")
+    assert ingest_runs(incremental, batches["m1"], batches["s1"])
+    assert ingest_runs(incremental, batches["m2"], batches["s2"])
+
+    full = str(tmp_path / "full.db")
+    _build(full, batches["all"], batches["s_all"])
+
+    for got, expected in zip(_contents(incremental), _contents(full)):
+        pd.testing.assert_frame_equal(got, expected, check_dtype=False)
+
+
+def test_ingest_after_rebuild_is_a_no_op(batches, tmp_path, capsys):
+    db_file = str(tmp_path / "nextgen.db")
+    _build(db_file, batches["all"], batches["s_all"])
+    with sqlite3.connect(db_file) as conn:
+        rows_before = conn.execute("SELECT COUNT(*), MAX(rowid) FROM measurement_data").fetchone()
+    conn.close()
+    capsys.readouterr()
+
+    assert ingest_runs(db_file, batches["all"], batches["s_all"])
+
+    assert "Found 5 runs, 0 new or changed" in capsys.readouterr().out
+    with sqlite3.connect(db_file) as conn:
+        assert conn.execute("SELECT COUNT(*), MAX(rowid) FROM measurement_data").fetchone() == rows_before
+    conn.close()
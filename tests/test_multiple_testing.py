@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import false_discovery_control
+
+from nextgen.analysis import add_q_values, adjust_p_values
+from nextgen.analysis.multiple_testing import benjamini_hochberg, bonferroni
+
+
+@pytest.fixture
+def p_vals():
+    rng = np.random.default_rng(0)
+    p_vals = np.concatenate([rng.uniform(0, 1e-3, 20), rng.uniform(0, 1, 180)])
+    p_vals[[3, 50, 51]] = np.nan
+    p_vals[[10, 11]] = p_vals[12]
+    return p_vals
+
+
+def test_benjamini_hochberg_matches_scipy(p_vals):
+    tested = ~np.isnan(p_vals)
+    q_vals = benjamini_hochberg(p_vals)
+
+    np.testing.assert_allclose(q_vals[tested], false_discovery_control(p_vals[tested]))
+    assert np.isnan(q_vals[~tested]).all()
+    assert np.isnan(benjamini_hochberg([np.nan, np.nan])).all()
+
+
+def test_bonferroni_counts_tested_p_values_only(p_vals):
+    tested = ~np.isnan(p_vals)
+    q_vals = bonferroni(p_vals)
+
+    np.testing.assert_allclose(q_vals[tested], np.minimum(p_vals[tested] * tested.sum(), 1))
+    assert np.isnan(q_vals[~tested]).all()
+
+
+def test_adjust_p_values_rejects_unknown_methods(p_vals):
+    np.testing.assert_array_equal(adjust_p_values(p_vals, "bonferroni"), bonferroni(p_vals))
+    with pytest.raises(ValueError):
+        adjust_p_values(p_vals, "holm")
+
+
+def test_add_q_values_adjusts_every_family_on_its_own(p_vals):
+    result = pd.DataFrame({"comparison": np.repeat(["a", "b"], 100), "p_val": p_vals, "auc": 0.5})
+
+    add_q_values(result, by="comparison")
+
+    assert list(result.columns) == ["comparison", "p_val", "q_val", "auc"]
+    for name, family in result.groupby("comparison"):
+        tested = family["p_val"].notna()
+        np.testing.assert_allclose(family.loc[tested, "q_val"], false_discovery_control(family.loc[tested, "p_val"]))
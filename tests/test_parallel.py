@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import mannwhitneyu
+
+from nextgen.analysis import ProteinShardExecutor, mann_whitney_exact
+from nextgen.analysis.parallel import START_METHOD, mann_whitney_exact_shard, shared_executor
+
+
+@pytest.fixture
+def shard_df(two_group_df):
+    """``two_group_df`` with tied intensities in P00 and P01 measured in breast only."""
+    df = two_group_df.copy()
+    ties = df["protein_group"] == "P00"
+    df.loc[ties, "intensity"] = 2.0 ** np.round(np.log2(df.loc[ties, "intensity"]))
+    return df[~((df["protein_group"] == "P01") & (df["cancer_type"] == "gastric"))]
+
+
+def _per_protein(df):
+    rows = []
+    for protein, group in df.dropna().groupby("protein_group"):
+        first = group.loc[group["cancer_type"] == "breast", "intensity"].to_numpy()
+        second = group.loc[group["cancer_type"] == "gastric", "intensity"].to_numpy()
+        if len(first) and len(second):
+            method = "exact" if group["intensity"].is_unique else "auto"
+            u_stat, p_val = mannwhitneyu(first, second, method=method)
+            rows.append({"protein_group": protein, "mann_whitney_u": u_stat, "mann_whitney_p_val": p_val})
+    return pd.DataFrame(rows)
+
+
+def test_sharded_equals_serial(shard_df):
+    serial = mann_whitney_exact(shard_df, max_workers=1)
+    sharded = mann_whitney_exact(shard_df, max_workers=2)
+
+    pd.testing.assert_frame_equal(sharded, serial)
+    assert "P01" not in set(serial["protein_group"])
+    expected = _per_protein(shard_df)
+    pd.testing.assert_frame_equal(serial[expected.columns], expected, check_dtype=False)
+
+
+def test_executor_is_reused_across_calls(shard_df):
+    with ProteinShardExecutor(max_workers=2, shards_per_worker=3) as executor:
+        first = executor.map(mann_whitney_exact_shard, shard_df, alternative="greater")
+        pool = executor._pool
+        second = executor.map(mann_whitney_exact_shard, shard_df, alternative="greater")
+        assert executor._pool is pool
+    assert executor._pool is None
+
+    pd.testing.assert_frame_equal(first, second)
+    pd.testing.assert_frame_equal(first, mann_whitney_exact(shard_df, alternative="greater", max_workers=1))
+
+
+def test_two_groups_are_required(long_df):
+    with pytest.raises(ValueError):
+        mann_whitney_exact(long_df, max_workers=1)
+
+
+def test_shared_executor_keeps_a_forkserver_pool(two_group_df):
+    mann_whitney_exact(two_group_df, max_workers=2)
+    executor = shared_executor(2)
+    pool = executor._pool
+
+    mann_whitney_exact(two_group_df, max_workers=2)
+
+    assert shared_executor(2) is executor and executor._pool is pool
+    assert pool._mp_context.get_start_method() == START_METHOD
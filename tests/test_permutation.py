@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from nextgen.analysis import differential_expression, permutation_test
+
+
+@pytest.fixture
+def shifted_df(two_group_df):
+    """``two_group_df`` with the breast intensities of P00 above all others, so only P00 differs."""
+    shifted = (two_group_df["protein_group"] == "P00") & (two_group_df["cancer_type"] == "breast")
+    two_group_df.loc[shifted, "intensity"] += two_group_df["intensity"].max()
+    return two_group_df
+
+
+def test_statistic_matches_t_test(shifted_df):
+    result = permutation_test(shifted_df, n_permutations=200, seed=0)
+    expected = differential_expression(shifted_df).sort_values("protein_group", ignore_index=True)
+
+    pd.testing.assert_series_equal(result["protein_group"], expected["protein_group"], check_dtype=False)
+    np.testing.assert_allclose(result["statistic"], expected["t_stat"], rtol=1e-9)
+    for column in ("number_of_samples_breast", "number_of_samples_gastric"):
+        np.testing.assert_array_equal(result[column], expected[column])
+
+
+def test_same_seed_gives_same_result(shifted_df):
+    first = permutation_test(shifted_df, n_permutations=500, seed=1)
+    pd.testing.assert_frame_equal(permutation_test(shifted_df, n_permutations=500, seed=1), first)
+    # One protein per shard and one permutation per part give the same permutations
+    small_batches = permutation_test(shifted_df, n_permutations=500, seed=1, max_batch_bytes=1)
+    pd.testing.assert_frame_equal(small_batches, first)
+
+
+def test_strong_effect_is_significant_and_null_proteins_stop_early(shifted_df):
+    result = permutation_test(shifted_df, n_permutations=2000, seed=0, stop_exceedances=10)
+    result = result.set_index("protein_group")
+
+    assert result.loc["P00", "n_permutations"] == 2000
+    assert result.loc["P00", "perm_p_val"] < 1e-3
+    stopped = result[result["n_permutations"] < 2000]
+    assert len(stopped) > 10
+    assert (stopped["exceedances"] >= 10).all()
+    np.testing.assert_allclose(stopped["perm_p_val"], stopped["exceedances"] / stopped["n_permutations"])
+
+
+def test_invalid_input_raises(shifted_df):
+    with pytest.raises(ValueError):
+        permutation_test(shifted_df, statistic="median")
+
+    shifted_df.loc[0, "cancer_type"] = "gastric" if shifted_df.loc[0, "cancer_type"] == "breast" else "breast"
+    with pytest.raises(ValueError):
+        permutation_test(shifted_df)
+
+
+def test_sharded_equals_serial(shifted_df):
+    serial = permutation_test(shifted_df, n_permutations=300, seed=2, max_workers=1)
+    sharded = permutation_test(shifted_df, n_permutations=300, seed=2, max_workers=2)
+
+    pd.testing.assert_frame_equal(sharded, serial)
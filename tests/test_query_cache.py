@@ -0,0 +1,135 @@
+import os
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from nextgen.vanna.query_cache import QueryCache
+
+SQL = "SELECT * FROM measurement"
+
+
+@pytest.fixture
+def db_file(tmp_path):
+    path = tmp_path / "nextgen.db"
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE measurement (protein_group TEXT, intensity REAL)")
+    conn.close()
+    return str(path)
+
+
+def _touch(db_file):
+    with sqlite3.connect(db_file) as conn:
+        conn.execute("INSERT INTO measurement VALUES ('P0', 1.0)")
+    conn.close()
+
+
+def test_sql_and_result_round_trip(db_file, tmp_path, make_frame):
+    cache = QueryCache(db_file, str(tmp_path / "cache"))
+    cache.set_sql("How many  Proteins?", SQL)
+    cache.set_result(SQL, make_frame(10))
+
+    assert cache.get_sql("how many proteins?") == SQL
+    pd.testing.assert_frame_equal(cache.get_result(SQL), make_frame(10))
+    streamed = pd.concat(cache.iter_result(SQL, chunk_size=3), ignore_index=True)
+    pd.testing.assert_frame_equal(streamed, make_frame(10), check_dtype=False)
+
+
+def test_streamed_result_is_cached_on_commit_only(db_file, tmp_path, make_frame):
+    cache = QueryCache(db_file, str(tmp_path / "cache"))
+    writer = cache.result_writer(SQL)
+    writer.write(make_frame(5))
+    writer.abort()
+    assert cache.get_result(SQL) is None
+
+    writer = cache.result_writer(SQL)
+    for offset in (0, 5):
+        writer.write(make_frame(5, offset))
+    writer.commit()
+    pd.testing.assert_frame_equal(cache.get_result(SQL), make_frame(10), check_dtype=False)
+    assert not list(cache.results_dir.glob("*.tmp"))
+
+
+def test_database_change_deletes_stale_entries_and_files(db_file, tmp_path, make_frame):
+    cache = QueryCache(db_file, str(tmp_path / "cache"))
+    cache.set_sql("question", SQL)
+    cache.set_result(SQL, make_frame(10))
+    assert len(list(cache.results_dir.iterdir())) == 1
+
+    _touch(db_file)
+
+    assert cache.get_sql("question") is None
+    assert cache.get_result(SQL) is None
+    assert not list(cache.results_dir.iterdir())
+
+
+def test_result_of_a_changed_database_is_not_cached(db_file, tmp_path, make_frame):
+    cache = QueryCache(db_file, str(tmp_path / "cache"))
+    writer = cache.result_writer(SQL)
+    writer.write(make_frame(5))
+    _touch(db_file)
+    writer.commit()
+
+    assert cache.get_result(SQL) is None
+    assert not list(cache.results_dir.iterdir())
+
+
+def test_caches_of_different_data_share_a_directory(db_file, tmp_path, make_frame):
+    other_db = str(tmp_path / "other.db")
+    sqlite3.connect(other_db).close()
+    cache = QueryCache(db_file, str(tmp_path / "cache"))
+    other = QueryCache(other_db, str(tmp_path / "cache"))
+    cache.set_result(SQL, make_frame(3))
+    other.set_result(SQL, make_frame(4))
+
+    assert len(cache.get_result(SQL)) == 3
+    assert len(other.get_result(SQL)) == 4
+
+
+def test_results_are_evicted_least_recently_used_first(db_file, tmp_path, make_frame):
+    cache = QueryCache(db_file, str(tmp_path / "cache"))
+    cache.set_result("SELECT 1", make_frame(100))
+    size = os.path.getsize(next(cache.results_dir.iterdir()))
+    cache.max_bytes = int(2.5 * size)
+    cache.set_result("SELECT 2", make_frame(100, 1))
+    assert cache.get_result("SELECT 1") is not None
+    cache.set_result("SELECT 3", make_frame(100, 2))
+
+    assert cache.get_result("SELECT 1") is not None
+    assert cache.get_result("SELECT 2") is None
+    assert cache.get_result("SELECT 3") is not None
+    assert len(list(cache.results_dir.iterdir())) == 2
+
+
+def test_questions_are_bounded(db_file, tmp_path):
+    cache = QueryCache(db_file, str(tmp_path / "cache"), max_questions=2)
+    for i in range(3):
+        cache.set_sql(f"question {i}", f"SELECT {i}")
+
+    assert cache.get_sql("question 0") is None
+    assert cache.get_sql("question 2") == "SELECT 2"
+
+
+def test_set_result_replaces_the_file_atomically(db_file, tmp_path, make_frame):
+    cache = QueryCache(db_file, str(tmp_path / "cache"))
+    cache.set_result(SQL, make_frame(10))
+    reader = cache.iter_result(SQL, chunk_size=4)
+    cache.set_result(SQL, make_frame(10, 10))
+
+    pd.testing.assert_frame_equal(pd.concat(reader, ignore_index=True), make_frame(10), check_dtype=False)
+    pd.testing.assert_frame_equal(cache.get_result(SQL), make_frame(10, 10))
+    assert not list(cache.results_dir.glob("*.tmp"))
+
+
+def test_dataset_fingerprint_is_reused_within_its_ttl(tmp_path, make_frame):
+    dataset = tmp_path / "measurement"
+    dataset.mkdir()
+    make_frame(3).to_parquet(dataset / "part-0.parquet")
+    cache = QueryCache(str(dataset), str(tmp_path / "cache"), dataset_ttl=3600)
+    cache.set_result(SQL, make_frame(3))
+
+    make_frame(4).to_parquet(dataset / "part-1.parquet")
+    assert cache.get_result(SQL) is not None
+
+    cache.dataset_ttl = 0
+    assert cache.get_result(SQL) is None